@@ -0,0 +1,383 @@
+import argparse
+import os
+import sys
+import json
+import time
+import random
+import platform
+import statistics
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from PIL import Image, ImageDraw
+
+
+DEFAULT_NUM_PAGES = 200
+DEFAULT_PAGE_SIZE = (2480, 3508)  # A4 at 300 dpi, like the pages converted by pdftopng
+DEFAULT_NUM_ANNOTATIONS_PER_PAGE = 3
+DEFAULT_NUM_BOOKMARKS = 100
+DEFAULT_NUM_RUNS = 5
+DEFAULT_NUM_SCROLL_EVENTS = 300
+DEFAULT_NUM_ARROW_PRESSES = 100
+DEFAULT_WINDOW_GEOMETRY = "1600x1000"
+
+SCROLL_EVENT_INTERVAL = 16  # milliseconds between the synthetic mouse wheel events, i.e. a fast scroll
+DECODED_PAGES_WAIT_TIMEOUT = 60  # seconds
+XVFB_SCREEN = "1920x1080x24"
+
+_SYNTHETIC_BOOK_INFO_FILE_NAME = "synthetic_book.json"  # in the metadata folder, to reuse an already generated book
+
+
+def make_synthetic_page(page_size, rng):
+    # a white page with grey bars where the lines of text would be, so that the png compresses like a scanned page
+    image = Image.new("L", page_size, 255)
+    draw = ImageDraw.Draw(image)
+    width, height = page_size
+    margin = width // 10
+    line_height = max(height // 60, 4)
+    for y in range(margin, height - margin - line_height, line_height * 2):
+        x = margin
+        while x < width - margin:
+            word_width = rng.randint(line_height, line_height * 6)
+            draw.rectangle((x, y, min(x + word_width, width - margin), y + line_height),
+                           fill=rng.randint(0, 96))
+            x += word_width + line_height
+    return image
+
+
+def make_synthetic_annotations(num_pages, num_annotations_per_page, page_size, rng):
+    # in the layout of annotations.json, see _Annotation.to_list in book_files.py
+    width, height = page_size
+    annotations = dict()
+    for page_num in range(1, num_pages + 1):
+        page_annotations = []
+        for i in range(num_annotations_per_page):
+            x, y = rng.randrange(width), rng.randrange(height)
+            if rng.random() < 0.5:
+                page_annotations.append([x, y, "arr"])
+            else:
+                page_annotations.append([x, y, "txt", f"Note {i} of page {page_num}", "n", "center"])
+        annotations[str(page_num)] = page_annotations
+    return annotations
+
+
+def make_synthetic_bookmarks(num_pages, num_bookmarks, rng):
+    # in the layout of bookmarks.json: indent, title, page number; in the order of the page numbers
+    page_nums = sorted(rng.randint(1, num_pages) for _ in range(num_bookmarks))
+    bookmarks = []
+    for i, page_num in enumerate(page_nums):
+        indent = 0 if i == 0 else rng.randint(0, min(bookmarks[-1][0] + 1, 3))
+        bookmarks.append([indent, f"Section {i + 1}", page_num])
+    return bookmarks
+
+
+def make_synthetic_book(book_folder, num_pages, page_size, num_annotations_per_page, num_bookmarks, seed=0):
+    # the png pages, and, the metadata folder with bookmarks.json and annotations.json
+    # an already generated book with the same parameters is reused, because, making the pages is slow
+    info = {"num_pages": num_pages, "page_size": list(page_size),
+            "num_annotations_per_page": num_annotations_per_page, "num_bookmarks": num_bookmarks, "seed": seed}
+    metadata_folder = os.path.join(book_folder, "metadata")
+    info_file_path = os.path.join(metadata_folder, _SYNTHETIC_BOOK_INFO_FILE_NAME)
+    try:
+        with open(info_file_path) as f:
+            if json.loads(f.read()) == info:
+                print("Reusing the synthetic book at", book_folder)
+                return book_folder
+    except (IOError, json.JSONDecodeError):
+        pass
+
+    print("Making a synthetic book at", book_folder)
+    os.makedirs(metadata_folder, exist_ok=True)
+    for file_name in os.listdir(metadata_folder):  # the thumbnails, pyramid etc. of a previously generated book
+        file_path = os.path.join(metadata_folder, file_name)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+    rng = random.Random(seed)
+    for page_num in range(1, num_pages + 1):
+        make_synthetic_page(page_size, rng).save(os.path.join(book_folder, f'{str(page_num).rjust(6, "0")}.png'))
+        print(f"\rMade {page_num}/{num_pages} pages", end="")
+        sys.stdout.flush()
+    print()
+
+    with open(os.path.join(metadata_folder, "annotations.json"), 'w') as f:
+        f.write(json.dumps(make_synthetic_annotations(num_pages, num_annotations_per_page, page_size, rng), indent=2))
+    with open(os.path.join(metadata_folder, "bookmarks.json"), 'w') as f:
+        f.write(json.dumps(make_synthetic_bookmarks(num_pages, num_bookmarks, rng), indent=2))
+    with open(info_file_path, 'w') as f:
+        f.write(json.dumps(info, indent=2))
+
+    return book_folder
+
+
+def start_xvfb():
+    # starts an X server without a screen, and points DISPLAY to it; returns the process (to be terminated)
+    display_num = 99
+    while os.path.exists(f"/tmp/.X{display_num}-lock"):
+        display_num += 1
+    process = subprocess.Popen(["Xvfb", f":{display_num}", "-screen", "0", XVFB_SCREEN, "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = f":{display_num}"
+    for _ in range(100):  # the server takes a moment to accept connections
+        if os.path.exists(f"/tmp/.X11-unix/X{display_num}"):
+            break
+        time.sleep(0.05)
+    return process
+
+
+def wait_for_decoded_pages(viewer, timeout=DECODED_PAGES_WAIT_TIMEOUT):
+    # runs the tkinter event loop until the pages (and tiles) on canvas are decoded and shown,
+    # so that the timings include the decoding on the worker threads
+    end_time = time.perf_counter() + timeout
+    while len(viewer._page_decode_futures) > 0 or len(viewer._page_tile_decode_futures) > 0:
+        if time.perf_counter() > end_time:
+            print("Warning: Timed out waiting for the pages to be decoded")
+            break
+        viewer.update()
+        time.sleep(0.001)
+    viewer.update()
+
+
+def wait_for_scrolling(viewer, timeout=DECODED_PAGES_WAIT_TIMEOUT):
+    # the scroll events are applied once per frame by the viewer, so, the scrolling goes on after the last event
+    end_time = time.perf_counter() + timeout
+    while viewer._scroll_after_id is not None:
+        if time.perf_counter() > end_time:
+            print("Warning: Timed out waiting for the scrolling to end")
+            break
+        viewer.update()
+        time.sleep(0.001)
+
+
+def wait_for_thumbnails(viewer, timeout=DECODED_PAGES_WAIT_TIMEOUT):
+    # the thumbnails are made once per book, so, they are made before the timings, not to compete for the cores
+    end_time = time.perf_counter() + timeout
+    while viewer._thumbnail_builder is not None and viewer._thumbnail_builder.is_alive():
+        if time.perf_counter() > end_time:
+            print("Warning: Timed out waiting for the thumbnails to be made")
+            break
+        viewer.update()
+        time.sleep(0.01)
+    viewer.update()
+
+
+def summarize(times):
+    return {
+        "runs": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+    }
+
+
+class _Benchmark:
+    # times the viewer's operations on a book; each timing is a list of seconds, one per run
+
+    def __init__(self, viewer, book_folder, num_pages, num_runs, num_scroll_events, num_arrow_presses):
+        self._viewer = viewer
+        self._book_folder = book_folder
+        self._num_pages = num_pages
+        self._num_runs = num_runs
+        self._num_scroll_events = num_scroll_events
+        self._num_arrow_presses = num_arrow_presses
+        self._event_time = 0  # milliseconds, like tkinter's event.time
+        self.timings = dict()
+
+    def _time(self, name, setup, function):
+        times = []
+        for _ in range(self._num_runs):
+            setup()
+            start_time = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start_time)
+        self.timings[name] = summarize(times)
+        print(f"{name}: median {self.timings[name]['median'] * 1000:.1f} ms")
+
+    def _reopen_book(self):
+        # like opening the book from the open-a-book dialog; the book settings are removed so that it opens at page 1
+        self._viewer._save_current_book_and_clear_canvas_and_bookmarks_and_dictionaries()
+        book_settings_file_path = os.path.join(self._book_folder, "metadata", "book_settings.json")
+        if os.path.exists(book_settings_file_path):
+            os.remove(book_settings_file_path)
+        self._viewer._load_book(self._book_folder)
+        wait_for_decoded_pages(self._viewer)
+
+    def _clear_decoded_page_cache(self):
+        self._viewer._decoded_page_cache.clear()
+
+    def _scroll(self, delta):
+        for _ in range(self._num_scroll_events):
+            self._event_time += SCROLL_EVENT_INTERVAL
+            self._viewer._mouse_wheel_in_canvas(SimpleNamespace(delta=delta, time=self._event_time))
+            self._viewer.update()
+        wait_for_scrolling(self._viewer)
+        wait_for_decoded_pages(self._viewer)
+
+    def _cycle_annotations(self, keysym):
+        for _ in range(self._num_arrow_presses):
+            self._viewer._down_or_up_arrow(SimpleNamespace(keysym=keysym))
+            self._viewer.update()
+        wait_for_decoded_pages(self._viewer)
+
+    def run(self):
+        viewer = self._viewer
+
+        # warm up: the thumbnails, and, the os's file cache
+        self._reopen_book()
+        wait_for_thumbnails(viewer)
+
+        self._time("load_book", lambda: None, self._reopen_book)
+        wait_for_thumbnails(viewer)
+
+        middle_page_num = max(self._num_pages // 2, 1)
+
+        def load_page_cold():
+            viewer._load_page(middle_page_num)
+            wait_for_decoded_pages(viewer)
+
+        def setup_load_page_cold():
+            viewer._load_page(1)
+            wait_for_decoded_pages(viewer)
+            self._clear_decoded_page_cache()
+
+        self._time("load_page_cold", setup_load_page_cold, load_page_cold)
+
+        def setup_load_page_warm():
+            viewer._load_page(1)
+            wait_for_decoded_pages(viewer)
+            viewer._load_page(middle_page_num)
+            wait_for_decoded_pages(viewer)
+            viewer._load_page(1)
+            wait_for_decoded_pages(viewer)
+
+        self._time("load_page_warm", setup_load_page_warm, load_page_cold)
+
+        def setup_scroll():
+            viewer._load_page(1)
+            wait_for_decoded_pages(viewer)
+            self._clear_decoded_page_cache()
+
+        self._time("scroll_down", setup_scroll, lambda: self._scroll(-120))
+
+        def setup_scroll_up():
+            viewer._load_page(self._num_pages)
+            wait_for_decoded_pages(viewer)
+            self._clear_decoded_page_cache()
+
+        self._time("scroll_up", setup_scroll_up, lambda: self._scroll(120))
+
+        self._time("cycle_annotations_down", setup_scroll, lambda: self._cycle_annotations("Down"))
+        self._time("cycle_annotations_up", setup_scroll_up, lambda: self._cycle_annotations("Up"))
+
+        self._time("save_annotations", lambda: None, viewer._save_annotations)
+        self._time("compact_annotations_journal", lambda: None, viewer._compact_annotations_journal)
+
+        return self.timings
+
+
+def get_environment():
+    import tkinter
+    import PIL
+    return {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "tk": tkinter.TkVersion,
+    }
+
+
+def compare_with_baseline(timings, baseline_file_path):
+    with open(baseline_file_path) as f:
+        baseline_timings = json.loads(f.read())["timings"]
+    print("\nCompared with", baseline_file_path, "(median, this run / baseline):")
+    for name, timing in timings.items():
+        if name not in baseline_timings:
+            continue
+        ratio = timing["median"] / baseline_timings[name]["median"]
+        print(f"{name}: {ratio:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=""
+        "Benchmarks the viewer's page loading, scrolling, annotation cycling and annotation saving.\n"
+        "A synthetic book is made (png pages, and, the metadata folder with annotations and bookmarks),\n"
+        "and the viewer is driven by calling its event handlers, with the timings written to a json file.\n"
+        "The timings include waiting for the pages to be decoded and shown.\n"
+        "The viewer needs a display; on a machine without one, use --xvfb (or run with xvfb-run).\n"
+        "The gui settings of the viewer are not touched, a temporary settings file is used.\n"
+        "\n"
+        "Command line args:\n\n"
+        "Optional arguments:\n\n"
+        "book_folder: \n"
+        "    Where the synthetic book is made. It is reused in later runs if the book parameters are the same.\n"
+        "    Default: a folder in the temp directory\n\n"
+        "output_json_file_path: \n"
+        "    The results: the book parameters, the environment, and, per operation the time of each run in seconds.\n"
+        "    If not given, the results are only printed.\n\n"
+        "baseline: \n"
+        "    The results of an earlier run, to print the change of the median times.",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-b", "--book_folder", default=os.path.join(tempfile.gettempdir(), "pdf_viewer_benchmark_book"))
+    parser.add_argument("-o", "--output_json_file_path")
+    parser.add_argument("--baseline")
+    parser.add_argument("--num_pages", type=int, default=DEFAULT_NUM_PAGES)
+    parser.add_argument("--page_width", type=int, default=DEFAULT_PAGE_SIZE[0])
+    parser.add_argument("--page_height", type=int, default=DEFAULT_PAGE_SIZE[1])
+    parser.add_argument("--num_annotations_per_page", type=int, default=DEFAULT_NUM_ANNOTATIONS_PER_PAGE)
+    parser.add_argument("--num_bookmarks", type=int, default=DEFAULT_NUM_BOOKMARKS)
+    parser.add_argument("--num_runs", type=int, default=DEFAULT_NUM_RUNS)
+    parser.add_argument("--num_scroll_events", type=int, default=DEFAULT_NUM_SCROLL_EVENTS)
+    parser.add_argument("--num_arrow_presses", type=int, default=DEFAULT_NUM_ARROW_PRESSES)
+    parser.add_argument("--geometry", default=DEFAULT_WINDOW_GEOMETRY)
+    parser.add_argument("--xvfb", action="store_true")
+    args = parser.parse_args()
+
+    make_synthetic_book(args.book_folder, args.num_pages, (args.page_width, args.page_height),
+                        args.num_annotations_per_page, args.num_bookmarks)
+
+    xvfb_process = start_xvfb() if args.xvfb else None
+
+    try:
+        import main as viewer_module  # imported here, after DISPLAY is set
+        settings_folder = tempfile.mkdtemp(prefix="pdf_viewer_benchmark_settings")
+        viewer_module.SETTINGS_FILE_PATH = os.path.join(settings_folder, "settings.json")
+
+        viewer = viewer_module.PdfViewer()
+        viewer.geometry(args.geometry)
+        viewer.update()
+
+        try:
+            timings = _Benchmark(viewer, args.book_folder, args.num_pages, args.num_runs,
+                                 args.num_scroll_events, args.num_arrow_presses).run()
+        finally:
+            viewer.destroy()
+    finally:
+        if xvfb_process is not None:
+            xvfb_process.terminate()
+
+    results = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "book": {"num_pages": args.num_pages, "page_size": [args.page_width, args.page_height],
+                 "num_annotations_per_page": args.num_annotations_per_page, "num_bookmarks": args.num_bookmarks},
+        "parameters": {"num_runs": args.num_runs, "num_scroll_events": args.num_scroll_events,
+                       "num_arrow_presses": args.num_arrow_presses, "geometry": args.geometry},
+        "environment": get_environment(),
+        "timings": timings,
+    }
+
+    if args.output_json_file_path is not None:
+        print("Writing results to", args.output_json_file_path)
+        with open(args.output_json_file_path, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        compare_with_baseline(timings, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
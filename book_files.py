@@ -0,0 +1,192 @@
+import json
+import os
+
+
+# the files of a book, and, its annotations as they are stored in them; this doesn't use tkinter (or PIL), so that the
+# annotations can be read without the viewer, e.g. by export_annotated.py
+# a book is a folder of the png images of the pages, named by page number (see get_page_path), and a metadata folder
+# with the annotations, bookmarks and settings of the book
+
+
+ALLOW_DEBUGGING = False  # like main.py's
+
+
+_COLOR_CHERRY_RED = "#d2042d"
+
+
+ANNOTATION_ARROW_COLOR = _COLOR_CHERRY_RED
+ANNOTATION_ARROW_LENGTH = 100  # pixels
+ANNOTATION_ARROW_WIDTH = 3
+ANNOTATION_ARROW_SHAPE = (8, 10, 3)  # see the shape explanation below
+TAG_ARROW = "arr"
+"""
+arrow shape: (d1, d2, d3)
+The following arrow is pointing to right (like -->)
+         |
+-------------
+         |
+d1 is the horizontal part of the arrow tip
+d2 is the diagonal part of the arrow tip (not drawn above: imagine a digonal line )
+d3 is the vertical part of the arrow tip
+tkinter's default is (8, 10, 3)
+"""
+
+TAG_TEXT = "txt"
+ANNOTATION_TEXT_COLOR = _COLOR_CHERRY_RED
+ANNOTATION_TEXT_DEFAULT_ANCHOR = "n"
+ANNOTATION_TEXT_DEFAULT_JUSTIFY = "center"  # tk.CENTER
+
+
+def get_metadata_folder(book_folder):
+    return os.path.join(book_folder, "metadata")
+
+
+def get_annotations_file_path(book_metadata_folder):
+    return os.path.join(book_metadata_folder, "annotations.json")
+
+
+def get_annotations_journal_file_path(book_metadata_folder):
+    return os.path.join(book_metadata_folder, "annotations.journal")
+
+
+def get_num_pages(book_folder):
+    # the pages are named with their six-digit-0-filled page numbers, see get_page_path
+    num_pages = 0
+    for file_name in os.listdir(book_folder):
+        name, extension = os.path.splitext(file_name)
+        if extension.lower() == ".png" and len(name) == 6 and name.isdigit():
+            num_pages = max(num_pages, int(name))
+    return num_pages
+
+
+def get_page_path(book_folder, page_num):
+    return os.path.join(book_folder, f'{str(page_num).rjust(6, "0")}.png')
+
+
+def write_file_atomically(file_path, text):
+    # written to a temp file first and then renamed, so that the file is never left partially written
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_path, file_path)
+
+
+class _Annotation:
+    # an annotation of a page; the viewer keeps these as the annotations of the book, and the canvas only shows them
+    # (see PdfViewer._dict_canvas_id_to_annotation in main.py), so, nothing is read back from the canvas items
+    # dx and dy are relative to the page's top left corner and unzoomed; they are rounded, so that a position is
+    # the same in the annotations file, the annotations index and the model
+    # kind is TAG_ARROW or TAG_TEXT; text, anchor and justify are only used by the text annotations
+
+    __slots__ = ("dx", "dy", "kind", "text", "anchor", "justify")
+
+    def __init__(self, dx, dy, kind, text=None, anchor=ANNOTATION_TEXT_DEFAULT_ANCHOR,
+                 justify=ANNOTATION_TEXT_DEFAULT_JUSTIFY):
+        self.dx = round(dx)
+        self.dy = round(dy)
+        self.kind = kind
+        self.text = text
+        self.anchor = anchor
+        self.justify = justify
+
+    @classmethod
+    def from_list(cls, a):
+        # as in the annotations file: [dx, dy, TAG_ARROW] or [dx, dy, TAG_TEXT, text, anchor, justify]
+        # (the older text annotations don't have the anchor and justify)
+        return cls(*a[:6]) if a[2] == TAG_TEXT else cls(a[0], a[1], a[2])
+
+    def to_list(self):
+        if self.kind == TAG_TEXT:
+            return [self.dx, self.dy, self.kind, self.text, self.anchor, self.justify]
+        return [self.dx, self.dy, self.kind]
+
+    def get_position(self):
+        # in the page, as in the annotations index
+        return self.dy, self.dx, self.kind
+
+
+def annotations_from_json(annotations):
+    # {page num: list of _Annotation} from the annotations as in the annotations file (a dict with the page numbers
+    # as strings, because json keys are strings), the duplicates removed
+    pages = dict()
+    for page_num, page_annotations in annotations.items():
+        unique_annotations = dict.fromkeys(map(tuple, page_annotations))  # in order
+        if len(unique_annotations) != len(page_annotations) and ALLOW_DEBUGGING:
+            print("Duplicates found on page", page_num, ":", page_annotations)
+        if len(unique_annotations) > 0:
+            pages[int(page_num)] = [_Annotation.from_list(a) for a in unique_annotations]
+    return pages
+
+
+def annotations_to_json(annotations):
+    return {str(page_num): [a.to_list() for a in page_annotations]
+            for page_num, page_annotations in sorted(annotations.items()) if len(page_annotations) > 0}
+
+
+class _AnnotationsJournal:
+    # an append-only file of json lines, each line has all the annotations of a page after a change to them
+    # (add, edit or remove), so, the cost of saving a change is proportional to the page, not the whole book
+    # replaying a line is idempotent (it sets the page's annotations), so, the journal can safely be replayed over
+    # an annotations file that it was already compacted into (in case of a crash while compacting)
+
+    def __init__(self, book_metadata_folder):
+        self._annotations_file_path = get_annotations_file_path(book_metadata_folder)
+        self._journal_file_path = get_annotations_journal_file_path(book_metadata_folder)
+        self._file = None
+        self._ends_with_partial_line = False  # then, the next record must start on a new line
+        self.num_records = 0
+
+    def replay(self, annotations):
+        # applies the changes in the journal to the annotations read from the annotations file
+        try:
+            with open(self._journal_file_path) as f:
+                for line in f:
+                    self._ends_with_partial_line = not line.endswith("\n")
+                    try:
+                        page_num, page_annotations = json.loads(line)
+                    except (json.JSONDecodeError, ValueError):
+                        print("Bad record in annotations journal (it may have been partially written):", line)
+                        continue
+                    annotations[str(page_num)] = page_annotations
+                    self.num_records += 1
+        except IOError:
+            pass  # the journal doesn't exist yet
+
+    def append(self, page_num, page_annotations):
+        if self._file is None:
+            self._file = open(self._journal_file_path, 'a')
+        if self._ends_with_partial_line:
+            self._file.write("\n")
+            self._ends_with_partial_line = False
+        self._file.write(json.dumps([page_num, page_annotations]) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())  # so that the change survives a crash
+        self.num_records += 1
+
+    def compact(self, annotations):
+        # the annotations are written to the annotations file, and then the journal is emptied
+        write_file_atomically(self._annotations_file_path, json.dumps(annotations))
+        self.close()
+        with open(self._journal_file_path, 'w'):
+            pass
+        self._ends_with_partial_line = False
+        self.num_records = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_annotations(book_metadata_folder):
+    # the annotations file with the changes in the annotations journal applied
+    annotations = dict()
+    try:
+        with open(get_annotations_file_path(book_metadata_folder)) as f:
+            annotations = json.loads(f.read())
+    except (IOError, json.JSONDecodeError):
+        pass
+    _AnnotationsJournal(book_metadata_folder).replay(annotations)
+    return annotations
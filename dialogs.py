@@ -0,0 +1,234 @@
+import os
+import tkinter as tk
+from tkinter import ttk
+from tkinter import simpledialog
+from tkinter import scrolledtext
+
+
+# the dialogs of the viewer (see main.py), in a module of their own, so that they are imported only when one is first
+# shown, and not while the viewer starts
+
+
+class _QueryTextAnnotationDialog(simpledialog.Dialog):
+
+    def __init__(self, title, prompt, initial_value, text_anchor, text_justify, parent=None):
+
+        self.prompt = prompt
+        self.initial_value = initial_value
+        self.entry = None
+
+        self._initial_text_anchor = text_anchor
+        self._initial_text_justify = text_justify
+
+        self._selected_bg = "light blue"
+        self._deselected_bg = "white"
+        self._buttons_for_text_anchor = {}
+        self._buttons_for_text_justify = {}
+
+        simpledialog.Dialog.__init__(self, parent, title)
+
+    def destroy(self):
+        self.entry = None
+        self._buttons_for_text_anchor = None
+        self._buttons_for_text_justify = None
+        simpledialog.Dialog.destroy(self)
+
+    def body(self, master):
+        w = tk.Label(master, text=self.prompt, justify=tk.LEFT)
+        w.grid(row=0, column=0, columnspan=2, sticky="w")
+
+        # the text widget
+        self.entry = scrolledtext.ScrolledText(master)
+        self.entry.grid(row=1, column=0, columnspan=2, sticky="ew")
+        if self.initial_value is not None:
+            self.entry.insert("1.0", self.initial_value)
+
+        # the text anchor buttons:
+
+        label_frame_anchor = ttk.Labelframe(master, text="Anchor:")
+        label_frame_anchor.grid(row=2, column=0, sticky='nw')
+
+        anchors = "nw n ne w c e sw s se".split()
+        for i in range(len(anchors)):
+            a = anchors[i]
+            button = tk.Button(
+                label_frame_anchor, text=a, relief=tk.FLAT,
+                bg=self._selected_bg if a == self._initial_text_anchor else self._deselected_bg)
+            button.grid(row=i//3, column=i % 3, sticky='ew')
+            button.bind("<Button-1>", self._select_this_anchor)
+            self._buttons_for_text_anchor[str(button)] = button
+
+        # the text justify buttons:
+
+        label_frame_justify = ttk.Labelframe(master, text="Justify:")
+        label_frame_justify.grid(row=2, column=1, sticky="nw")
+        master.columnconfigure(1, weight=1)  # so that this labelframe and the text-anchor label frame look side-by-side
+
+        justifies = "left center right".split()
+        for i in range(len(justifies)):
+            j = justifies[i]
+            button = tk.Button(
+                label_frame_justify, text=j, relief=tk.FLAT,
+                bg=self._selected_bg if j == self._initial_text_justify else self._deselected_bg)
+            button.grid(row=0, column=i)
+            button.bind("<Button-1>", self._select_this_justify)
+            self._buttons_for_text_justify[str(button)] = button
+
+        return self.entry  # this will have initial focus
+
+    def buttonbox(self):
+        super(_QueryTextAnnotationDialog, self).buttonbox()
+        self.unbind("<Return>")  # by default, in super class' buttonbox function, the Return event on "self" is bound
+        # to self.ok function which closes the dialog and returns the result, but, for text, we need Return to just
+        # take the cursor to the next line, so, we unbind the above event AFTER the call to superclass' buttonbox is
+        # finished. We can bind "Control-Return" instead as follows  // https://stackoverflow.com/a/62115918
+        self.bind("<Control-Return>", self.ok)
+
+    def validate(self):
+        text = self.entry.get("1.0", tk.END)
+
+        anchor = None
+        for i in self._buttons_for_text_anchor:
+            if self._buttons_for_text_anchor[i].cget("bg") == self._selected_bg:
+                anchor = self._buttons_for_text_anchor[i].cget("text")
+                break
+        if anchor is None:
+            anchor = self._initial_text_anchor
+
+        justify = None
+        for i in self._buttons_for_text_justify:
+            if self._buttons_for_text_justify[i].cget("bg") == self._selected_bg:
+                justify = self._buttons_for_text_justify[i].cget("text")
+                break
+        if justify is None:
+            justify = self._initial_text_justify
+
+        self.result = text, anchor, justify
+        return 1
+
+    def _select_this_anchor(self, event):
+        for i in self._buttons_for_text_anchor:
+            self._buttons_for_text_anchor[i].configure(bg=self._deselected_bg)
+        self._buttons_for_text_anchor[str(event.widget)].configure(bg=self._selected_bg)
+
+    def _select_this_justify(self, event):
+        for i in self._buttons_for_text_justify:
+            self._buttons_for_text_justify[i].configure(bg=self._deselected_bg)
+        self._buttons_for_text_justify[str(event.widget)].configure(bg=self._selected_bg)
+
+
+def ask_text(title, prompt, initial_value, text_anchor, text_justify):
+    # the result is (text, anchor, justify), or None if cancelled
+    d = _QueryTextAnnotationDialog(title, prompt, initial_value, text_anchor, text_justify)
+    return d.result
+
+
+class _QueryRecentBooksDialog(simpledialog.Dialog):
+
+    def __init__(self, title, prompt, recent_books, parent=None):
+        self._prompt = prompt
+        self._recent_books = recent_books
+        self._book_button_widgets = {}
+
+        self._selected_bg = "light blue"
+        self._deselected_bg = "white"
+
+        simpledialog.Dialog.__init__(self, parent, title)
+
+    def destroy(self):
+        self._book_button_widgets = None
+        simpledialog.Dialog.destroy(self)
+
+    def body(self, master):
+        w = tk.Label(master, text=self._prompt, justify=tk.LEFT)
+        w.grid(row=0, column=0, sticky='w')
+
+        frame = ttk.Frame(master)
+        frame.grid(row=1, column=0, sticky='w')
+
+        for i in range(len(self._recent_books)):
+            book_path = self._recent_books[i]
+            book_name = os.path.split(book_path)[-1]
+
+            button = tk.Button(frame, text=book_name, bg=self._deselected_bg, relief="flat", anchor="w")
+            button.grid(row=i, column=0, sticky="ew")
+
+            button.bind("<Button-1>", self._select_this)
+
+            self._book_button_widgets[str(button)] = button
+
+            button.book_path = book_path
+
+    def validate(self):
+        result = None
+        for i in self._book_button_widgets:
+            button = self._book_button_widgets[i]
+            if button.cget("bg") == self._selected_bg:
+                result = button.book_path
+                break
+        self.result = result
+        return 1
+
+    def _select_this(self, event):
+        for i in self._book_button_widgets:
+            self._book_button_widgets[i].configure(bg=self._deselected_bg)
+        self._book_button_widgets[str(event.widget)].configure(bg=self._selected_bg)
+
+
+def ask_recent_book(title, prompt, recent_books):
+    d = _QueryRecentBooksDialog(title, prompt, recent_books)
+    return d.result
+
+
+class _QuerySearchDialog(simpledialog.Dialog):
+    # the hits are searched and listed as the query is typed, the result is (query, the chosen hit's value)
+
+    def __init__(self, title, prompt, search, initial_query="", parent=None):
+        self._prompt = prompt
+        self._search = search  # query to (list of (hit's text shown in the list, hit's value), status text)
+        self._initial_query = initial_query
+        self._hits = []
+        self._entry_query = None
+        self._label_status = None
+        self._listbox_hits = None
+
+        simpledialog.Dialog.__init__(self, parent, title)
+
+    def body(self, master):
+        w = tk.Label(master, text=self._prompt, justify=tk.LEFT)
+        w.grid(row=0, column=0, sticky='w')
+
+        self._entry_query = tk.Entry(master, width=40)
+        self._entry_query.grid(row=1, column=0, sticky='ew')
+        self._entry_query.insert(0, self._initial_query)
+        self._entry_query.bind("<KeyRelease>", self._update_hits)
+
+        self._listbox_hits = tk.Listbox(master, width=60, height=15, activestyle="none")
+        self._listbox_hits.grid(row=2, column=0, sticky='news')
+        self._listbox_hits.bind("<Double-Button-1>", self.ok)
+
+        self._label_status = tk.Label(master, justify=tk.LEFT)
+        self._label_status.grid(row=3, column=0, sticky='w')
+
+        self._update_hits()
+        return self._entry_query  # initial focus
+
+    def validate(self):
+        if len(self._hits) == 0:
+            self.result = None
+            return 1
+        selection = self._listbox_hits.curselection()
+        _, value = self._hits[selection[0] if len(selection) > 0 else 0]
+        self.result = (self._entry_query.get(), value)
+        return 1
+
+    def _update_hits(self, _event=None):
+        self._hits, status = self._search(self._entry_query.get())
+        self._listbox_hits.delete(0, tk.END)
+        self._listbox_hits.insert(tk.END, *[text for text, _ in self._hits])
+        self._label_status.configure(text=status)
+
+
+def ask_search(title, prompt, search, initial_query=""):
+    d = _QuerySearchDialog(title, prompt, search, initial_query)
+    return d.result
@@ -0,0 +1,359 @@
+import argparse
+import os
+import sys
+import time
+import zlib
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from import_pdf import DEFAULT_RESOLUTION
+from book_files import (ANNOTATION_ARROW_COLOR, ANNOTATION_ARROW_LENGTH, ANNOTATION_ARROW_SHAPE,
+                        ANNOTATION_ARROW_WIDTH, ANNOTATION_TEXT_COLOR, TAG_ARROW, TAG_TEXT, annotations_from_json,
+                        get_metadata_folder, get_num_pages, get_page_path, read_annotations)
+
+# PIL is imported in the functions that use it, like in main.py; neither tkinter nor the viewer (main.py) is imported,
+# so, this runs on a machine without tk
+
+
+# the annotations are drawn at the size they have on the viewer's canvas at zoom 1, where a pixel of the page's png
+# is a pixel on screen
+EXPORT_TEXT_FONT_SIZE = 12  # pixels; about tk's default font, which the canvas uses for the text annotations
+EXPORT_FORMATS = ("pdf", "png")
+NUM_PAGES_IN_FLIGHT_PER_WORKER = 2  # pages rendered ahead of the one being written, see _iter_results_in_order
+PDF_COMPRESSION_LEVEL = 6  # zlib's default
+
+
+def parse_page_ranges(page_ranges):
+    # "1-5,8,10-12" => [1, 2, 3, 4, 5, 8, 10, 11, 12]; the pages are sorted and the duplicates removed
+    page_nums = set()
+    for page_range in page_ranges.split(","):
+        if page_range.strip() == "":
+            continue
+        first_page, _, last_page = page_range.partition("-")
+        first_page = int(first_page)
+        last_page = first_page if last_page.strip() == "" else int(last_page)
+        if first_page < 1 or last_page < first_page:
+            raise ValueError(f"Not a valid page range: {page_range}")
+        page_nums.update(range(first_page, last_page + 1))
+    return sorted(page_nums)
+
+
+def get_arrow_polygon(x, y, length=ANNOTATION_ARROW_LENGTH, shape=ANNOTATION_ARROW_SHAPE, width=ANNOTATION_ARROW_WIDTH):
+    # the outline of the arrow that the canvas draws for an arrow annotation, i.e. a line from the tip (x, y) to
+    # (x - length, y) with the arrowhead at the tip (tk.FIRST), pointing to the right
+    # the arrowhead is computed like tk does it (see ConfigureArrows in tkCanvLine.c): the back points are d2 behind
+    # the tip and d3 outside the line, and the arrowhead meets the line (at the "neck") on the lines from the back
+    # points to the point d1 behind the tip
+    d1, d2, d3 = shape
+    half_width = width / 2
+    back_y_offset = d3 + half_width
+    fraction = half_width / back_y_offset
+    neck_x = x - (d2 * fraction + d1 * (1 - fraction))
+    return [(x, y), (x - d2, y - back_y_offset), (neck_x, y - half_width), (x - length, y - half_width),
+            (x - length, y + half_width), (neck_x, y + half_width), (x - d2, y + back_y_offset)]
+
+
+def get_text_top_left(x, y, text_width, text_height, anchor):
+    # the top left of the text's bbox, for the text anchored at (x, y) with tk's anchor (nw, n, ne, w, c, e, sw, s, se)
+    if "w" in anchor:
+        left = x
+    elif "e" in anchor:
+        left = x - text_width
+    else:
+        left = x - text_width / 2
+    if anchor.startswith("n"):
+        top = y
+    elif anchor.startswith("s"):
+        top = y - text_height
+    else:
+        top = y - text_height / 2
+    return left, top
+
+
+@functools.lru_cache(maxsize=None)
+def _get_font(font_file_path, font_size):
+    # once per process
+    from PIL import ImageFont
+    if font_file_path is not None:
+        return ImageFont.truetype(font_file_path, font_size)
+    try:
+        return ImageFont.load_default(size=font_size)
+    except TypeError:  # PIL older than 10.1 has only the fixed size bitmap font
+        return ImageFont.load_default()
+
+
+def draw_annotations(image, page_annotations, font):
+    # draws the annotations (list of _Annotation) of a page on the image of the page, like the canvas draws them
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(image)
+    for annotation in page_annotations:
+        if annotation.kind == TAG_ARROW:
+            draw.polygon(get_arrow_polygon(annotation.dx, annotation.dy), fill=ANNOTATION_ARROW_COLOR)
+        elif annotation.kind == TAG_TEXT:
+            left, top, right, bottom = draw.multiline_textbbox((0, 0), annotation.text, font=font,
+                                                               align=annotation.justify)
+            text_left, text_top = get_text_top_left(annotation.dx, annotation.dy, right - left, bottom - top,
+                                                    annotation.anchor)
+            draw.multiline_text((text_left - left, text_top - top), annotation.text, fill=ANNOTATION_TEXT_COLOR,
+                                font=font, align=annotation.justify)
+        else:
+            print("Error: Unknown annotation type", annotation.kind)
+
+
+def render_annotated_page(book_folder, page_num, page_annotations, font_file_path=None,
+                          font_size=EXPORT_TEXT_FONT_SIZE):
+    # the page's png with its annotations drawn on it, as an RGB image
+    from PIL import Image
+    with Image.open(get_page_path(book_folder, page_num)) as page_image:
+        dpi = page_image.info.get("dpi")
+        image = page_image.convert("RGB")
+    draw_annotations(image, page_annotations, _get_font(font_file_path, font_size))
+    image.info["dpi"] = dpi
+    return image
+
+
+class _StreamingPdfWriter:
+    # writes a pdf with a page per image, a page at a time, so, only the page being written is in memory (PIL's pdf
+    # writer keeps all the pages until the end)
+    # the number of pages is needed upfront, to write the page tree first: the objects are the catalog (1), the page
+    # tree (2), and, for each page, the page, its contents and its image
+
+    def __init__(self, file, num_pages):
+        self._file = file
+        self._num_pages = num_pages
+        self._num_pages_written = 0
+        self._object_offsets = []
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._write_object(b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = b" ".join(b"%d 0 R" % self._get_page_object_id(i) for i in range(num_pages))
+        self._write_object(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, num_pages))
+
+    @staticmethod
+    def _get_page_object_id(page_index):
+        return 3 + 3 * page_index
+
+    def _write_object(self, dictionary, stream=None):
+        self._object_offsets.append(self._file.tell())
+        self._file.write(b"%d 0 obj\n" % len(self._object_offsets))
+        self._file.write(dictionary)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_page(self, width, height, dpi, compressed_rgb_pixels):
+        # compressed_rgb_pixels: the image's RGB bytes compressed with zlib (see _compress_page_for_pdf)
+        page_object_id = self._get_page_object_id(self._num_pages_written)
+        page_width = width * 72 / dpi[0]  # points
+        page_height = height * 72 / dpi[1]
+        self._write_object(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] /Contents %d 0 R"
+                           b" /Resources << /XObject << /Im0 %d 0 R >> >> >>"
+                           % (page_width, page_height, page_object_id + 1, page_object_id + 2))
+        contents = b"q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q" % (page_width, page_height)
+        self._write_object(b"<< /Length %d >>" % len(contents), contents)
+        self._write_object(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB"
+                           b" /BitsPerComponent 8 /Filter /FlateDecode /Length %d >>"
+                           % (width, height, len(compressed_rgb_pixels)), compressed_rgb_pixels)
+        self._num_pages_written += 1
+
+    def close(self):
+        if self._num_pages_written != self._num_pages:
+            raise ValueError(f"Wrote {self._num_pages_written} of {self._num_pages} pages")
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self._object_offsets) + 1))
+        for offset in self._object_offsets:
+            self._file.write(b"%010d 00000 n \n" % offset)
+        self._file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                         % (len(self._object_offsets) + 1, xref_offset))
+
+
+def _compress_page_for_pdf(image):
+    # (width, height, dpi, compressed RGB pixels) for _StreamingPdfWriter.add_page
+    dpi = image.info.get("dpi") or (DEFAULT_RESOLUTION, DEFAULT_RESOLUTION)  # import_pdf.py's, if the png has none
+    return image.width, image.height, dpi, zlib.compress(image.tobytes(), PDF_COMPRESSION_LEVEL)
+
+
+def _export_page(book_folder, page_num, page_annotations, output_png_file_path, font_file_path, font_size):
+    # run in a worker process
+    # the page is written to output_png_file_path if given, else it is returned, ready for the pdf (the pdf is
+    # written in the order of the pages by the main process)
+    image = render_annotated_page(book_folder, page_num, page_annotations, font_file_path, font_size)
+    if output_png_file_path is None:
+        return _compress_page_for_pdf(image)
+    temp_file_path = output_png_file_path + ".tmp"
+    image.save(temp_file_path, format="PNG", dpi=image.info["dpi"] or (DEFAULT_RESOLUTION, DEFAULT_RESOLUTION))
+    os.replace(temp_file_path, output_png_file_path)
+    return None
+
+
+def _iter_results_in_order(executor, function, list_of_args, max_in_flight):
+    # like executor.map, but only max_in_flight calls are submitted ahead of the result being consumed, so that the
+    # rendered pages don't pile up in memory while the pdf is being written
+    futures = deque()
+    for args in list_of_args:
+        if len(futures) >= max_in_flight:
+            yield futures.popleft().result()
+        futures.append(executor.submit(function, *args))
+    while len(futures) > 0:
+        yield futures.popleft().result()
+
+
+def get_pages_to_export(book_folder, page_nums=None, annotations=None, annotated_only=False):
+    # the given pages (all the pages if None) that have a png; if annotated_only, only the ones with annotations
+    if page_nums is None:
+        page_nums = range(1, get_num_pages(book_folder) + 1)
+    return [page_num for page_num in page_nums
+            if os.path.isfile(get_page_path(book_folder, page_num))
+            and (not annotated_only or len(annotations.get(page_num, [])) > 0)]
+
+
+def get_export_path(book_folder, output_folder, output_format):
+    # <output_folder>/<book name>.pdf, or, the folder <output_folder>/<book name> for the png files
+    book_name = os.path.basename(os.path.normpath(book_folder))
+    return os.path.join(output_folder, book_name + ".pdf" if output_format == "pdf" else book_name)
+
+
+def export_book(executor, book_folder, output_path, output_format="pdf", page_nums=None, annotated_only=False,
+                num_workers=None, font_file_path=None, font_size=EXPORT_TEXT_FONT_SIZE, on_page_done=None):
+    # exports the pages of the book with their annotations drawn on them, to a pdf file (output_path), or, to png
+    # files named like the book's (in the folder output_path); the pages are rendered in the executor's processes,
+    # and at most a few pages per worker are in memory at a time, so, a book of any size can be exported
+    # on_page_done(page_num, num_pages_done, num_pages) is called as each page is written
+    # returns the number of pages exported
+    annotations = annotations_from_json(read_annotations(get_metadata_folder(book_folder)))
+    page_nums = get_pages_to_export(book_folder, page_nums, annotations, annotated_only)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    if output_format == "png":
+        os.makedirs(output_path, exist_ok=True)
+    list_of_args = [(book_folder, page_num, annotations.get(page_num, []),
+                     get_page_path(output_path, page_num) if output_format == "png" else None,
+                     font_file_path, font_size)
+                    for page_num in page_nums]
+    results = _iter_results_in_order(executor, _export_page, list_of_args,
+                                     num_workers * NUM_PAGES_IN_FLIGHT_PER_WORKER)
+
+    def report_progress(page_index):
+        if on_page_done is not None:
+            on_page_done(page_nums[page_index], page_index + 1, len(page_nums))
+
+    if output_format == "png":
+        for page_index, _ in enumerate(results):
+            report_progress(page_index)
+        return len(page_nums)
+
+    temp_file_path = output_path + ".tmp"  # renamed when complete, so, a pdf is never left partially written
+    with open(temp_file_path, 'wb') as f:
+        pdf_writer = _StreamingPdfWriter(f, len(page_nums))
+        for page_index, page in enumerate(results):
+            pdf_writer.add_page(*page)
+            report_progress(page_index)
+        pdf_writer.close()
+    os.replace(temp_file_path, output_path)
+    return len(page_nums)
+
+
+def read_manifest(manifest_file_path):
+    # list of (book folder, page ranges string or None): a line per book, the book folder, optionally followed by a
+    # tab and the pages of that book to export (see parse_page_ranges), empty lines and lines starting with # are
+    # skipped
+    book_folders_and_page_ranges = []
+    with open(manifest_file_path) as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.strip() == "" or line.startswith("#"):
+                continue
+            book_folder, _, page_ranges = line.partition("\t")
+            book_folders_and_page_ranges.append((book_folder, page_ranges if page_ranges.strip() != "" else None))
+    return book_folders_and_page_ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=""
+        "Exports the pages of books with their annotations (arrows and texts) drawn on them, as they are shown in\n"
+        "the viewer at zoom 1, to a pdf file per book, or, to png files. This doesn't need a display.\n"
+        "The pages are rendered in parallel processes, and are written one by one, so, the memory used doesn't\n"
+        "grow with the number of pages.\n"
+        "\n"
+        "Command line args:\n\n"
+        "Required arguments:\n\n"
+        "book_folder: the folder of a book (the png files and the metadata folder), more than one can be given\n\n"
+        "output_folder: \n"
+        "    The folder to write to. A book is exported to <book name>.pdf, or, with png, to the png files named\n"
+        "    like the book's in the folder <book name>.\n\n"
+        "Optional arguments:\n\n"
+        "format: \n"
+        f"    {' or '.join(EXPORT_FORMATS)}. Default: {EXPORT_FORMATS[0]}\n\n"
+        "pages: \n"
+        "    The pages to export, like 1-5,8,10-12. Default: all the pages\n\n"
+        "annotated_only: \n"
+        "    Export only the pages with annotations (of the given pages).\n\n"
+        "manifest: \n"
+        "    A file listing more books to export, a line per book: its folder, optionally followed by a tab and\n"
+        "    the pages of that book to export (instead of the pages command-line-arg).\n\n"
+        "num_workers: \n"
+        "    The number of processes. Default: the number of cores\n\n"
+        "font: \n"
+        "    A truetype font file for the text annotations. Default: PIL's default font\n\n"
+        "font_size: \n"
+        f"    In pixels of the page. Default: {EXPORT_TEXT_FONT_SIZE}",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("book_folders", nargs="*", metavar="book_folder")
+    parser.add_argument("-o", "--output_folder", required=True)
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default=EXPORT_FORMATS[0])
+    parser.add_argument("-p", "--pages")
+    parser.add_argument("--annotated_only", action="store_true")
+    parser.add_argument("-m", "--manifest")
+    parser.add_argument("-n", "--num_workers", type=int)
+    parser.add_argument("--font")
+    parser.add_argument("--font_size", type=int, default=EXPORT_TEXT_FONT_SIZE)
+    args = parser.parse_args()
+
+    book_folders_and_page_ranges = [(book_folder, args.pages) for book_folder in args.book_folders]
+    if args.manifest is not None:
+        book_folders_and_page_ranges.extend((book_folder, args.pages if page_ranges is None else page_ranges)
+                                            for book_folder, page_ranges in read_manifest(args.manifest))
+    if len(book_folders_and_page_ranges) == 0:
+        parser.error("a book_folder or a manifest is required")
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    num_workers = args.num_workers or os.cpu_count() or 1
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for book_folder, page_ranges in book_folders_and_page_ranges:
+            if not os.path.isdir(get_metadata_folder(book_folder)):
+                num_failed += 1
+                print("Not a valid book folder (it has no metadata folder):", book_folder)
+                continue
+            try:
+                page_nums = None if page_ranges is None else parse_page_ranges(page_ranges)
+            except ValueError as e:
+                num_failed += 1
+                print("Error: Not valid pages for", book_folder, ":", e)
+                continue
+
+            def print_progress(_page_num, num_pages_done, num_pages):
+                print(f"\rExported {num_pages_done}/{num_pages} pages of {book_folder}", end="")
+                sys.stdout.flush()
+
+            output_path = get_export_path(book_folder, args.output_folder, args.format)
+            start_time = time.perf_counter()
+            try:
+                num_pages = export_book(executor, book_folder, output_path, args.format, page_nums,
+                                        args.annotated_only, num_workers, args.font, args.font_size, print_progress)
+            except Exception as e:  # a broken page shouldn't stop the other books; PIL raises many kinds of errors
+                num_failed += 1
+                print("\nError: Couldn't export", book_folder, ":", repr(e))
+                continue
+            print(f"\rExported {num_pages} pages of {book_folder} to {output_path} in "
+                  f"{time.perf_counter() - start_time:.2f} s")
+    print(f"Done: {len(book_folders_and_page_ranges) - num_failed} succeeded, {num_failed} failed")
+
+
+if __name__ == '__main__':
+    main()
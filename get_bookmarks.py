@@ -1,7 +1,15 @@
 import argparse
+import bisect
+import itertools
 import os
+import sys
+import time
 import PyPDF2
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+NUM_SLOWEST_PDFS_TO_REPORT = 5  # in the batch mode
 
 
 # The following function code from: https://stackoverflow.com/a/54363890
@@ -26,6 +34,235 @@ def get_bookmarks_list_with_page_numbers(bookmark_list, pdf_reader_obj, indent=0
     return result
 
 
+def get_page_numbers_by_object_id(pdf_reader_obj):
+    # {object id of a page: page number (0 indexed, like PyPDF2's)}, by walking the page tree once, iteratively
+    page_numbers_by_object_id = dict()
+    visited_object_ids = set()  # a broken page tree may have cycles
+    stack = [pdf_reader_obj.trailer["/Root"].raw_get("/Pages")]
+    while len(stack) > 0:
+        reference = stack.pop()
+        if not isinstance(reference, PyPDF2.generic.IndirectObject) or reference.idnum in visited_object_ids:
+            continue  # pages are always indirect objects
+        visited_object_ids.add(reference.idnum)
+        node = reference.getObject()
+        if "/Kids" in node:  # an intermediate node (/Type /Pages), its kids are in the order of the pages
+            stack.extend(reversed(node["/Kids"]))
+        else:
+            page_numbers_by_object_id[reference.idnum] = len(page_numbers_by_object_id)
+    return page_numbers_by_object_id
+
+
+def _get_destination_page_reference(node, pdf_reader_obj, named_destinations):
+    # the page (indirect object, or, a page number in some broken files) that the outline item goes to, or None
+    if "/Dest" in node:
+        destination = node["/Dest"]
+    elif "/A" in node and node["/A"].get("/S") == "/GoTo" and "/D" in node["/A"]:
+        destination = node["/A"]["/D"]
+    else:
+        return None
+
+    if isinstance(destination, (PyPDF2.generic.TextStringObject, PyPDF2.generic.ByteStringObject,
+                                PyPDF2.generic.NameObject)):
+        if named_destinations[0] is None:  # read on the first named destination only, most pdfs don't use them
+            named_destinations[0] = pdf_reader_obj.getNamedDestinations()
+        named_destination = named_destinations[0].get(destination)
+        return None if named_destination is None else named_destination.page
+    if isinstance(destination, PyPDF2.generic.DictionaryObject) and "/D" in destination:
+        destination = destination["/D"]
+    if isinstance(destination, PyPDF2.generic.ArrayObject) and len(destination) > 0:
+        return destination[0]  # the items of an array are not resolved, so, this is the page's indirect object
+    return None
+
+
+def iter_bookmarks_with_page_numbers(pdf_reader_obj, page_numbers_by_object_id=None):
+    # yields [indent, title, page number] of the bookmarks in order, like get_bookmarks_list_with_page_numbers
+    # (page number is 0 indexed, and -1 if it is not found), but, without PyPDF2's getOutlines and
+    # getDestinationPageNumber: the outline is walked iteratively (so, deep outlines don't hit the recursion limit)
+    # and the pages are looked up in the map from get_page_numbers_by_object_id, built once
+    # an outline item that doesn't go to a page is skipped, and the items nested in it are yielded with their indents
+    if page_numbers_by_object_id is None:
+        page_numbers_by_object_id = get_page_numbers_by_object_id(pdf_reader_obj)
+    catalog = pdf_reader_obj.trailer["/Root"]
+    try:
+        outlines = catalog["/Outlines"] if "/Outlines" in catalog else None
+    except PyPDF2.utils.PdfReadError:  # a broken reference to the outlines
+        return
+    if outlines is None or "/First" not in outlines:
+        return
+
+    named_destinations = [None]  # read when needed, see _get_destination_page_reference
+    visited_object_ids = set()  # a broken outline may have cycles
+    stack = [(outlines.raw_get("/First"), 0)]  # of (item, indent), the top is the next item in order
+    while len(stack) > 0:
+        reference, indent = stack.pop()
+        if isinstance(reference, PyPDF2.generic.IndirectObject):
+            if reference.idnum in visited_object_ids:
+                continue
+            visited_object_ids.add(reference.idnum)
+        node = reference.getObject()
+
+        if "/Next" in node:
+            stack.append((node.raw_get("/Next"), indent))
+        if "/First" in node:
+            stack.append((node.raw_get("/First"), indent + 1))  # on top of the next one, so, it comes first
+
+        if "/Title" not in node:
+            continue
+        page_reference = _get_destination_page_reference(node, pdf_reader_obj, named_destinations)
+        if page_reference is None:
+            continue
+        if isinstance(page_reference, int):
+            page_num = page_reference
+        else:
+            page_num = page_numbers_by_object_id.get(getattr(page_reference, "idnum", None), -1)
+        yield [indent, str(node["/Title"]), page_num]
+
+
+def get_bookmarks_with_page_numbers(pdf_file_path):
+    pdf_reader = PyPDF2.PdfFileReader(pdf_file_path)
+    return list(iter_bookmarks_with_page_numbers(pdf_reader))
+
+
+def parse_deltas(deltas):
+    # the deltas command-line-arg (see the help text) to a list of (start_index, end_index, delta)
+    return [tuple(map(int, sub_command.split(","))) for sub_command in deltas.strip().split(";")
+            if sub_command.strip() != ""]
+
+
+def add_deltas(bookmarks, deltas):
+    # adds the deltas (see parse_deltas) to the page numbers of the bookmarks, end_index -1 means the last bookmark
+    # the ranges are added to a difference array, whose running sum is the delta for each bookmark, so, this takes
+    # time in the number of bookmarks plus the number of ranges, however long the ranges are
+    differences = [0] * (len(bookmarks) + 1)
+    for first_index, last_index, delta in deltas:
+        if last_index == -1:
+            last_index = len(bookmarks) - 1
+        differences[first_index] += delta
+        differences[last_index + 1] -= delta
+    for bookmark, delta in zip(bookmarks, itertools.accumulate(differences)):
+        bookmark[-1] += delta
+
+
+def get_page_label_offsets(pdf_reader_obj):
+    # from the page labels of the pdf, i.e. the page numbers printed on the pages (like i, ii, ..., 1, 2, ...):
+    # the first (0 indexed) page numbers of the page label ranges in order, and, the offset for each range that makes
+    # the 0 indexed page numbers the printed ones, for the ranges numbered in decimals, or, 1 for the other ranges
+    # (roman numerals, letters, or no numbers), i.e. their page numbers start at 1 like the png files
+    # both are empty, if the pdf has no page labels
+    catalog = pdf_reader_obj.trailer["/Root"]
+    if "/PageLabels" not in catalog:
+        return [], []
+    ranges = []  # (first page number, offset)
+    stack = [catalog["/PageLabels"]]  # the page labels are a number tree
+    while len(stack) > 0:
+        node = stack.pop()
+        if "/Kids" in node:
+            stack.extend(kid.getObject() for kid in node["/Kids"])
+        if "/Nums" in node:
+            nums = node["/Nums"]
+            for i in range(0, len(nums) - 1, 2):
+                first_page_num, page_label = int(nums[i]), nums[i + 1].getObject()
+                if "/S" in page_label and page_label["/S"] == "/D":
+                    first_printed_page_num = int(page_label["/St"]) if "/St" in page_label else 1
+                    ranges.append((first_page_num, first_printed_page_num - first_page_num))
+                else:
+                    ranges.append((first_page_num, 1))
+    ranges.sort()
+    return [first_page_num for first_page_num, _ in ranges], [offset for _, offset in ranges]
+
+
+def add_page_label_offsets(bookmarks, first_page_nums, offsets):
+    # adds the offsets from get_page_label_offsets to the page numbers of the bookmarks (the pages before the first
+    # page label range, if any, get 1), the bookmarks whose page is not found (-1) are left as they are
+    for bookmark in bookmarks:
+        if bookmark[-1] < 0:
+            continue
+        k = bisect.bisect_right(first_page_nums, bookmark[-1]) - 1
+        bookmark[-1] += offsets[k] if k >= 0 else 1
+
+
+def get_bookmarks_record(pdf_file_path, deltas=None, use_page_labels=False):
+    # for the batch mode (run in a worker process): a dict of the input file path, the bookmarks with the page
+    # label offsets and deltas added (or, the error instead, if the pdf couldn't be read), and the seconds taken
+    start_time = time.perf_counter()
+    record = {"input_file_path": pdf_file_path}
+    try:
+        pdf_reader = PyPDF2.PdfFileReader(pdf_file_path)
+        bookmarks = list(iter_bookmarks_with_page_numbers(pdf_reader))
+        if use_page_labels:
+            add_page_label_offsets(bookmarks, *get_page_label_offsets(pdf_reader))
+        if deltas is not None:
+            add_deltas(bookmarks, deltas)
+        record["bookmarks"] = bookmarks
+    except Exception as e:  # PyPDF2 raises many kinds of errors for broken pdfs
+        record["error"] = repr(e)
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+
+def iter_bookmarks_records(pdf_file_paths_and_deltas, use_page_labels=False, num_workers=None):
+    # yields the records (see get_bookmarks_record) of the given (pdf file path, deltas) as they are done, the pdfs
+    # are read in parallel processes
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(get_bookmarks_record, pdf_file_path, deltas, use_page_labels)
+                   for pdf_file_path, deltas in pdf_file_paths_and_deltas]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def read_manifest(manifest_file_path):
+    # list of (pdf file path, deltas string or None): a line per pdf, the path, optionally followed by a tab and
+    # the deltas for that pdf, empty lines and lines starting with # are skipped
+    pdf_file_paths_and_deltas = []
+    with open(manifest_file_path) as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.strip() == "" or line.startswith("#"):
+                continue
+            pdf_file_path, _, deltas = line.partition("\t")
+            pdf_file_paths_and_deltas.append((pdf_file_path, deltas if deltas.strip() != "" else None))
+    return pdf_file_paths_and_deltas
+
+
+def _write_bookmarks_of_pdf_to_book(pdf_file_path):
+    # run in a worker process, returns (number of bookmarks, seconds taken)
+    from import_pdf import get_book_folder_for_pdf, write_bookmarks
+    start_time = time.perf_counter()
+    num_bookmarks = write_bookmarks(pdf_file_path, get_book_folder_for_pdf(pdf_file_path))
+    return num_bookmarks, time.perf_counter() - start_time
+
+
+def write_bookmarks_of_pdfs_in_directory(directory, num_workers=None):
+    # writes bookmarks.json of each pdf in the directory into its book's metadata folder (the book folder is beside
+    # the pdf with the same name, see import_pdf.get_book_folder_for_pdf), the pdfs are read in parallel processes
+    # the pdfs without a book folder are skipped
+    from import_pdf import get_book_folder_for_pdf
+    pdf_file_paths = []
+    for file_name in sorted(os.listdir(directory)):
+        pdf_file_path = os.path.join(directory, file_name)
+        if not (file_name.lower().endswith(".pdf") and os.path.isfile(pdf_file_path)):
+            continue
+        if not os.path.isdir(get_book_folder_for_pdf(pdf_file_path)):
+            print("Skipping, there is no book folder for:", pdf_file_path)
+            continue
+        pdf_file_paths.append(pdf_file_path)
+
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_write_bookmarks_of_pdf_to_book, pdf_file_path): pdf_file_path
+                   for pdf_file_path in pdf_file_paths}
+        for future in as_completed(futures):
+            try:
+                num_bookmarks, seconds = future.result()
+            except Exception as e:  # PyPDF2 raises many kinds of errors for broken pdfs
+                num_failed += 1
+                print("Error: Couldn't write bookmarks of", futures[future], repr(e))
+                continue
+            print(f"Wrote {num_bookmarks} bookmarks in {seconds:.2f} s of", futures[future])
+            sys.stdout.flush()
+    return len(pdf_file_paths) - num_failed, num_failed
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=""
@@ -41,8 +278,31 @@ def main():
         "\n"
         "Command line args:\n\n"
         "Required arguments:\n\n"
-        "input_file_path: a valid path to a pdf file\n\n"
+        "input_file_path: a valid path to a pdf file, or, a directory (see directory below)\n"
+        "    More than one pdf file can be given for the batch mode (see format below)\n\n"
         "Optional arguments:\n\n"
+        "format: \n"
+        "    json or jsonl. Batch mode: the bookmarks of all the given pdf files (and the ones in manifest) are\n"
+        "    written to stdout, as a json list, or, as json lines (one line per pdf file, as soon as it is done,\n"
+        "    for piping), each is {\"input_file_path\": ..., \"bookmarks\": [...], \"seconds\": ...}, with \"error\"\n"
+        "    instead of \"bookmarks\" if the pdf file couldn't be read. The pdf files are read in parallel\n"
+        "    processes, and the slowest ones are reported to stderr. The deltas, if given, are added for each pdf.\n"
+        "    This is the default when more than one pdf file, or, a manifest is given (with jsonl).\n\n"
+        "manifest: \n"
+        "    A file listing the pdf files for the batch mode, a line per pdf file: its path, optionally followed by\n"
+        "    a tab and the deltas for that pdf file (instead of the deltas command-line-arg).\n\n"
+        "page_labels: \n"
+        "    Make the page numbers the page numbers printed on the pages, from the page labels of the pdf file.\n"
+        "    The pages that are not numbered in decimals (like the front matter numbered i, ii, ...) get page\n"
+        "    numbers starting at 1. The deltas, if given, are added after this.\n"
+        "    This is for display only: the viewer takes the page numbers in bookmarks.json as the numbers of the\n"
+        "    png files, so, it can't be given with directory or output_json_file_path.\n\n"
+        "directory: \n"
+        "    The input_file_path is a directory of pdf files. The bookmarks of each pdf file are written to\n"
+        "    bookmarks.json in the metadata folder of its book (the folder beside the pdf file with its name, as\n"
+        "    import_pdf.py makes), with page numbers starting at 1. The pdf files are read in parallel processes.\n\n"
+        "num_workers: \n"
+        "    The number of processes for directory. Default: the number of cores\n\n"
         "output_json_file_path: \n"
         "    Need not exist, just directory to write to should exist.\n"
         "    If not given, the data is printed, along with the index of each bookmark on the list.\n\n"
@@ -66,37 +326,62 @@ def main():
         "           0,9,1;90,99,-1",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
-    parser.add_argument("input_file_path")
+    parser.add_argument("input_file_paths", nargs="*", metavar="input_file_path")
     parser.add_argument("-o", "--output_json_file_path")
     parser.add_argument("-d", "--deltas")
+    parser.add_argument("--directory", action="store_true")
+    parser.add_argument("-n", "--num_workers", type=int)
+    parser.add_argument("-f", "--format", choices=("json", "jsonl"))
+    parser.add_argument("-m", "--manifest")
+    parser.add_argument("--page_labels", action="store_true")
     args = parser.parse_args()
     # print(args)
 
-    input_file_path = args.input_file_path
+    if args.page_labels and (args.directory or args.output_json_file_path is not None):
+        parser.error("page_labels is for display only, it can't be given with directory or output_json_file_path "
+                     "(the viewer needs the numbers of the png files)")
+
+    if args.format is not None or args.manifest is not None or len(args.input_file_paths) > 1:
+        if args.output_json_file_path is not None:
+            parser.error("the batch mode writes to stdout, output_json_file_path can't be given")
+        _run_batch_mode(args)
+        return
+
+    if len(args.input_file_paths) != 1:
+        parser.error("input_file_path is required")
+    input_file_path = args.input_file_paths[0]
+
+    if args.directory:
+        if not os.path.isdir(input_file_path):
+            print("Not a valid directory:", input_file_path)
+            return
+        num_succeeded, num_failed = write_bookmarks_of_pdfs_in_directory(input_file_path, args.num_workers)
+        print(f"Done: {num_succeeded} succeeded, {num_failed} failed")
+        return
 
     if (not input_file_path.lower().endswith(".pdf")) or (not os.path.isfile(input_file_path)):
         print("Not a valid pdf file:", input_file_path)
         return
 
     pdf_reader = PyPDF2.PdfFileReader(input_file_path)
-    # show_tree(pdf_reader.getOutlines())
-    bookmarks = get_bookmarks_list_with_page_numbers(pdf_reader.getOutlines(), pdf_reader)
+    bookmarks = list(iter_bookmarks_with_page_numbers(pdf_reader))
 
     # Before adding deltas:
     # for i in range(len(bookmarks)):
     #     print(f"{i}:", bookmarks[i])
 
+    if args.page_labels:
+        print("Adding page label offsets")
+        add_page_label_offsets(bookmarks, *get_page_label_offsets(pdf_reader))
+
     if args.deltas is not None:
         print("Adding deltas:")
-        deltas_sub_commands = args.deltas.strip().split(";")
-        # print(deltas_sub_commands)
-        for sub_command in deltas_sub_commands:
-            first_index, last_index, delta_value = tuple(map(int, sub_command.split(",")))
+        deltas = parse_deltas(args.deltas)
+        for first_index, last_index, delta_value in deltas:
             if last_index == -1:
                 last_index = len(bookmarks) - 1
             print(f"Adding {delta_value} to bookmarks of indices in range [{first_index}, {last_index}]")
-            for i in range(first_index, last_index + 1):
-                bookmarks[i][-1] += delta_value
+        add_deltas(bookmarks, deltas)
 
     for i in range(len(bookmarks)):
         print(f"{i}:", bookmarks[i])
@@ -114,5 +399,34 @@ def main():
             f.write(json.dumps(bookmarks, indent=2))
 
 
+def _run_batch_mode(args):
+    pdf_file_paths_and_deltas = [(input_file_path, args.deltas) for input_file_path in args.input_file_paths]
+    if args.manifest is not None:
+        pdf_file_paths_and_deltas.extend((pdf_file_path, args.deltas if deltas is None else deltas)
+                                         for pdf_file_path, deltas in read_manifest(args.manifest))
+    pdf_file_paths_and_deltas = [(pdf_file_path, None if deltas is None else parse_deltas(deltas))
+                                 for pdf_file_path, deltas in pdf_file_paths_and_deltas]
+
+    output_format = args.format or "jsonl"
+    start_time = time.perf_counter()
+    records = []
+    for record in iter_bookmarks_records(pdf_file_paths_and_deltas, args.page_labels, args.num_workers):
+        records.append(record)
+        if output_format == "jsonl":
+            print(json.dumps(record))
+            sys.stdout.flush()
+        if "error" in record:
+            print("Error: Couldn't read bookmarks of", record["input_file_path"], record["error"], file=sys.stderr)
+    if output_format == "json":
+        order = {pdf_file_path: i for i, (pdf_file_path, _) in enumerate(pdf_file_paths_and_deltas)}
+        records.sort(key=lambda r: order[r["input_file_path"]])  # in the given order
+        print(json.dumps(records, indent=2))
+
+    print(f"Read {len(records)} pdf files in {time.perf_counter() - start_time:.2f} s, the slowest ones:",
+          file=sys.stderr)
+    for record in sorted(records, key=lambda r: r["seconds"], reverse=True)[:NUM_SLOWEST_PDFS_TO_REPORT]:
+        print(f"    {record['seconds']:.3f} s {record['input_file_path']}", file=sys.stderr)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,176 @@
+import argparse
+import os
+import sys
+import json
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the rasterizer command is run once per range of pages, each item is formatted with the keys:
+# resolution, first_page, last_page, pdf_file_path and output_root
+# the rasterizer must write the page with page number N to a file named "<output_root>-<N>.png",
+# with N optionally 0-filled, like xpdf's pdftopng (and poppler's pdftoppm -png) do
+DEFAULT_RASTERIZER_COMMAND = ["pdftopng", "-r", "{resolution}", "-f", "{first_page}", "-l", "{last_page}",
+                              "{pdf_file_path}", "{output_root}"]
+DEFAULT_RESOLUTION = 300  # dpi
+NUM_PAGES_PER_RANGE = 8  # small ranges, so that the first pages are ready early, and the cores are evenly used
+
+_OUTPUT_ROOT_NAME = "importing"  # the rasterizer's outputs are renamed from "importing-000001.png" to "000001.png"
+
+
+def get_book_folder_for_pdf(pdf_file_path):
+    # a folder beside the pdf file with the same name as the pdf file
+    return os.path.splitext(pdf_file_path)[0]
+
+
+def get_num_pages_of_pdf(pdf_file_path):
+    import PyPDF2
+    return PyPDF2.PdfFileReader(pdf_file_path).getNumPages()
+
+
+def get_page_ranges(num_pages, num_pages_per_range=NUM_PAGES_PER_RANGE):
+    # list of (first_page, last_page), both inclusive and 1 indexed
+    return [(first_page, min(first_page + num_pages_per_range - 1, num_pages))
+            for first_page in range(1, num_pages + 1, num_pages_per_range)]
+
+
+def write_bookmarks(pdf_file_path, book_folder):
+    # bookmarks.json in the book's metadata folder, with page numbers starting at 1 like the png files
+    # (PyPDF2's page numbers start at 0)
+    # returns the number of bookmarks
+    from get_bookmarks import get_bookmarks_with_page_numbers  # imported here, so that the viewer doesn't need
+    # PyPDF2 until a pdf is imported
+    bookmarks = get_bookmarks_with_page_numbers(pdf_file_path)
+    for bookmark in bookmarks:
+        bookmark[-1] += 1
+    with open(os.path.join(book_folder, "metadata", "bookmarks.json"), 'w') as f:
+        f.write(json.dumps(bookmarks, indent=2))
+    return len(bookmarks)
+
+
+def _rename_rasterizer_outputs(book_folder, first_page, last_page):
+    # returns the page numbers that were renamed
+    renamed_pages = []
+    prefix = f"{_OUTPUT_ROOT_NAME}-"
+    for file_name in os.listdir(book_folder):
+        if not (file_name.startswith(prefix) and file_name.lower().endswith(".png")):
+            continue
+        try:
+            page_num = int(file_name[len(prefix):-len(".png")])
+        except ValueError:
+            continue
+        if first_page <= page_num <= last_page:
+            os.replace(os.path.join(book_folder, file_name),
+                       os.path.join(book_folder, f'{str(page_num).rjust(6, "0")}.png'))
+            renamed_pages.append(page_num)
+    return renamed_pages
+
+
+def _rasterize_page_range(pdf_file_path, book_folder, first_page, last_page, rasterizer_command, resolution):
+    command = [c.format(resolution=resolution, first_page=first_page, last_page=last_page,
+                        pdf_file_path=pdf_file_path, output_root=os.path.join(book_folder, _OUTPUT_ROOT_NAME))
+               for c in rasterizer_command]
+    completed_process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if completed_process.returncode != 0:
+        raise RuntimeError(f"Rasterizer failed for pages {first_page}-{last_page} with exit code "
+                           f"{completed_process.returncode}: {completed_process.stderr.decode(errors='replace')}")
+    return sorted(_rename_rasterizer_outputs(book_folder, first_page, last_page))
+
+
+def convert_pdf_to_book(pdf_file_path, book_folder=None, rasterizer_command=None, resolution=DEFAULT_RESOLUTION,
+                        num_workers=None, on_pages_ready=None, stop_event=None):
+    # converts the pdf into a book folder that the viewer can open: the png files named by page number, and,
+    # the metadata folder with bookmarks.json
+    # the rasterizer is run on ranges of pages in parallel (one process per range, as many at a time as there are
+    # cores), the lower page numbers first
+    # on_pages_ready(page_nums, num_pages_done, num_pages) is called (from a worker thread) as each range is done,
+    # so that the book can be opened before all the pages are converted
+    # setting the stop_event stops converting the ranges that are not yet started
+    if book_folder is None:
+        book_folder = get_book_folder_for_pdf(pdf_file_path)
+    if rasterizer_command is None:
+        rasterizer_command = DEFAULT_RASTERIZER_COMMAND
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    os.makedirs(os.path.join(book_folder, "metadata"), exist_ok=True)
+
+    try:
+        write_bookmarks(pdf_file_path, book_folder)
+    except Exception as e:  # a broken outline shouldn't stop the conversion; PyPDF2 raises many kinds of errors
+        print("Error: Couldn't write bookmarks:", repr(e))
+
+    num_pages = get_num_pages_of_pdf(pdf_file_path)
+    lock = threading.Lock()
+    num_pages_done = 0
+
+    def rasterize(first_page, last_page):
+        nonlocal num_pages_done
+        if stop_event is not None and stop_event.is_set():
+            return
+        page_nums = _rasterize_page_range(pdf_file_path, book_folder, first_page, last_page,
+                                          rasterizer_command, resolution)
+        with lock:
+            num_pages_done += len(page_nums)
+            if on_pages_ready is not None:
+                on_pages_ready(page_nums, num_pages_done, num_pages)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:  # threads, because the work is in the processes
+        futures = [executor.submit(rasterize, first_page, last_page)
+                   for first_page, last_page in get_page_ranges(num_pages)]
+        for future in futures:
+            future.result()  # raises the rasterizer's error, if any
+
+    return book_folder
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=""
+        "Converts a pdf file into a book that the image pdf viewer can open, i.e.\n"
+        "png images of the pages named 000001.png, 000002.png, ... and a metadata folder with bookmarks.json.\n"
+        "The pages are converted in parallel using all the cores.\n"
+        "\n"
+        "Command line args:\n\n"
+        "Required arguments:\n\n"
+        "input_file_path: a valid path to a pdf file\n\n"
+        "Optional arguments:\n\n"
+        "book_folder: \n"
+        "    The folder to write the book to. If not given, a folder beside the pdf file with its name is used.\n\n"
+        "resolution: \n"
+        f"    Resolution of the png images in dpi. Default: {DEFAULT_RESOLUTION}\n\n"
+        "rasterizer: \n"
+        "    The rasterizer command as a json list of strings. Each string is formatted with\n"
+        "    {resolution}, {first_page}, {last_page}, {pdf_file_path} and {output_root}.\n"
+        "    The page N must be written to <output_root>-<N>.png (N may be 0-filled).\n"
+        f"    Default: {json.dumps(DEFAULT_RASTERIZER_COMMAND)}",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input_file_path")
+    parser.add_argument("-b", "--book_folder")
+    parser.add_argument("-r", "--resolution", type=int, default=DEFAULT_RESOLUTION)
+    parser.add_argument("--rasterizer")
+    args = parser.parse_args()
+
+    input_file_path = args.input_file_path
+
+    if (not input_file_path.lower().endswith(".pdf")) or (not os.path.isfile(input_file_path)):
+        print("Not a valid pdf file:", input_file_path)
+        return
+
+    rasterizer_command = None
+    if args.rasterizer is not None:
+        rasterizer_command = json.loads(args.rasterizer)
+
+    def print_progress(_page_nums, num_pages_done, num_pages):
+        print(f"\rConverted {num_pages_done}/{num_pages} pages", end="")
+        sys.stdout.flush()
+
+    book_folder = convert_pdf_to_book(input_file_path, args.book_folder, rasterizer_command, args.resolution,
+                                      on_pages_ready=print_progress)
+    print("\nThe book is ready at", book_folder)
+
+
+if __name__ == '__main__':
+    main()
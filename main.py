@@ -1,19 +1,45 @@
-# import argparse
+import time
+_IMPORT_START_TIME = time.perf_counter()  # see --profile-startup
+import argparse
 import sys
 import os
 import tkinter as tk
 from tkinter import ttk
-from tkinter import filedialog
-from tkinter import simpledialog
 from tkinter import messagebox
-from tkinter import scrolledtext
 import json
-from PIL import Image, ImageTk
+import bisect
+import io
+import math
+import queue
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import functools
+from contextlib import contextmanager
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+
+# PIL and the dialogs (see dialogs.py) are imported where they are first used, so that the window shows up sooner;
+# PIL alone took most of the import time (see --profile-startup); it is imported on a worker thread at startup
+# (see _finish_startup), so, the main thread rarely waits for it
+
+from import_pdf import convert_pdf_to_book, get_book_folder_for_pdf, DEFAULT_RASTERIZER_COMMAND
+from text_index import open_text_index_db, search_text_index, get_num_indexed_pages, DEFAULT_PDF_TEXT_COMMAND
+from book_files import (ANNOTATION_ARROW_COLOR, ANNOTATION_ARROW_LENGTH, ANNOTATION_ARROW_SHAPE,
+                        ANNOTATION_ARROW_WIDTH, ANNOTATION_TEXT_COLOR, ANNOTATION_TEXT_DEFAULT_ANCHOR,
+                        ANNOTATION_TEXT_DEFAULT_JUSTIFY, TAG_ARROW, TAG_TEXT, _Annotation, _AnnotationsJournal,
+                        annotations_from_json, annotations_to_json, get_annotations_file_path,
+                        get_annotations_journal_file_path, get_metadata_folder, get_num_pages, get_page_path,
+                        read_annotations, write_file_atomically)
 
 import ctypes
 
-ctypes.windll.shcore.SetProcessDpiAwareness(1)  # do this once before starting the GUI to fix blurring in 1080p screens
+if sys.platform == "win32":
+    ctypes.windll.shcore.SetProcessDpiAwareness(1)  # do this once before starting the GUI to fix blurring in 1080p screens
+
+_IMPORTS_DONE_TIME = time.perf_counter()  # see --profile-startup
 
 
 ALLOW_DEBUGGING = False
@@ -22,16 +48,27 @@ ALLOW_DEBUGGING = False
 DEFAULT_BOOKMARKS_TEXT_WIDTH = 40  # It is num chars. Also, height isn't required because it will expand vertically
 
 _FOLDER_OF_THIS_PYTHON_FILE = os.path.split(sys.argv[0])[0]  # sys.argv[0] is the rel path to the file being run
-SETTINGS_FILE_PATH = os.path.join(_FOLDER_OF_THIS_PYTHON_FILE, "data\\settings.json")
+SETTINGS_FILE_PATH = os.path.join(_FOLDER_OF_THIS_PYTHON_FILE, "data", "settings.json")
+SETTINGS_WRITE_DELAY = 2  # seconds; the changes to a settings file within this time are written together
+SETTINGS_WRITER_IDLE_CHECK_INTERVAL = 1  # seconds; see _SettingsWriter._run
 
 KEY_SETTING_GUI_GEOMETRY = "geometry"
 KEY_SETTING_GUI_STATE = "state"  # maximized window, or normal window
 KEY_CURRENTLY_OPENED_BOOK = "currently-opened-book"
 KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_ANCHOR = "recently-used-text-annotation-anchor"
 KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_JUSTIFY = "recently-used-text-annotation-justify"
+KEY_DECODED_PAGE_CACHE_SIZE_MB = "decoded-page-cache-size-mb"
+KEY_SHOW_THUMBNAILS = "show-thumbnails"
+KEY_PDF_RASTERIZER_COMMAND = "pdf-rasterizer-command"  # see import_pdf.py
+KEY_SMOOTH_SCROLLING = "smooth-scrolling"  # if false, the accumulated scroll is done in one frame
+KEY_PDF_TEXT_COMMAND = "pdf-text-command"  # see text_index.py
+KEY_OCR_COMMAND = "ocr-command"  # see text_index.py; None => the pages without a text layer are not searchable
 
 KEY_CURRENTLY_VISIBLE_PAGES = "currently-visible-pages"
 KEY_SCROLLBAR_POSITIONS = "scroll-bar-positions"
+KEY_PREFETCH_PAGE_RANGE = "prefetch-page-range"  # max pages decoded ahead of the scroll direction, per book
+KEY_ZOOM = "zoom"
+KEY_COLLAPSED_BOOKMARKS = "collapsed-bookmarks"  # indices of the collapsed bookmarks
 
 KEY_RECENTLY_OPENED_BOOKS = "recently-opened-books"
 NUM_BOOKS_TO_STORE_IN_RECENTLY_OPENED_BOOKS = 20
@@ -44,65 +81,126 @@ if ALLOW_DEBUGGING:
           KEY_PRESSES_TO_ALLOW_FURTHER_HANDLING_IN_TEXT_BOOKMARKS)
 
 TAG_OBJECT = "obj"
-TAG_PAGE_IMAGE = "pg-img"
+TAG_PAGE_IMAGE = "pg-img"  # the page itself i.e. a rectangle of the page's size (see TAG_PAGE_DECODED_IMAGE)
+TAG_PAGE_DECODED_IMAGE = "pg-dec-img"  # the decoded png image drawn on top of the page rectangle
 PREFIX_TAG_PAGE_NUM = "pg-num"  # this is used in tag.startswith, so, this must be unique prefix
-PREFIX_TAG_ANNOTATION_DELTAS = "ann_del"  # this is used in tag.startswith, so, this must also be unique
 
 TAG_BOOKMARK = "bm"
+TAG_BOOKMARK_TOGGLE = "bm-toggle"  # the marker before a bookmark that has bookmarks nested in it, to collapse/expand
+TAG_BOOKMARK_HIDDEN = "bm-hidden"  # the lines of the bookmarks nested in a collapsed bookmark (elided)
+TAG_CURRENT_BOOKMARK = "bm-current"  # the bookmark of the section being read
+BOOKMARK_EXPANDED_MARKER = "\u25be"  # small down-pointing triangle
+BOOKMARK_COLLAPSED_MARKER = "\u25b8"  # small right-pointing triangle
+
+# the bookmarks panel is filled in chunks when idle, after the first page of the book is shown, so that opening a
+# book doesn't wait for a large outline
+NUM_BOOKMARKS_TO_INSERT_AT_A_TIME = 500
 
 
 NUM_PIXELS_TO_SCROLL = 80
+PAGE_X1 = 2  # pixels; the left of the pages on canvas
+# the scroll events are accumulated, and the canvas is scrolled at most once per frame
+SCROLL_FRAME_INTERVAL = 16  # milliseconds, i.e. about 60 frames per second
+SMOOTH_SCROLL_FRACTION = 0.35  # of the remaining scroll, done in each frame (if smooth scrolling is on)
 PIXELS_BETWEEN_PAGES = 20
 NUM_PAGE_IMAGE_RANGE_TO_KEEP = 3  # this means from current page num +-3 are kept
 
+NUM_PAGE_DECODE_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))  # threads that decode png files
+PAGE_DECODE_POLL_INTERVAL = 15  # milliseconds; how often the Tk loop checks for pages decoded by the workers
+
+# pages ahead of the scroll direction are decoded before they are needed on canvas
+# the number of such pages grows with the scroll speed, up to the book's prefetch page range (which by default is
+# NUM_PAGE_IMAGE_RANGE_TO_KEEP), such that the pages that will be scrolled into view in the next
+# PREFETCH_LOOK_AHEAD_TIME are ready
+PREFETCH_LOOK_AHEAD_TIME = 1000  # milliseconds
+SCROLL_SPEED_RESET_TIME = 500  # milliseconds; if there is no scroll for this long, the scroll speed is taken as zero
+SCROLL_SPEED_SMOOTHING = 0.5  # weight of the latest scroll event in the scroll speed (exponential moving average)
+
+DEFAULT_DECODED_PAGE_CACHE_SIZE_MB = 512  # memory budget of the decoded pages kept for reuse, see _DecodedPageCache
+
+ZOOM_STEP = 1.25  # zoom is multiplied or divided by this on zoom in or zoom out
+MIN_ZOOM = 0.1
+MAX_ZOOM = 4
+# downscaled renditions of the pages are saved in the book's metadata folder the first time they are needed,
+# and a page is shown at a zoom by resizing the smallest of them that is not smaller than the zoom
+# a level is the factor by which the page is downscaled, for example, level 4 => 1/4 of the page's width and height
+PYRAMID_LEVELS = (2, 4, 8)
+
+# very large pages (for example, engineering drawings) are shown as a grid of tiles, and only the tiles near the
+# visible area are decoded and kept on canvas
+# the tiles are cut from the page (or its pyramid level) once, and saved in the book's metadata folder
+TILED_PAGE_MIN_PIXELS = 5000 * 5000  # pages larger than this (at the current zoom) are tiled
+PAGE_TILE_SIZE = 1024  # pixels of the pyramid level that the tiles are cut from
+PAGE_TILE_MARGIN = 512  # pixels; tiles within this distance outside the visible area are also kept on canvas
+
+# thumbnails of all the pages are made once by a background thread and saved in the book's metadata folder
+# (and remade if a png's modification time or size changes)
+# only the thumbnails in the visible part of the thumbnails panel are on its canvas
+THUMBNAIL_MAX_SIZE = (120, 160)  # pixels (width, height); aspect ratio of the page is kept
+THUMBNAIL_ROW_HEIGHT = THUMBNAIL_MAX_SIZE[1] + 30  # pixels; includes the space for the page number
+THUMBNAIL_PANEL_WIDTH = THUMBNAIL_MAX_SIZE[0] + 20  # pixels
+THUMBNAIL_POLL_INTERVAL = 100  # milliseconds; how often the Tk loop checks for newly made thumbnails
+
+# the sizes of all the pages are read from the headers of the png files when a book is opened (in parallel), and
+# cached in the book's metadata folder along with the size and modification time of each png file
+NUM_PAGE_GEOMETRY_WORKERS = 8  # threads; reading the headers is mostly waiting for the disk
+
+PDF_IMPORT_POLL_INTERVAL = 200  # milliseconds; how often the Tk loop checks the progress of importing a pdf
+
+# at startup, the window is shown first, and then, the last opened book is restored; its page sizes are read on a
+# worker thread (see read_page_sizes), and the Tk loop checks this often whether they are read
+BOOK_RESTORE_POLL_INTERVAL = 10  # milliseconds
+
+# the full text search index of a book is built in a separate process (see text_index.py), started this long after
+# the book is opened, so that it doesn't slow down opening the book
+TEXT_INDEX_BUILD_DELAY = 3000  # milliseconds
+
+# every change to the annotations of a page is appended to the annotations journal, and, once the journal has this
+# many records, it is compacted back into the annotations file, see _AnnotationsJournal
+ANNOTATIONS_JOURNAL_MAX_RECORDS = 200
+
+LIBRARY_ANNOTATIONS_MAX_SEARCH_RESULTS = 500  # see _LibraryAnnotationsIndex
+
+ANNOTATIONS_GRID_CELL_SIZE = 256  # pixels on canvas, see _SpatialGrid; a few times the size of an annotation
+ANNOTATION_HIT_PADDING = 3  # pixels on canvas; a click this close to an annotation's bbox is a click on it
+
+# the times of the operations on the hot path (loading pages, decoding, scrolling etc.) are measured all the time,
+# and shown by the performance overlay; while a trace is being recorded, every measurement is also kept for the trace
+PERFORMANCE_NUM_SAMPLES = 500  # per operation; the most recent ones are used for the percentiles
+PERFORMANCE_PERCENTILES = (50, 95, 99)
+PERFORMANCE_OVERLAY_UPDATE_INTERVAL = 500  # milliseconds
+_TRACE_FILE_DATETIME_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
 
 _COLOR_LAVENDER = "#e6e6fa"
 _COLOR_TEAL = "#008080"
-_COLOR_CHERRY_RED = "#d2042d"
 _COLOR_WHITE = "#ffffff"
 _COLOR_LIGHT_BLUE = "#add8e6"
 _COLOR_DARK_BLUE = "#00008b"
 _COLOR_SKY_BLUE = "#87ceeb"
+_COLOR_LIGHT_GREY = "#d3d3d3"
+
 
+PAGE_PLACEHOLDER_COLOR = _COLOR_LIGHT_GREY  # shown in place of a page until its png is decoded
+
+
+TAG_ANNOTATION = "ann"  # all the annotations on canvas, with TAG_ARROW or TAG_TEXT
 
-ANNOTATION_ARROW_COLOR = _COLOR_CHERRY_RED
-ANNOTATION_ARROW_LENGTH = 100  # pixels
-ANNOTATION_ARROW_WIDTH = 3
-ANNOTATION_ARROW_SHAPE = (8, 10, 3)  # see the shape explanation below
-TAG_ANNOTATION = "ann"
-TAG_ARROW = "arr"
-"""
-arrow shape: (d1, d2, d3)
-The following arrow is pointing to right (like -->)
-         |
--------------
-         |
-d1 is the horizontal part of the arrow tip
-d2 is the diagonal part of the arrow tip (not drawn above: imagine a digonal line )
-d3 is the vertical part of the arrow tip
-tkinter's default is (8, 10, 3)
-"""
-
-TAG_TEXT = "txt"
-ANNOTATION_TEXT_COLOR = _COLOR_CHERRY_RED
-ANNOTATION_TEXT_DEFAULT_ANCHOR = "n"
-ANNOTATION_TEXT_DEFAULT_JUSTIFY = tk.CENTER
-
-TAG_ANNOTATION_HIGHLIGHTED = "ann-hl"
 TAG_BBOX = "bbox"
 ANNOTATION_HIGHLIGHT_COLOR = _COLOR_TEAL
 ANNOTATION_HIGHLIGHT_WIDTH = 2
 ANNOTATION_HIGHLIGHT_BBOX_PADDING = 5
+TAG_SEARCH_HIT = "search-hit"
+SEARCH_HIT_COLOR = _COLOR_SKY_BLUE
+SEARCH_HIT_WIDTH = 3
+SEARCH_HIT_PADDING = 2  # pixels around the word
+
 ANNOTATION_HIGHLIGHTED_BRING_TO_SIGHT_PADDING = 100  # the out of sight annotations are
 # brought to this many pixels into the visible area
 
 # some helper functions
 
 
-def get_metadata_folder(book_folder):
-    return os.path.join(book_folder, "metadata")
-
-
 def get_bookmarks_file_path(book_metadata_folder):
     return os.path.join(book_metadata_folder, "bookmarks.json")
 
@@ -111,211 +209,917 @@ def get_book_settings_file_path(book_metadata_folder):
     return os.path.join(book_metadata_folder, "book_settings.json")
 
 
-def get_annotations_file_path(book_metadata_folder):
-    return os.path.join(book_metadata_folder, "annotations.json")
+def get_page_geometry_file_path(book_metadata_folder):
+    return os.path.join(book_metadata_folder, "page_geometry.json")
+
+
+def get_library_annotations_index_file_path():
+    return os.path.join(_FOLDER_OF_THIS_PYTHON_FILE, "data", "annotations_index.sqlite3")
+
+
+def get_trace_file_path():
+    trace_file_name = f"trace-{datetime.now().strftime(_TRACE_FILE_DATETIME_FORMAT)}.json"
+    return os.path.join(_FOLDER_OF_THIS_PYTHON_FILE, "data", trace_file_name)
+
+
+def get_thumbnails_file_path(book_metadata_folder):
+    return os.path.join(book_metadata_folder, "thumbnails.sqlite3")
+
+
+def get_page_size(page_png_image_path):
+    # PIL reads only the header of the file in Image.open, the pixels are decoded lazily, so, this is cheap
+    from PIL import Image
+    with Image.open(page_png_image_path) as image:
+        return image.size
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def read_png_size(png_image_path):
+    # the width and height are in the IHDR chunk, which is the first chunk, right after the signature, so, only the
+    # first 24 bytes of the file are read: signature (8), chunk length (4), chunk type (4), width (4), height (4)
+    with open(png_image_path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != _PNG_SIGNATURE or header[12:16] != b"IHDR":
+        raise IOError(f"Not a png file: {png_image_path}")
+    return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+
+
+def _read_png_size_or_none(png_image_path):
+    try:
+        return read_png_size(png_image_path)
+    except IOError as e:
+        print("Error: Couldn't read the size of the page:", e)
+        return None
+
+
+def read_page_sizes(book_folder):
+    # (width, height) of each page (index is page num - 1), or None if there is no (valid) png for the page
+    # only the pngs that are new or changed since they were last read (by their size and modification time) are read,
+    # the others are taken from the page geometry file in the book's metadata folder
+    page_file_entries = dict()  # page num to os.DirEntry, see get_page_path
+    for entry in os.scandir(book_folder):
+        name, extension = os.path.splitext(entry.name)
+        if extension.lower() == ".png" and len(name) == 6 and name.isdigit() and int(name) > 0:
+            page_file_entries[int(name)] = entry
+    num_pages = max(page_file_entries.keys(), default=0)
+
+    metadata_folder = get_metadata_folder(book_folder)
+    page_geometry_file_path = get_page_geometry_file_path(metadata_folder)
+    try:
+        with open(page_geometry_file_path) as f:
+            page_geometry = json.loads(f.read())  # page num to [png file size, png mtime in ns, width, height]
+    except IOError:
+        page_geometry = dict()
+    except json.JSONDecodeError:
+        print("Bad json in", page_geometry_file_path)
+        page_geometry = dict()
+
+    page_sizes = [None] * num_pages
+    new_page_geometry = dict()
+    pages_to_read = []  # (page num, png file size, png mtime)
+    for page_num, entry in page_file_entries.items():
+        stat = entry.stat()
+        cached = page_geometry.get(str(page_num))
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            page_sizes[page_num - 1] = tuple(cached[2:])
+            new_page_geometry[str(page_num)] = cached
+        else:
+            pages_to_read.append((page_num, stat.st_size, stat.st_mtime_ns))
+
+    if len(pages_to_read) > 0:
+        if ALLOW_DEBUGGING:
+            print("Reading the sizes of", len(pages_to_read), "pages")
+        with ThreadPoolExecutor(max_workers=NUM_PAGE_GEOMETRY_WORKERS, thread_name_prefix="page-geometry") as executor:
+            sizes = list(executor.map(_read_png_size_or_none,
+                                      [page_file_entries[page_num].path for page_num, _, _ in pages_to_read]))
+        for (page_num, file_size, mtime), size in zip(pages_to_read, sizes):
+            if size is None:
+                continue
+            page_sizes[page_num - 1] = size
+            new_page_geometry[str(page_num)] = [file_size, mtime, *size]
+
+    if new_page_geometry != page_geometry and os.path.isdir(metadata_folder):
+        try:
+            write_file_atomically(page_geometry_file_path, json.dumps(new_page_geometry))
+        except IOError:
+            print("Error: Couldn't write the page geometry file:", page_geometry_file_path)
+
+    return page_sizes
+
+
+def _decode_png(png_image_path):
+    from PIL import Image
+    image = Image.open(png_image_path)
+    image.load()  # the actual decoding; PIL also closes the file after this
+    if image.mode not in ("1", "L", "RGB", "RGBA"):
+        # convert here to a mode that ImageTk.PhotoImage accepts as is, so that the conversion doesn't happen
+        # on the main thread
+        has_transparency = image.mode.endswith("A") or "transparency" in image.info
+        image = image.convert("RGBA" if has_transparency else "RGB")
+    return image
+
+
+def save_pyramid_for_page(book_folder, page_num, page_image):
+    # returns the dict of level to downscaled image, each level is made from the previous one
+    from PIL import Image
+    pyramid = {}
+    image = page_image
+    for level in PYRAMID_LEVELS:
+        image = image.resize(get_zoomed_size(page_image.size, 1 / level), Image.BOX)
+        pyramid[level] = image
+
+        pyramid_page_path = get_pyramid_page_path(book_folder, page_num, level)
+        pyramid_level_folder = os.path.split(pyramid_page_path)[0]
+        try:
+            os.makedirs(pyramid_level_folder, exist_ok=True)
+            # written to a temp file first, so that a partially written file is never read as a page
+            file_descriptor, temp_file_path = tempfile.mkstemp(suffix=".tmp", dir=pyramid_level_folder)
+            with os.fdopen(file_descriptor, "wb") as f:
+                image.save(f, format="PNG", compress_level=1)  # fast compression; these are small files
+            os.replace(temp_file_path, pyramid_page_path)
+        except IOError as e:
+            print(f"Error: Couldn't save level {level} of pyramid for page {page_num}:", e)
+    return pyramid
+
+
+def _decode_pyramid_level(book_folder, page_num, level):
+    page_png_image_path = get_page_path(book_folder, page_num)
+    if level == 1:
+        return _decode_png(page_png_image_path)
+    try:
+        return _decode_png(get_pyramid_page_path(book_folder, page_num, level))
+    except IOError:  # this level of the pyramid isn't made yet for this page
+        return save_pyramid_for_page(book_folder, page_num, _decode_png(page_png_image_path))[level]
+
+
+def decode_page_image(book_folder, page_num, zoom=1):
+    # this runs on a page decode worker thread, so, no tkinter calls must be made here
+    from PIL import Image
+    zoomed_size = get_zoomed_size(get_page_size(get_page_path(book_folder, page_num)), zoom)
+
+    image = _decode_pyramid_level(book_folder, page_num, get_pyramid_level_for_zoom(zoom))
+
+    if image.size != zoomed_size:
+        image = image.resize(zoomed_size, Image.BILINEAR)
+    return image
+
+
+# a lock per page and level being tiled, so that two workers don't cut the tiles of the same page at the same time,
+# while the tiles of the other pages are cut in parallel; keyed by the page's tiles done marker path
+_page_tiling_locks = dict()
+_page_tiling_locks_lock = threading.Lock()  # guards _page_tiling_locks
+
+
+def save_tiles_for_page(book_folder, page_num, level):
+    # the whole page (at the level) has to be decoded once here, because a png can't be decoded partially,
+    # but, this is on a worker thread, and after this, only the required tiles are decoded
+    image = _decode_pyramid_level(book_folder, page_num, level)
+
+    os.makedirs(get_page_tiles_folder(book_folder, page_num, level), exist_ok=True)
+    num_rows, num_cols = get_page_tile_grid(image.size)
+    for row in range(num_rows):
+        for col in range(num_cols):
+            tile = image.crop((col * PAGE_TILE_SIZE, row * PAGE_TILE_SIZE,
+                               min((col + 1) * PAGE_TILE_SIZE, image.width),
+                               min((row + 1) * PAGE_TILE_SIZE, image.height)))
+            tile.save(get_page_tile_path(book_folder, page_num, level, row, col), format="PNG", compress_level=1)
+
+    with open(get_page_tiles_done_marker_path(book_folder, page_num, level), "w"):
+        pass
+
+
+def decode_page_tile(book_folder, page_num, zoom, row, col):
+    # this runs on a page decode worker thread, so, no tkinter calls must be made here
+    from PIL import Image
+    level = get_pyramid_level_for_zoom(zoom)
+    unzoomed_size = get_page_size(get_page_path(book_folder, page_num))
+    level_size = get_zoomed_size(unzoomed_size, 1 / level)
+
+    tiles_done_marker_path = get_page_tiles_done_marker_path(book_folder, page_num, level)
+    if not os.path.isfile(tiles_done_marker_path):
+        with _page_tiling_locks_lock:
+            page_tiling_lock = _page_tiling_locks.setdefault(tiles_done_marker_path, threading.Lock())
+        with page_tiling_lock:
+            if not os.path.isfile(tiles_done_marker_path):  # the tiles may have been cut while waiting for the lock
+                save_tiles_for_page(book_folder, page_num, level)
+        with _page_tiling_locks_lock:  # the marker exists now, so, the lock isn't needed anymore
+            _page_tiling_locks.pop(tiles_done_marker_path, None)
+
+    image = _decode_png(get_page_tile_path(book_folder, page_num, level, row, col))
+
+    x1, y1, x2, y2 = get_page_tile_bbox_on_canvas(row, col, level_size, get_zoomed_size(unzoomed_size, zoom))
+    if image.size != (x2 - x1, y2 - y1):
+        image = image.resize((x2 - x1, y2 - y1), Image.BILINEAR)
+    return image
+
+
+def get_num_bytes_of_image(image):
+    # memory taken by the pixels of a decoded PIL image (PIL uses at least a byte per band per pixel)
+    return image.width * image.height * len(image.getbands())
+
+
+def get_bookmark_subtree_ends(bookmarks):
+    # for each bookmark, the index after the last bookmark nested in it (by the indents), so, the bookmarks nested in
+    # the bookmark at index i are the ones at i + 1 up to (not including) its subtree end
+    subtree_ends = [len(bookmarks)] * len(bookmarks)
+    not_ended = []  # indices of the bookmarks whose subtrees are not ended yet, with increasing indents
+    for i, (indent, _, _) in enumerate(bookmarks):
+        while len(not_ended) > 0 and bookmarks[not_ended[-1]][0] >= indent:
+            subtree_ends[not_ended.pop()] = i
+        not_ended.append(i)
+    return subtree_ends
+
+
+def get_bookmark_parents(bookmarks):
+    # for each bookmark, the index of the bookmark it is directly nested in (by the indents), or None
+    parents = [None] * len(bookmarks)
+    not_ended = []  # same as in get_bookmark_subtree_ends
+    for i, (indent, _, _) in enumerate(bookmarks):
+        while len(not_ended) > 0 and bookmarks[not_ended[-1]][0] >= indent:
+            not_ended.pop()
+        if len(not_ended) > 0:
+            parents[i] = not_ended[-1]
+        not_ended.append(i)
+    return parents
+
+
+def get_page_tops_and_bottoms(page_sizes, zoom):
+    # the pages are laid out one below the other on canvas (i.e. in the document), with PIXELS_BETWEEN_PAGES
+    # between them (and above the first page)
+    # page_sizes are unzoomed; a page without a size (None, i.e. its png isn't there yet, for example, while a pdf is
+    # being imported) is taken to be as large as the page before it (or, the first page that has a size)
+    previous_size = next((size for size in page_sizes if size is not None), (0, 0))
+    page_tops, page_bottoms = [], []
+    y = PIXELS_BETWEEN_PAGES
+    for size in page_sizes:
+        if size is None:
+            size = previous_size
+        previous_size = size
+        page_tops.append(y)
+        y += get_zoomed_size(size, zoom)[1]
+        page_bottoms.append(y)
+        y += PIXELS_BETWEEN_PAGES
+    return page_tops, page_bottoms
+
+
+def get_pyramid_page_path(book_folder, page_num, level):
+    return os.path.join(get_metadata_folder(book_folder), "pyramid", str(level), f'{str(page_num).rjust(6, "0")}.png')
+
+
+def get_pyramid_level_for_zoom(zoom):
+    # the most downscaled level that is still not smaller than the zoom, so that no detail is lost
+    level = 1
+    for pyramid_level in PYRAMID_LEVELS:
+        if 1 / pyramid_level >= zoom:
+            level = pyramid_level
+    return level
+
 
+def get_page_tiles_folder(book_folder, page_num, level):
+    return os.path.join(get_metadata_folder(book_folder), "tiles", str(level), str(page_num).rjust(6, "0"))
 
-def get_page_path(book_folder, page_num):
-    return os.path.join(book_folder, f'{str(page_num).rjust(6, "0")}.png')
+
+def get_page_tile_path(book_folder, page_num, level, row, col):
+    return os.path.join(get_page_tiles_folder(book_folder, page_num, level), f"{row}-{col}.png")
+
+
+def get_page_tiles_done_marker_path(book_folder, page_num, level):
+    # this file is created after all the tiles of the page are saved
+    return os.path.join(get_page_tiles_folder(book_folder, page_num, level), "done")
+
+
+def is_tiled_page_size(zoomed_size):
+    width, height = zoomed_size
+    return width * height > TILED_PAGE_MIN_PIXELS
+
+
+def get_page_tile_grid(level_size):
+    # returns num rows, num cols
+    width, height = level_size
+    return math.ceil(height / PAGE_TILE_SIZE), math.ceil(width / PAGE_TILE_SIZE)
+
+
+def get_page_tile_bbox_on_canvas(row, col, level_size, zoomed_size):
+    # the tile's rectangle on canvas relative to the page's north-west corner
+    # the edges are rounded in the same way for neighboring tiles, so, there are no gaps between them
+    level_width, level_height = level_size
+    zoomed_width, zoomed_height = zoomed_size
+    scale_x = zoomed_width / level_width
+    scale_y = zoomed_height / level_height
+    x1 = round(col * PAGE_TILE_SIZE * scale_x)
+    y1 = round(row * PAGE_TILE_SIZE * scale_y)
+    x2 = round(min((col + 1) * PAGE_TILE_SIZE, level_width) * scale_x)
+    y2 = round(min((row + 1) * PAGE_TILE_SIZE, level_height) * scale_y)
+    return x1, y1, x2, y2
+
+
+def get_zoomed_size(size, zoom):
+    width, height = size
+    return max(1, round(width * zoom)), max(1, round(height * zoom))
 
 
 def get_page_num_tag(page_num):
     return f"{PREFIX_TAG_PAGE_NUM}-{page_num}"
 
 
-def get_tag_annotation_deltas(dx, dy):
-    return f"{PREFIX_TAG_ANNOTATION_DELTAS}_{int(dx)}_{int(dy)}"
+def prune_recently_opened_books(recently_opened_books, num_books_to_keep=NUM_BOOKS_TO_STORE_IN_RECENTLY_OPENED_BOOKS):
+    # removes all but the most recently opened books from the dict of book folder to the time it was opened (in
+    # _DATETIME_FORMAT_TO_SAVE, which sorts in the order of time)
+    if len(recently_opened_books) > num_books_to_keep:
+        books_ordered_by_most_recent = sorted(recently_opened_books.keys(),
+                                              key=lambda x: recently_opened_books[x], reverse=True)
+        for book_folder in books_ordered_by_most_recent[num_books_to_keep:]:
+            recently_opened_books.pop(book_folder)
+    return recently_opened_books
+
+
+class _SettingsWriter:
+    # writes the settings files on a background thread, atomically (see write_file_atomically), so that the gui
+    # never waits for the disk
+    # the writes to a file are debounced: a file is written a delay after the first change to it since it was last
+    # written, with the latest contents, so, a burst of changes is one write
+    # the contents are serialized by the caller (on the gui thread), so, the settings dicts are never read while
+    # they change
+    # the thread isn't a daemon, so, the pending writes are done even after the gui is closed (see close)
+
+    def __init__(self, delay=SETTINGS_WRITE_DELAY):
+        self._delay = delay
+        self._condition = threading.Condition()
+        self._pending_writes = dict()  # file path to (text, time to write at)
+        self._writes_in_progress = dict()  # file path to text
+        self._is_closed = False
+        self._thread = threading.Thread(target=self._run, name="settings-writer")
+        self._thread.start()
+
+    def write(self, file_path, text, delay=None):
+        # delay: None => the default delay, 0 => as soon as possible (the contents are final, e.g. on closing a book)
+        delay = self._delay if delay is None else delay
+        with self._condition:
+            if self._is_closed:
+                self._write(file_path, text)
+                return
+            write_at = time.monotonic() + delay
+            if file_path in self._pending_writes:  # not later than the first change asked for
+                write_at = min(write_at, self._pending_writes[file_path][1])
+            self._pending_writes[file_path] = (text, write_at)
+            self._condition.notify()
+
+    def read(self, file_path):
+        # the contents of the file, as they will be once the pending writes to it are done
+        with self._condition:
+            if file_path in self._pending_writes:
+                return self._pending_writes[file_path][0]
+            if file_path in self._writes_in_progress:
+                return self._writes_in_progress[file_path]
+        with open(file_path) as f:
+            return f.read()
+
+    def close(self):
+        # doesn't wait for the pending writes; they are done right away by the thread, which then ends
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify()
+
+    @staticmethod
+    def _write(file_path, text):
+        try:
+            write_file_atomically(file_path, text)
+        except OSError as e:
+            print("Error: Couldn't write to", file_path, ":", e)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    # if the gui thread ended without closing this (after an error), the pending writes are done
+                    is_closing = self._is_closed or not threading.main_thread().is_alive()
+                    now = time.monotonic()
+                    due_file_paths = [file_path for file_path, (_, write_at) in self._pending_writes.items()
+                                      if is_closing or write_at <= now]
+                    if len(due_file_paths) > 0 or is_closing:
+                        break
+                    next_write_at = min((write_at for _, write_at in self._pending_writes.values()),
+                                        default=now + SETTINGS_WRITER_IDLE_CHECK_INTERVAL)
+                    self._condition.wait(min(next_write_at - now, SETTINGS_WRITER_IDLE_CHECK_INTERVAL))
+                for file_path in due_file_paths:
+                    self._writes_in_progress[file_path] = self._pending_writes.pop(file_path)[0]
+
+            for file_path in due_file_paths:
+                self._write(file_path, self._writes_in_progress[file_path])
+                with self._condition:
+                    self._writes_in_progress.pop(file_path)
+
+            if is_closing:
+                return
 
 
-def get_dx_dy_from_tag_annotation_deltas(tag_annotation_deltas):
-    _, dx, dy = str.rsplit(tag_annotation_deltas, "_", 2)  # 2 breaking points from right side at the split char
-    return int(dx), int(dy)
+class _LibraryAnnotationsIndex:
+    # the text annotations of all the recently opened books in a sqlite file, so that they can be searched without
+    # opening the books; a book is read again only if its annotations file or journal changed since it was indexed,
+    # and, the pages of the opened book are updated as they change (see set_page)
 
+    def __init__(self, file_path):
+        self._connection = sqlite3.connect(file_path, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # books: the state (mtime and size) of the annotations file and journal of the book when it was indexed
+        self._connection.execute("CREATE TABLE IF NOT EXISTS books (book TEXT PRIMARY KEY, files_state TEXT)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS texts"
+                                 " (book TEXT, page INTEGER, dx INTEGER, dy INTEGER, text TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS texts_book_page ON texts (book, page)")
+        self._connection.commit()
 
-class _QueryTextAnnotationDialog(simpledialog.Dialog):
+    @staticmethod
+    def _get_files_state(book_folder):
+        metadata_folder = get_metadata_folder(book_folder)
+        files_state = []
+        for file_path in (get_annotations_file_path(metadata_folder),
+                          get_annotations_journal_file_path(metadata_folder)):
+            try:
+                stat = os.stat(file_path)
+                files_state.append([stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                files_state.append(None)
+        return json.dumps(files_state)
 
-    def __init__(self, title, prompt, initial_value=None, parent=None,
-                 text_anchor=ANNOTATION_TEXT_DEFAULT_ANCHOR, text_justify=ANNOTATION_TEXT_DEFAULT_JUSTIFY):
+    @staticmethod
+    def _get_text_rows(book_folder, page_num, page_annotations):
+        return [(book_folder, page_num, a[0], a[1], a[3]) for a in page_annotations if a[2] == TAG_TEXT]
+
+    def update_books(self, book_folders):
+        # indexes the books that changed since they were indexed, and, removes the books that are not given
+        indexed_books = dict(self._connection.execute("SELECT book, files_state FROM books"))
+        with self._connection:
+            for book_folder in set(indexed_books) - set(book_folders):
+                self._connection.execute("DELETE FROM texts WHERE book = ?", (book_folder,))
+                self._connection.execute("DELETE FROM books WHERE book = ?", (book_folder,))
+            for book_folder in book_folders:
+                files_state = self._get_files_state(book_folder)
+                if indexed_books.get(book_folder) == files_state:
+                    continue
+                if ALLOW_DEBUGGING:
+                    print("Index annotations of", book_folder)
+                annotations = read_annotations(get_metadata_folder(book_folder))
+                self._connection.execute("DELETE FROM texts WHERE book = ?", (book_folder,))
+                for page_num, page_annotations in annotations.items():
+                    self._connection.executemany("INSERT INTO texts VALUES (?, ?, ?, ?, ?)",
+                                                 self._get_text_rows(book_folder, int(page_num), page_annotations))
+                self._connection.execute("INSERT OR REPLACE INTO books VALUES (?, ?)", (book_folder, files_state))
+
+    def set_page(self, book_folder, page_num, page_annotations):
+        # after the page's annotations are saved to the book's journal
+        with self._connection:
+            self._connection.execute("DELETE FROM texts WHERE book = ? AND page = ?", (book_folder, page_num))
+            self._connection.executemany("INSERT INTO texts VALUES (?, ?, ?, ?, ?)",
+                                         self._get_text_rows(book_folder, page_num, page_annotations))
+            # only a book that update_books indexed fully is marked as up to date; otherwise, its other pages would
+            # never be indexed
+            self._connection.execute("UPDATE books SET files_state = ? WHERE book = ?",
+                                     (self._get_files_state(book_folder), book_folder))
+
+    def search(self, query, max_num_results=LIBRARY_ANNOTATIONS_MAX_SEARCH_RESULTS):
+        # list of (book folder, page num, dx, dy, text) of the text annotations that contain the query
+        # (case-insensitively), in the order of books and then positions in the books
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return self._connection.execute("SELECT book, page, dx, dy, text FROM texts WHERE text LIKE ? ESCAPE '\\'"
+                                        " ORDER BY book, page, dy, dx LIMIT ?", (pattern, max_num_results)).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+
+class _PerformanceStats:
+    # the most recent durations of each measured operation, and, while tracing, all the measurements as trace events
+    # (chrome's trace event format, which can be opened in chrome://tracing or https://ui.perfetto.dev)
+    # the decodes are measured on the worker threads, hence the lock
 
-        self.prompt = prompt
-        self.initial_value = initial_value
-        self.entry = None
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = dict()  # operation name to deque of the most recent durations in seconds
+        self._trace_events = None  # list while tracing
 
-        self._initial_text_anchor = text_anchor
-        self._initial_text_justify = text_justify
+    @contextmanager
+    def measure(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start_time, time.perf_counter())
+
+    def call_measured(self, name, function, *args):
+        with self.measure(name):
+            return function(*args)
+
+    def record(self, name, start_time, end_time):
+        with self._lock:
+            if name not in self._durations:
+                self._durations[name] = deque(maxlen=PERFORMANCE_NUM_SAMPLES)
+            self._durations[name].append(end_time - start_time)
+            if self._trace_events is not None:
+                self._trace_events.append({"name": name, "ph": "X", "ts": start_time * 1e6,
+                                           "dur": (end_time - start_time) * 1e6,
+                                           "pid": os.getpid(), "tid": threading.get_ident()})
+
+    def get_names(self):
+        with self._lock:
+            return sorted(self._durations.keys())
+
+    def get_percentiles(self, name, percentiles=PERFORMANCE_PERCENTILES):
+        # in seconds, the nearest-rank percentiles of the most recent durations
+        with self._lock:
+            durations = sorted(self._durations.get(name, ()))
+        if len(durations) == 0:
+            return None
+        return [durations[min(len(durations) - 1, math.ceil(p / 100 * len(durations)) - 1)] for p in percentiles]
 
-        self._selected_bg = "light blue"
-        self._deselected_bg = "white"
-        self._buttons_for_text_anchor = {}
-        self._buttons_for_text_justify = {}
+    def get_num_samples(self, name):
+        with self._lock:
+            return len(self._durations.get(name, ()))
 
-        simpledialog.Dialog.__init__(self, parent, title)
+    def is_tracing(self):
+        return self._trace_events is not None
 
-    def destroy(self):
-        self.entry = None
-        self._buttons_for_text_anchor = None
-        self._buttons_for_text_justify = None
-        simpledialog.Dialog.destroy(self)
-
-    def body(self, master):
-        w = tk.Label(master, text=self.prompt, justify=tk.LEFT)
-        w.grid(row=0, column=0, columnspan=2, sticky="w")
-
-        # the text widget
-        self.entry = scrolledtext.ScrolledText(master)
-        self.entry.grid(row=1, column=0, columnspan=2, sticky="ew")
-        if self.initial_value is not None:
-            self.entry.insert("1.0", self.initial_value)
-
-        # the text anchor buttons:
-
-        label_frame_anchor = ttk.Labelframe(master, text="Anchor:")
-        label_frame_anchor.grid(row=2, column=0, sticky='nw')
-
-        anchors = "nw n ne w c e sw s se".split()
-        for i in range(len(anchors)):
-            a = anchors[i]
-            button = tk.Button(
-                label_frame_anchor, text=a, relief=tk.FLAT,
-                bg=self._selected_bg if a == self._initial_text_anchor else self._deselected_bg)
-            button.grid(row=i//3, column=i % 3, sticky='ew')
-            button.bind("<Button-1>", self._select_this_anchor)
-            self._buttons_for_text_anchor[str(button)] = button
-
-        # the text justify buttons:
-
-        label_frame_justify = ttk.Labelframe(master, text="Justify:")
-        label_frame_justify.grid(row=2, column=1, sticky="nw")
-        master.columnconfigure(1, weight=1)  # so that this labelframe and the text-anchor label frame look side-by-side
-
-        justifies = "left center right".split()
-        for i in range(len(justifies)):
-            j = justifies[i]
-            button = tk.Button(
-                label_frame_justify, text=j, relief=tk.FLAT,
-                bg=self._selected_bg if j == self._initial_text_justify else self._deselected_bg)
-            button.grid(row=0, column=i)
-            button.bind("<Button-1>", self._select_this_justify)
-            self._buttons_for_text_justify[str(button)] = button
-
-        return self.entry  # this will have initial focus
-
-    def buttonbox(self):
-        super(_QueryTextAnnotationDialog, self).buttonbox()
-        self.unbind("<Return>")  # by default, in super class' buttonbox function, the Return event on "self" is bound
-        # to self.ok function which closes the dialog and returns the result, but, for text, we need Return to just
-        # take the cursor to the next line, so, we unbind the above event AFTER the call to superclass' buttonbox is
-        # finished. We can bind "Control-Return" instead as follows  // https://stackoverflow.com/a/62115918
-        self.bind("<Control-Return>", self.ok)
-
-    def validate(self):
-        text = self.entry.get("1.0", tk.END)
-
-        anchor = None
-        for i in self._buttons_for_text_anchor:
-            if self._buttons_for_text_anchor[i].cget("bg") == self._selected_bg:
-                anchor = self._buttons_for_text_anchor[i].cget("text")
-                break
-        if anchor is None:
-            anchor = ANNOTATION_TEXT_DEFAULT_ANCHOR
-
-        justify = None
-        for i in self._buttons_for_text_justify:
-            if self._buttons_for_text_justify[i].cget("bg") == self._selected_bg:
-                justify = self._buttons_for_text_justify[i].cget("text")
-                break
-        if justify is None:
-            justify = ANNOTATION_TEXT_DEFAULT_JUSTIFY
-
-        self.result = text, anchor, justify
-        return 1
-
-    def _select_this_anchor(self, event):
-        for i in self._buttons_for_text_anchor:
-            self._buttons_for_text_anchor[i].configure(bg=self._deselected_bg)
-        self._buttons_for_text_anchor[str(event.widget)].configure(bg=self._selected_bg)
-
-    def _select_this_justify(self, event):
-        for i in self._buttons_for_text_justify:
-            self._buttons_for_text_justify[i].configure(bg=self._deselected_bg)
-        self._buttons_for_text_justify[str(event.widget)].configure(bg=self._selected_bg)
-
-
-def ask_text(title, prompt, initial_value=None,
-             text_anchor=ANNOTATION_TEXT_DEFAULT_ANCHOR, text_justify=ANNOTATION_TEXT_DEFAULT_JUSTIFY):
-    d = _QueryTextAnnotationDialog(title, prompt, initial_value, text_anchor=text_anchor, text_justify=text_justify)
-    return d.result
-
-
-class _QueryRecentBooksDialog(simpledialog.Dialog):
-
-    def __init__(self, title, prompt, recent_books, parent=None):
-        self._prompt = prompt
-        self._recent_books = recent_books
-        self._book_button_widgets = {}
-
-        self._selected_bg = "light blue"
-        self._deselected_bg = "white"
-
-        simpledialog.Dialog.__init__(self, parent, title)
+    def get_num_trace_events(self):
+        with self._lock:
+            return 0 if self._trace_events is None else len(self._trace_events)
 
-    def destroy(self):
-        self._book_button_widgets = None
-        simpledialog.Dialog.destroy(self)
+    def start_trace(self):
+        with self._lock:
+            self._trace_events = []
 
-    def body(self, master):
-        w = tk.Label(master, text=self._prompt, justify=tk.LEFT)
-        w.grid(row=0, column=0, sticky='w')
+    def stop_trace(self, trace_file_path):
+        with self._lock:
+            trace_events, self._trace_events = self._trace_events, None
+        write_file_atomically(trace_file_path, json.dumps({"traceEvents": trace_events, "displayTimeUnit": "ms"}))
 
-        frame = ttk.Frame(master)
-        frame.grid(row=1, column=0, sticky='w')
 
-        for i in range(len(self._recent_books)):
-            book_path = self._recent_books[i]
-            book_name = os.path.split(book_path)[-1]
+def _import_pil():
+    # at startup, on a worker thread, see the note at the imports
+    from PIL import Image, ImageTk  # noqa: F401
 
-            button = tk.Button(frame, text=book_name, bg=self._deselected_bg, relief="flat", anchor="w")
-            button.grid(row=i, column=0, sticky="ew")
 
-            button.bind("<Button-1>", self._select_this)
+def _measured(method):
+    # measures the time of a PdfViewer method, see _PerformanceStats
+    @functools.wraps(method)
+    def measured_method(self, *args, **kwargs):
+        with self._performance_stats.measure(method.__name__):
+            return method(self, *args, **kwargs)
+    return measured_method
 
-            self._book_button_widgets[str(button)] = button
 
-            button.book_path = book_path
+class _AnnotationsIndex:
+    # the page numbers that have annotations, in sorted order, and for each of those pages, the positions of its
+    # annotations sorted by (y, x), so that the next or previous annotation of a position is a binary search
+    # a position is (page num, (dy, dx, annotation type)), where dy and dx are relative to the page (unzoomed)
 
-    def validate(self):
-        result = None
-        for i in self._book_button_widgets:
-            button = self._book_button_widgets[i]
-            if button.cget("bg") == self._selected_bg:
-                result = button.book_path
-                break
-        self.result = result
-        return 1
+    def __init__(self):
+        self._page_nums = []
+        self._dict_page_num_to_positions = dict()
+
+    def build(self, annotations):
+        # annotations: {page num: list of _Annotation}
+        self._page_nums.clear()
+        self._dict_page_num_to_positions.clear()
+        for page_num, page_annotations in annotations.items():
+            self.set_page(page_num, page_annotations)
+
+    def set_page(self, page_num, page_annotations):
+        # page_annotations: list of _Annotation
+        positions = sorted(a.get_position() for a in page_annotations)
+        has_page = page_num in self._dict_page_num_to_positions
+        if len(positions) == 0:
+            if has_page:
+                self._dict_page_num_to_positions.pop(page_num)
+                self._page_nums.pop(bisect.bisect_left(self._page_nums, page_num))
+            return
+        if not has_page:
+            bisect.insort(self._page_nums, page_num)
+        self._dict_page_num_to_positions[page_num] = positions
+
+    def get_next(self, position):
+        # the first annotation after the position, or None
+        page_num, position_in_page = position
+        positions = self._dict_page_num_to_positions.get(page_num, [])
+        i = bisect.bisect_right(positions, position_in_page)
+        if i < len(positions):
+            return page_num, positions[i]
+        i = bisect.bisect_right(self._page_nums, page_num)
+        if i < len(self._page_nums):
+            next_page_num = self._page_nums[i]
+            return next_page_num, self._dict_page_num_to_positions[next_page_num][0]
+        return None
+
+    def get_previous(self, position):
+        # the last annotation before the position, or None
+        page_num, position_in_page = position
+        positions = self._dict_page_num_to_positions.get(page_num, [])
+        i = bisect.bisect_left(positions, position_in_page)
+        if i > 0:
+            return page_num, positions[i - 1]
+        i = bisect.bisect_left(self._page_nums, page_num)
+        if i > 0:
+            previous_page_num = self._page_nums[i - 1]
+            return previous_page_num, self._dict_page_num_to_positions[previous_page_num][-1]
+        return None
+
+
+class _SpatialGrid:
+    # the bboxes of items (in canvas coordinates) in a uniform grid of square cells, so that the items at a point
+    # are found by looking in the cells around the point, however many items there are; an item is in every cell
+    # that its bbox overlaps (an annotation is smaller than a cell, so, it is in a few cells at most)
+
+    def __init__(self, cell_size=ANNOTATIONS_GRID_CELL_SIZE):
+        self._cell_size = cell_size
+        self._dict_cell_to_items = dict()  # (column, row) to set of items
+        self._dict_item_to_bbox = dict()
+
+    def __len__(self):
+        return len(self._dict_item_to_bbox)
+
+    def _get_cells(self, bbox):
+        x1, y1, x2, y2 = bbox
+        c = self._cell_size
+        return [(column, row)
+                for column in range(math.floor(x1 / c), math.floor(x2 / c) + 1)
+                for row in range(math.floor(y1 / c), math.floor(y2 / c) + 1)]
+
+    def insert(self, item, bbox):
+        self.remove(item)
+        self._dict_item_to_bbox[item] = tuple(bbox)
+        for cell in self._get_cells(bbox):
+            self._dict_cell_to_items.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        bbox = self._dict_item_to_bbox.pop(item, None)
+        if bbox is None:
+            return
+        for cell in self._get_cells(bbox):
+            items = self._dict_cell_to_items[cell]
+            items.discard(item)
+            if len(items) == 0:
+                self._dict_cell_to_items.pop(cell)
+
+    def move(self, item, dx, dy):
+        x1, y1, x2, y2 = self._dict_item_to_bbox[item]
+        self.insert(item, (x1 + dx, y1 + dy, x2 + dx, y2 + dy))
+
+    def clear(self):
+        self._dict_cell_to_items.clear()
+        self._dict_item_to_bbox.clear()
+
+    def get_bbox(self, item):
+        return self._dict_item_to_bbox[item]
+
+    def find_at(self, x, y, padding=0):
+        # the items whose bboxes, grown by the padding, contain the point
+        found = []
+        for cell in self._get_cells((x - padding, y - padding, x + padding, y + padding)):
+            for item in self._dict_cell_to_items.get(cell, ()):
+                x1, y1, x2, y2 = self._dict_item_to_bbox[item]
+                if x1 - padding <= x <= x2 + padding and y1 - padding <= y <= y2 + padding and item not in found:
+                    found.append(item)
+        return found
+
+
+class _DecodedPageCache:
+    # keeps decoded page images (PIL images, which are ready to be made into ImageTk.PhotoImage) for reuse,
+    # the least recently used ones are evicted when the total size goes beyond the memory budget
+    # the keys are (page num, zoom) for a whole page, or, (page num, zoom, row, col) for a tile of a page (see
+    # decode_page_tile), so, a page decoded at another zoom is a different entry
+    # this is independent of the pages on canvas, so, pages that were removed from canvas can be shown again
+    # without decoding them again, for example, when jumping back and forth between two chapters
+
+    def __init__(self, max_size_mb):
+        self.max_num_bytes = max_size_mb * 1024 * 1024
+        self.num_bytes = 0
+        self._images = OrderedDict()  # key to decoded image, the least recently used one is the first
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+
+    def __contains__(self, key):
+        return key in self._images  # note: this doesn't count as a use of the image
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key):
+        image = self._images.get(key)
+        if image is None:
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        self._images.move_to_end(key)  # the most recently used one is the last
+        return image
+
+    def put(self, key, image):
+        self.remove(key)
+        num_bytes = get_num_bytes_of_image(image)
+        if num_bytes > self.max_num_bytes:
+            return  # can't be kept even if everything else is evicted
+        self._images[key] = image
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_num_bytes:
+            _, evicted_image = self._images.popitem(last=False)
+            self.num_bytes -= get_num_bytes_of_image(evicted_image)
+            self.num_evictions += 1
+
+    def remove(self, key):
+        image = self._images.pop(key, None)
+        if image is not None:
+            self.num_bytes -= get_num_bytes_of_image(image)
+
+    def clear(self):
+        self._images.clear()
+        self.num_bytes = 0
+
+    def get_stats(self):
+        return {"pages": len(self._images), "mb": self.num_bytes / (1024 * 1024),
+                "hits": self.num_hits, "misses": self.num_misses, "evictions": self.num_evictions}
+
+
+def make_thumbnail_png(book_folder, page_num):
+    # the smallest pyramid level, if it is already made, is much faster to decode than the page itself
+    from PIL import Image
+    try:
+        image = _decode_png(get_pyramid_page_path(book_folder, page_num, PYRAMID_LEVELS[-1]))
+    except IOError:
+        image = _decode_png(get_page_path(book_folder, page_num))
+    image.thumbnail(THUMBNAIL_MAX_SIZE, Image.BILINEAR, reducing_gap=2.0)
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    return png.getvalue()
+
+
+def open_thumbnails_db(book_metadata_folder):
+    connection = sqlite3.connect(get_thumbnails_file_path(book_metadata_folder), timeout=10)
+    connection.execute("PRAGMA journal_mode=WAL")  # so that the gui can read while the builder thread writes
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS thumbnails"
+                       " (page INTEGER PRIMARY KEY, png_mtime INTEGER, png_size INTEGER, png BLOB)")
+    connection.commit()
+    return connection
+
+
+class _ThumbnailBuilder(threading.Thread):
+    # makes the missing or outdated thumbnails of a book, the pages asked for by prioritize() are made first,
+    # and the page number of each made thumbnail is put into the made_thumbnails queue
+
+    def __init__(self, book_folder, num_pages):
+        threading.Thread.__init__(self, name="thumbnail-builder", daemon=True)
+        self._book_folder = book_folder
+        self._num_pages = num_pages
+        self._lock = threading.Lock()
+        self._priority_pages = []
+        self._stop_event = threading.Event()
+        self.made_thumbnails = queue.Queue()
+
+    def prioritize(self, page_nums):
+        with self._lock:
+            self._priority_pages = list(page_nums)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _get_next_page(self, done_pages, next_page_in_order):
+        with self._lock:
+            while len(self._priority_pages) > 0:
+                page_num = self._priority_pages.pop(0)
+                if page_num not in done_pages:
+                    return page_num
+        while next_page_in_order <= self._num_pages and next_page_in_order in done_pages:
+            next_page_in_order += 1
+        return next_page_in_order
+
+    def run(self):
+        try:
+            connection = open_thumbnails_db(get_metadata_folder(self._book_folder))
+        except sqlite3.Error as e:
+            print("Error: Couldn't open the thumbnails file:", e)
+            return
 
-    def _select_this(self, event):
-        for i in self._book_button_widgets:
-            self._book_button_widgets[i].configure(bg=self._deselected_bg)
-        self._book_button_widgets[str(event.widget)].configure(bg=self._selected_bg)
+        done_pages = set()
+        next_page_in_order = 1
+        try:
+            while not self._stop_event.is_set():
+                page_num = self._get_next_page(done_pages, next_page_in_order)
+                if page_num > self._num_pages:
+                    break
+                if page_num == next_page_in_order:
+                    next_page_in_order += 1
+                done_pages.add(page_num)
 
+                try:
+                    stat = os.stat(get_page_path(self._book_folder, page_num))
+                except OSError:
+                    continue
+                row = connection.execute("SELECT png_mtime, png_size FROM thumbnails WHERE page = ?",
+                                         (page_num,)).fetchone()
+                if row == (stat.st_mtime_ns, stat.st_size):
+                    continue  # the thumbnail is up-to-date
 
-def ask_recent_book(title, prompt, recent_books):
-    d = _QueryRecentBooksDialog(title, prompt, recent_books)
-    return d.result
+                try:
+                    png = make_thumbnail_png(self._book_folder, page_num)
+                except (IOError, SyntaxError) as e:
+                    print(f"Error: Couldn't make thumbnail of page {page_num}:", e)
+                    continue
+                connection.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)",
+                                   (page_num, stat.st_mtime_ns, stat.st_size, png))
+                connection.commit()  # committed per page, so that an interrupted build is continued next time
+                self.made_thumbnails.put(page_num)
+        except sqlite3.Error as e:
+            print("Error: Couldn't write to the thumbnails file:", e)
+        finally:
+            connection.close()
 
 
 class PdfViewer(tk.Tk):
 
-    def __init__(self):
+    def __init__(self, profile_startup=False):
         tk.Tk.__init__(self)
         self.set_default_title()
 
-        self._gui_settings = dict()
+        # (name, time) of the steps of the startup, if they are to be reported, see _mark_startup
+        self._startup_milestones = [("imports done", _IMPORTS_DONE_TIME)] if profile_startup else None
+        self._book_to_restore = None  # the last opened book, until it is loaded, see _finish_startup
 
-        self._dict_page_num_to_image = dict()
-        self._dict_canvas_id_to_page_num = dict()
-        self._dict_page_num_to_canvas_id = dict()
-        self._annotations = dict()
+        self._gui_settings = dict()
+        self._settings_writer = _SettingsWriter()  # the gui settings and the book settings are written through this
+
+        self._performance_stats = _PerformanceStats()  # see _measured
+        self._frame_start_time = None  # of the frame being measured, see _measure_frame
+        self._performance_overlay_after_id = None  # not None while the performance overlay is shown
+
+        self._dict_page_num_to_image = dict()  # the value is None while the page is being decoded
+        self._dict_canvas_id_to_page_num = dict()  # both page rectangles and decoded images on top of them
+        self._dict_page_num_to_canvas_id = dict()  # page rectangles
+        self._dict_page_num_to_decoded_image_canvas_id = dict()
+        self._dict_page_num_to_unzoomed_size = dict()
+        self._dict_page_num_to_tiles = dict()  # only for tiled pages; (row, col) to (canvas id, ImageTk.PhotoImage)
+
+        # every page has a fixed place on canvas (the document), and the canvas is scrolled with its yview, so,
+        # scrolling doesn't move the objects on canvas; only the pages near the visible area are on canvas
+        self._page_sizes = []  # unzoomed (width, height) of each page (index is page num - 1); None if no png yet
+        self._page_tops = []  # y on canvas of the top of each page, at the current zoom
+        self._page_bottoms = []
+        self._bookmarks = []  # of the currently opened book: [indent, title, page num]; index + 1 is its line
+        self._bookmark_subtree_ends = []  # see get_bookmark_subtree_ends
+        self._bookmark_parents = []  # see get_bookmark_parents
+        self._bookmark_indices_by_page_num = []  # indices of the bookmarks sorted by their page nums, for bisect
+        self._bookmark_page_nums = []  # the page nums in the above order
+        self._current_bookmark_line = None  # the highlighted line in the bookmarks panel
+        self._collapsed_bookmarks = set()  # indices
+        self._bookmarks_insert_after_id = None  # not None while the bookmarks panel is being filled
+        self._bookmarks_scroll_positions_to_restore = ((0, 1), (0, 1))  # once the bookmarks panel is filled
+
+        self._annotations = dict()  # page num to list of _Annotation, of the currently opened book
+        # the annotations of the pages on canvas, and their canvas items, both ways (the canvas item's page num is
+        # kept, so that the annotation can be removed from its page)
+        self._dict_canvas_id_to_annotation = dict()  # canvas id to (page num, _Annotation)
+        self._dict_annotation_to_canvas_id = dict()
+        self._annotations_grid = _SpatialGrid()  # the bboxes of the annotations on canvas, for hit-testing
+        self._highlighted_annotation_id = None  # the canvas id of the highlighted annotation, see _highlight_annotation
+        self._annotations_journal = None  # of the currently opened book, see _read_annotations
+        self._annotations_index = _AnnotationsIndex()  # kept in sync with self._annotations
+        self._library_annotations_index = None  # opened when first needed, see _get_library_annotations_index
+        self._library_annotations_search_query = ""  # the last one, shown when searching again
+
+        # png files are decoded on worker threads, and the decoded images are picked up on the main thread by polling
+        # with "after", because, tkinter must only be called from the main thread
+        self._page_decode_executor = ThreadPoolExecutor(max_workers=NUM_PAGE_DECODE_WORKERS,
+                                                        thread_name_prefix="page-decode")
+        self._page_decode_futures = dict()  # (page num, zoom) to future of the decoded PIL image
+        self._page_tile_decode_futures = dict()  # (page num, zoom, row, col) to future of the decoded PIL image
+        self._page_decode_poll_after_id = None
+
+        # pages ahead of the scroll direction are decoded into the decoded page cache (created after the gui settings
+        # are loaded), see _prefetch_pages
+        self._decoded_page_cache = None
+        self._prefetch_page_range = NUM_PAGE_IMAGE_RANGE_TO_KEEP
+        self._zoom = 1  # pages are shown at this times their size; annotations are stored unzoomed
+        self._pending_scroll_amount = 0  # pixels accumulated from the scroll events, yet to be scrolled
+        self._scroll_after_id = None  # not None while scrolling, see _scroll_one_frame
+        self._scroll_direction = 0  # 1 => towards higher page numbers, -1 => towards lower page numbers
+        self._scroll_speed = 0.0  # pixels per millisecond
+        self._last_scroll_event_time = None  # milliseconds (tkinter's event.time)
+
+        self._num_pages = 0
+        self._thumbnails_db = None  # sqlite connection used to read the thumbnails, see _ThumbnailBuilder
+        self._thumbnail_builder = None
+        self._thumbnail_poll_after_id = None
+        self._dict_page_num_to_thumbnail = dict()  # only of the thumbnails on the canvas; None if not made yet
+
+        self._text_index_builder_process = None  # of the currently opened book, see _start_text_index_builder
+        self._text_index_builder_after_id = None
+        self._search_query = ""  # the last one, shown when searching again
+        self._search_hits = None  # (page num, unzoomed bboxes) of the highlighted hits
+
+        self._pdf_import_book_folder = None  # not None while a pdf is being imported
+        self._pdf_import_progress = queue.Queue()  # filled by the import thread, read by _poll_pdf_import_progress
+        self._pdf_import_stop_event = threading.Event()
 
         # a frame for bookmarks
         # it holds a text and 2 scrolls (horizontal and vertical)
@@ -347,14 +1151,41 @@ class PdfViewer(tk.Tk):
         self._size_grip_like_frame = tk.Frame(self._frame_bookmarks, bg="blue")
         self._size_grip_like_frame.grid(row=1, column=1, sticky='news')
 
+        # a frame for thumbnails
+        # it holds a canvas and a vertical scroll
+
+        self._frame_thumbnails = tk.Frame(self)
+        self._frame_thumbnails.grid(row=0, column=1, sticky='ns')
+
+        self._canvas_thumbnails = tk.Canvas(self._frame_thumbnails, width=THUMBNAIL_PANEL_WIDTH, bg="white",
+                                            yscrollincrement=THUMBNAIL_ROW_HEIGHT)
+        self._canvas_thumbnails.grid(row=0, column=0, sticky='ns')
+        self._frame_thumbnails.rowconfigure(0, weight=1)
+
+        self._v_scroll_thumbnails = ttk.Scrollbar(self._frame_thumbnails, orient=tk.VERTICAL,
+                                                  command=self._canvas_thumbnails.yview)
+        self._v_scroll_thumbnails.grid(row=0, column=1, sticky='ns')
+
+        self._canvas_thumbnails.configure(yscrollcommand=self._y_scroll_in_canvas_thumbnails)
+
         # the canvas to show images
 
-        self._canvas = tk.Canvas(self, bg="light green")
+        self._canvas = tk.Canvas(self, bg="light green", xscrollincrement=1, yscrollincrement=1)  # scroll by pixels
         self._canvas.grid(row=0, column=2, sticky='news')
         self.columnconfigure(2, weight=1)
 
+        # the performance overlay is made when it is first shown, see _toggle_performance_overlay
+        self._label_performance_overlay = None
+
+        self._mark_startup("window built")
         self._load_gui_settings()
 
+        self._decoded_page_cache = _DecodedPageCache(
+            self._gui_settings.setdefault(KEY_DECODED_PAGE_CACHE_SIZE_MB, DEFAULT_DECODED_PAGE_CACHE_SIZE_MB))
+
+        if not self._gui_settings.get(KEY_SHOW_THUMBNAILS, True):
+            self._frame_thumbnails.grid_remove()
+
         # bindings
 
         self._size_grip_like_frame.bind("<Button-1>", self._left_click_on_size_grip_like_frame)
@@ -374,18 +1205,79 @@ class PdfViewer(tk.Tk):
         self._canvas.bind("<MouseWheel>", self._mouse_wheel_in_canvas)
         # this is working as expected to work, i.e. even though focus is in some other widget, if mouse is scrolled
         # in this widget, the event is being registered
+        self._canvas.bind("<Configure>", lambda _: self._update_pages_on_canvas())
 
         self._canvas.bind("<Button-2>", self._event_handler_for_arrow_annotation)  # middle click
         self._canvas.bind("<Control-Button-2>", self._event_handler_for_text_annotation)  # control-middle click
         self._canvas.bind("<Button-3>", self._event_handler_for_remove_annotation)  # right click
 
+        self._canvas_thumbnails.bind("<MouseWheel>", self._mouse_wheel_in_canvas_thumbnails)
+        self._canvas_thumbnails.bind("<Button-1>", self._click_on_a_thumbnail)
+        self._canvas_thumbnails.bind("<Configure>", lambda _: self._update_visible_thumbnails())
+
         self._text_bookmarks.tag_config(TAG_BOOKMARK, foreground="green")
         self._text_bookmarks.tag_bind(TAG_BOOKMARK, "<Button-1>", self._click_on_a_bookmark)
-
-        # if there is a previously opened book, open it
-        currently_opened_book = self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK, None)
+        self._text_bookmarks.tag_config(TAG_BOOKMARK_TOGGLE, foreground=_COLOR_DARK_BLUE)
+        self._text_bookmarks.tag_bind(TAG_BOOKMARK_TOGGLE, "<Button-1>", self._click_on_a_bookmark_toggle)
+        self._text_bookmarks.tag_config(TAG_BOOKMARK_HIDDEN, elide=True)
+        self._text_bookmarks.tag_config(TAG_CURRENT_BOOKMARK, background=_COLOR_LIGHT_BLUE)
+
+        # if there is a previously opened book, it is opened after the window is shown (see _finish_startup); until
+        # then, no book is open, but it is still the currently opened book in the saved settings
+        currently_opened_book = self._gui_settings.pop(KEY_CURRENTLY_OPENED_BOOK, None)
         if currently_opened_book is not None and os.path.isdir(currently_opened_book):
-            self._load_book(currently_opened_book)
+            self._book_to_restore = currently_opened_book
+        self._mark_startup("gui settings loaded")
+        self._startup_map_binding = self.bind("<Map>", self._on_first_map, add="+")
+
+    def _mark_startup(self, name):
+        if self._startup_milestones is not None:
+            self._startup_milestones.append((name, time.perf_counter()))
+
+    def _print_startup_profile(self):
+        if self._startup_milestones is None:
+            return
+        print("Startup, in milliseconds since the imports started (and since the previous step):")
+        previous_time = _IMPORT_START_TIME
+        for name, t in self._startup_milestones:
+            print(f"  {name:<24}{(t - _IMPORT_START_TIME) * 1000:8.1f}{(t - previous_time) * 1000:8.1f}")
+            previous_time = t
+        self._startup_milestones = None
+
+    def _on_first_map(self, event):
+        if event.widget is not self:  # the children's <Map> events come here too (the window is in their bindtags)
+            return
+        self.unbind("<Map>", self._startup_map_binding)
+        self._mark_startup("window mapped")
+        self.after_idle(self._finish_startup)  # after the window is drawn, which is also done when idle
+
+    def _finish_startup(self):
+        # PIL is imported, and the page sizes of the last opened book are read, on worker threads, and then, the book
+        # is loaded (its pages are decoded on the workers as usual, see _poll_decoded_pages)
+        self._mark_startup("window shown")
+        self._page_decode_executor.submit(_import_pil)
+        if self._book_to_restore is None:
+            self._print_startup_profile()
+            return
+        future = self._page_decode_executor.submit(self._performance_stats.call_measured, "read_page_sizes",
+                                                   read_page_sizes, self._book_to_restore)
+        self._poll_restoring_book(self._book_to_restore, future)
+
+    def _poll_restoring_book(self, book_folder, future):
+        if self._book_to_restore != book_folder:  # another book was opened meanwhile
+            return
+        if not future.done():
+            self.after(BOOK_RESTORE_POLL_INTERVAL, self._poll_restoring_book, book_folder, future)
+            return
+        self._mark_startup("page sizes read")
+        try:
+            page_sizes = future.result()
+        except OSError as e:  # read again by _load_book, which reports it
+            print("Error: Couldn't read the page sizes of", book_folder, ":", e)
+            page_sizes = None
+        self._load_book(book_folder, page_sizes)
+        self._mark_startup("book restored")
+        self._print_startup_profile()
 
     def set_default_title(self):
         if ALLOW_DEBUGGING:
@@ -405,9 +1297,24 @@ class PdfViewer(tk.Tk):
         pass
 
     def destroy(self):
+        # nothing here waits for the disk: the settings are written by the settings writer's thread after the window
+        # is closed, and every change to the annotations is already in the journal
         self._save_gui_settings()
-        self._save_annotations()
-        self._save_book_settings()
+        if self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK) is not None:
+            self._save_annotations(compact_if_long=False)
+            self._save_book_settings()
+        self._settings_writer.close()
+
+        self._stop_scrolling()
+        self._cancel_page_decodes()
+        self._page_decode_executor.shutdown(wait=False, cancel_futures=True)
+        self._close_thumbnails()
+        self._stop_text_index_builder()
+        if self._library_annotations_index is not None:
+            self._library_annotations_index.close()
+        self._pdf_import_stop_event.set()
+        if self._performance_stats.is_tracing():
+            self._save_trace()
 
         tk.Tk.destroy(self)
 
@@ -423,33 +1330,27 @@ class PdfViewer(tk.Tk):
             self.state("normal")
         self._gui_settings[KEY_SETTING_GUI_GEOMETRY] = self.winfo_geometry()
 
-        # if there are more recently opened books than allowed, remove the older ones
-        # this code is commented for now, meaning, all recent books will be saved
-        # as, the dialog only shows max allowed number of books, it may be kept this way for now
+        self._save_gui_settings_later(delay=0)
 
-        # recently_opened_books = self._gui_settings.get(KEY_RECENTLY_OPENED_BOOKS, {})
-        # if len(recently_opened_books) > NUM_BOOKS_TO_STORE_IN_RECENTLY_OPENED_BOOKS:
-        #     books_ordered_by_most_recent = sorted(recently_opened_books.keys(),
-        #                                           key=lambda x: recently_opened_books[x], reverse=True)
-        #     for i in range(NUM_BOOKS_TO_STORE_IN_RECENTLY_OPENED_BOOKS, len(books_ordered_by_most_recent)):
-        #         recently_opened_books.pop(books_ordered_by_most_recent[i])
+    def _save_gui_settings_later(self, delay=None):
+        # after a change to the gui settings; see _SettingsWriter for the delay
+        # only the most recently opened books are kept, so that the settings file doesn't keep growing
+        prune_recently_opened_books(self._gui_settings.get(KEY_RECENTLY_OPENED_BOOKS, {}))
+        gui_settings = self._gui_settings
+        if self._book_to_restore is not None:  # it is still the currently opened book, see _finish_startup
+            gui_settings = {**gui_settings, KEY_CURRENTLY_OPENED_BOOK: self._book_to_restore}
 
         if ALLOW_DEBUGGING:
-            print("GUI settings being saved:", self._gui_settings)
+            print("GUI settings being saved:", gui_settings)
 
-        try:
-            with open(SETTINGS_FILE_PATH, 'w') as f:
-                f.write(json.dumps(self._gui_settings, indent=2))
-        except IOError:
-            print("IOError while writing settings to", SETTINGS_FILE_PATH)
+        self._settings_writer.write(SETTINGS_FILE_PATH, json.dumps(gui_settings, indent=2), delay)
 
     def _load_gui_settings(self):
         if ALLOW_DEBUGGING:
             print("\nLoad GUI settings")
 
         try:
-            with open(SETTINGS_FILE_PATH) as f:
-                self._gui_settings = json.loads(f.read())  # type: dict
+            self._gui_settings = json.loads(self._settings_writer.read(SETTINGS_FILE_PATH))  # type: dict
         except IOError:
             print(f'IOError while reading settings from "{SETTINGS_FILE_PATH}". The file may not exist yet.')
             return
@@ -478,6 +1379,7 @@ class PdfViewer(tk.Tk):
         if initial_dir_for_ask_dir_dialog is None:  # if it is still None, use the drive letter
             initial_dir_for_ask_dir_dialog = os.path.splitdrive(sys.argv[0])[0]
 
+        from tkinter import filedialog
         result = filedialog.askdirectory(initialdir=initial_dir_for_ask_dir_dialog)
         if result == "":
             if ALLOW_DEBUGGING:
@@ -509,6 +1411,7 @@ class PdfViewer(tk.Tk):
             return
 
         recently_opened_books = recently_opened_books[:NUM_BOOKS_TO_STORE_IN_RECENTLY_OPENED_BOOKS]
+        from dialogs import ask_recent_book
         result = ask_recent_book("Quick open", "Choose a recently opened book:", recently_opened_books)
         if ALLOW_DEBUGGING:
             print("Result:", result)
@@ -529,6 +1432,14 @@ class PdfViewer(tk.Tk):
         if ALLOW_DEBUGGING:
             print("\nKey press in text bookmarks:", event.keysym)
 
+        if event.keysym in KEY_PRESSES_TO_ALLOW_FURTHER_HANDLING_IN_TEXT_BOOKMARKS:
+            # this will allow pressing "Alt F4" for further processing which will close the application
+            # otherwise, pressing "Alt F4" when text bookmarks is in Focus will not close the application because
+            # the event will be stopped from further processing because of returning "break"
+            # the hot key binding to this key, if any, is done in the further processing (by bind_all), so, it is
+            # not done here, otherwise, it would be done twice
+            return None
+
         try:
             # if there is any hot key binding to this key, do it
             # todo disallow running hot key binding if unnecessary modifiers are there like shift, control etc
@@ -536,12 +1447,6 @@ class PdfViewer(tk.Tk):
         except KeyError:
             pass
 
-        if event.keysym in KEY_PRESSES_TO_ALLOW_FURTHER_HANDLING_IN_TEXT_BOOKMARKS:
-            # this will allow pressing "Alt F4" for further processing which will close the application
-            # otherwise, pressing "Alt F4" when text bookmarks is in Focus will not close the application because
-            # the event will be stopped from further processing because of returning "break"
-            return None
-
         return "break"  # makes the text bookmark readonly by disallowing further processing of the event
 
     def _save_current_book_and_clear_canvas_and_bookmarks_and_dictionaries(self):
@@ -551,19 +1456,45 @@ class PdfViewer(tk.Tk):
             self._save_book_settings()
 
         # clear canvas and bookmarks
+        self._stop_scrolling()
         self._canvas.delete(TAG_OBJECT)  # delete all objects on canvas
-        self._text_bookmarks.delete("1.0", tk.END)
+        self._clear_bookmarks()
 
         # clear all dictionaries
         self._dict_page_num_to_image.clear()
         self._dict_page_num_to_canvas_id.clear()
         self._dict_canvas_id_to_page_num.clear()
+        self._dict_page_num_to_decoded_image_canvas_id.clear()
+        self._dict_page_num_to_unzoomed_size.clear()
+        self._dict_page_num_to_tiles.clear()
+        self._page_sizes = []
+        self._page_tops = []
+        self._page_bottoms = []
+        self._canvas.configure(scrollregion=(0, 0, 0, 0))
         self._annotations.clear()
+        self._dict_canvas_id_to_annotation.clear()
+        self._dict_annotation_to_canvas_id.clear()
+        self._annotations_grid.clear()
+        self._highlighted_annotation_id = None
+        self._annotations_journal = None
+        self._annotations_index.build(self._annotations)
+        self._search_hits = None
+
+        self._cancel_page_decodes()
+        if ALLOW_DEBUGGING:
+            print("Decoded page cache:", self._decoded_page_cache.get_stats())
+        self._decoded_page_cache.clear()
+
+        self._close_thumbnails()
+        self._stop_text_index_builder()
 
-    def _load_book(self, book_directory):
+    def _load_book(self, book_directory, page_sizes=None):
+        # page_sizes: as read by read_page_sizes, if they were already read (see _finish_startup)
         if ALLOW_DEBUGGING:
             print("\nLoad book", book_directory)
 
+        self._book_to_restore = None  # this book is opened instead, if the last opened book isn't restored yet
+
         if not os.path.isdir(book_directory):
             print("ERROR: Book dir doesn't exist:", book_directory)
             return
@@ -576,6 +1507,7 @@ class PdfViewer(tk.Tk):
             self._gui_settings[KEY_RECENTLY_OPENED_BOOKS] = {}
         self._gui_settings[KEY_RECENTLY_OPENED_BOOKS][book_directory] =\
             datetime.today().strftime(_DATETIME_FORMAT_TO_SAVE)
+        self._save_gui_settings_later()
 
         metadata_folder = get_metadata_folder(book_directory)
 
@@ -585,109 +1517,526 @@ class PdfViewer(tk.Tk):
 
             # read book settings like which page opened
             try:
-                with open(get_book_settings_file_path(metadata_folder)) as f:
-                    book_settings = json.loads(f.read())
+                book_settings = json.loads(self._settings_writer.read(get_book_settings_file_path(metadata_folder)))
             except IOError:
                 print("Book-settings file doesn't exist for this book:", get_book_settings_file_path(metadata_folder))
             except json.JSONDecodeError:
                 print("Bad json in book-settings file:", get_book_settings_file_path(metadata_folder))
 
-            # read bookmarks
-            self._text_bookmarks.delete("1.0", tk.END)
+            # read bookmarks (they are inserted into the bookmarks panel after the first page is shown)
+            self._clear_bookmarks()
             try:
                 with open(get_bookmarks_file_path(metadata_folder)) as f:
-                    bookmarks = json.loads(f.read())
-                for (indent, title, page_num) in bookmarks:
-                    self._text_bookmarks.insert(tk.END, " " * indent, ())  # empty tuple as tags because,
-                    # if not given, then tags at preceding/succeeding characters may be taken
-                    self._text_bookmarks.insert(tk.END, title, (TAG_BOOKMARK,))  # note, tuple required for tags even
-                    # when there is only one tag, because, for Text widget, if string is given, each individual letter
-                    # will be applied as a separate tag
-                    self._text_bookmarks.insert(tk.END, f"  {page_num}\n", ())
+                    self._bookmarks = json.loads(f.read())
             except IOError:
                 print("Bookmarks file doesn't exist for this book:", get_bookmarks_file_path(metadata_folder))
+            except json.JSONDecodeError:
+                print("Bad json in bookmarks file:", get_bookmarks_file_path(metadata_folder))
+            self._bookmark_subtree_ends = get_bookmark_subtree_ends(self._bookmarks)
+            self._bookmark_parents = get_bookmark_parents(self._bookmarks)
+            self._bookmark_indices_by_page_num = sorted(range(len(self._bookmarks)),
+                                                        key=lambda i: self._bookmarks[i][2])  # stable, so, of the
+            # bookmarks at the same page, the last one in the outline is found by bisect_right
+            self._bookmark_page_nums = [self._bookmarks[i][2] for i in self._bookmark_indices_by_page_num]
 
             # read annotations
             self._read_annotations()
 
-        try:
-            h_scroll_pos, v_scroll_pos = book_settings[KEY_SCROLLBAR_POSITIONS]
-            self._text_bookmarks.xview_moveto(h_scroll_pos[0])
-            self._text_bookmarks.yview_moveto(v_scroll_pos[0])
-        except (KeyError, ValueError):
-            pass
+        self._open_thumbnails(book_directory)
+        if os.path.exists(metadata_folder):
+            self._text_index_builder_after_id = self.after(TEXT_INDEX_BUILD_DELAY, self._start_text_index_builder)
+
+        self._prefetch_page_range = book_settings.get(KEY_PREFETCH_PAGE_RANGE, NUM_PAGE_IMAGE_RANGE_TO_KEEP)
+        self._zoom = book_settings.get(KEY_ZOOM, 1)
+
+        # the bookmarks are inserted when idle, i.e. after the first page is shown below
+        self._collapsed_bookmarks = set(book_settings.get(KEY_COLLAPSED_BOOKMARKS, []))
+        self._bookmarks_scroll_positions_to_restore = book_settings.get(KEY_SCROLLBAR_POSITIONS, ((0, 1), (0, 1)))
+        self._bookmarks_insert_after_id = self.after_idle(self._insert_bookmarks, 0)
+
+        self._update_page_layout(page_sizes)
 
         try:
             visible_pages = book_settings[KEY_CURRENTLY_VISIBLE_PAGES]
             assert type(visible_pages) == list
             assert len(visible_pages) > 0
-            for page_num, x, y in visible_pages:
-                self._load_page(page_num, x=x, y=y, delete_all_objects=False)
+            page_num, _, y = visible_pages[0]  # the top-most one, the others are shown along with it
+            self._load_page(page_num, y=y)
         except (KeyError, AssertionError, ValueError):
             self._load_page(1)
 
-    def _load_page(self, page_num, delete_all_objects=True, x=2, y=2, anchor="nw"):
+    def _clear_bookmarks(self):
+        if self._bookmarks_insert_after_id is not None:
+            self.after_cancel(self._bookmarks_insert_after_id)
+            self._bookmarks_insert_after_id = None
+        self._text_bookmarks.delete("1.0", tk.END)
+        self._bookmarks = []
+        self._bookmark_subtree_ends = []
+        self._bookmark_parents = []
+        self._bookmark_indices_by_page_num = []
+        self._bookmark_page_nums = []
+        self._current_bookmark_line = None
+        self._collapsed_bookmarks = set()
+
+    def _insert_bookmarks(self, start):
+        # inserts a chunk of bookmarks into the bookmarks panel, and schedules the next chunk
+        # each bookmark is a line: indent, the collapse/expand marker (if it has nested bookmarks), title, page num
+        self._bookmarks_insert_after_id = None
+
+        end = min(start + NUM_BOOKMARKS_TO_INSERT_AT_A_TIME, len(self._bookmarks))
+        chars_and_tags = []  # inserted in one call, text.insert takes any number of chars, tags pairs
+        for i in range(start, end):
+            indent, title, page_num = self._bookmarks[i]
+            if self._bookmark_subtree_ends[i] > i + 1:
+                marker, marker_tags = BOOKMARK_EXPANDED_MARKER, (TAG_BOOKMARK_TOGGLE,)
+            else:
+                marker, marker_tags = " ", ()
+            chars_and_tags.extend([" " * indent, (), marker, marker_tags, " ", (), title, (TAG_BOOKMARK,),
+                                   f"  {page_num}\n", ()])
+            # note: empty tuple as tags because, if not given, then tags at preceding/succeeding characters may be
+            # taken, and, tuple is required for tags even when there is only one tag, because, for Text widget, if
+            # string is given, each individual letter will be applied as a separate tag
+        if len(chars_and_tags) > 0:
+            self._text_bookmarks.insert(tk.END, *chars_and_tags)
+
+        if end < len(self._bookmarks):
+            self._bookmarks_insert_after_id = self.after_idle(self._insert_bookmarks, end)
+            return
+
+        # all the bookmarks are inserted
+        for i in sorted(self._collapsed_bookmarks):
+            if i < len(self._bookmarks) and self._bookmark_subtree_ends[i] > i + 1:
+                self._set_bookmark_collapsed(i, True)
+        self._collapsed_bookmarks.intersection_update(range(len(self._bookmarks)))
+        try:
+            h_scroll_pos, v_scroll_pos = self._bookmarks_scroll_positions_to_restore
+            self._text_bookmarks.xview_moveto(h_scroll_pos[0])
+            self._text_bookmarks.yview_moveto(v_scroll_pos[0])
+        except (TypeError, ValueError, IndexError):
+            pass
+        self._update_current_bookmark()
+
+    def _update_current_bookmark(self):
+        # highlights the bookmark of the section that the page at the top of the visible area is in, i.e. the last
+        # bookmark at or before that page, and scrolls the bookmarks panel to it
+        # if it is nested in a collapsed bookmark, the outermost such collapsed bookmark is highlighted instead
+        # called on every scroll frame, so, it only bisects, and touches the bookmarks panel only when the line changes
+        line = None
+        if len(self._page_bottoms) > 0 and self._bookmarks_insert_after_id is None:
+            page_num = bisect.bisect_right(self._page_bottoms, self._canvas.canvasy(0)) + 1
+            k = bisect.bisect_right(self._bookmark_page_nums, page_num) - 1
+            if k >= 0:
+                i = self._bookmark_indices_by_page_num[k]
+                parent = self._bookmark_parents[i]
+                while parent is not None:
+                    if parent in self._collapsed_bookmarks:
+                        i = parent
+                    parent = self._bookmark_parents[parent]
+                line = i + 1
+
+        if line == self._current_bookmark_line:
+            return
+        if self._current_bookmark_line is not None:
+            self._text_bookmarks.tag_remove(TAG_CURRENT_BOOKMARK, f"{self._current_bookmark_line}.0",
+                                            f"{self._current_bookmark_line}.end")
+        self._current_bookmark_line = line
+        if line is not None:
+            self._text_bookmarks.tag_add(TAG_CURRENT_BOOKMARK, f"{line}.0", f"{line}.end")
+            self._text_bookmarks.see(f"{line}.0")
+
+    def _set_bookmark_collapsed(self, i, collapsed):
+        # the lines of the bookmarks nested in it are elided, or shown again (except the ones nested in the bookmarks
+        # that are still collapsed)
+        line = i + 1
+        indent = self._bookmarks[i][0]
+        self._text_bookmarks.delete(f"{line}.{indent}")
+        self._text_bookmarks.insert(f"{line}.{indent}",
+                                    BOOKMARK_COLLAPSED_MARKER if collapsed else BOOKMARK_EXPANDED_MARKER,
+                                    (TAG_BOOKMARK_TOGGLE,))
+
+        subtree_end = self._bookmark_subtree_ends[i]
+        if collapsed:
+            self._collapsed_bookmarks.add(i)
+            self._text_bookmarks.tag_add(TAG_BOOKMARK_HIDDEN, f"{line + 1}.0", f"{subtree_end + 1}.0")
+            return
+
+        self._collapsed_bookmarks.discard(i)
+        self._text_bookmarks.tag_remove(TAG_BOOKMARK_HIDDEN, f"{line + 1}.0", f"{subtree_end + 1}.0")
+        j = i + 1
+        while j < subtree_end:
+            if j in self._collapsed_bookmarks:
+                j_subtree_end = self._bookmark_subtree_ends[j]
+                self._text_bookmarks.tag_add(TAG_BOOKMARK_HIDDEN, f"{j + 2}.0", f"{j_subtree_end + 1}.0")
+                j = j_subtree_end
+            else:
+                j += 1
+
+    def _click_on_a_bookmark_toggle(self, _):
+        if self._bookmarks_insert_after_id is not None:
+            return  # the bookmarks nested in it may not be inserted yet
+        i = int(self._text_bookmarks.index("current").split(".")[0]) - 1
+        if ALLOW_DEBUGGING:
+            print("Collapse or expand bookmark", i)
+        self._set_bookmark_collapsed(i, i not in self._collapsed_bookmarks)
+        self._update_current_bookmark()
+
+    @_measured
+    def _load_page(self, page_num, y=2):
+        # scrolls such that the top of the page is at y in the visible area, and shows the pages in the visible area
 
         if ALLOW_DEBUGGING:
-            print(f"\nLoad page {page_num} anchored at at {anchor} of ({x}, {y})"
-                  f" Delete all objects: {delete_all_objects}")
-
-        # (x,y) is northwest point of image
-        if delete_all_objects:
-            for p in self._dict_page_num_to_image:
-                self._save_annotations_back_to_the_dict_for_page(p)
-            self._canvas.delete(TAG_OBJECT)
-            self._dict_page_num_to_image.clear()
-            self._dict_canvas_id_to_page_num.clear()
-            self._dict_page_num_to_canvas_id.clear()
-            # todo see if all required items are cleared
+            print(f"\nLoad page {page_num} with its top at {y}")
+
+        if not 1 <= page_num <= len(self._page_tops):
+            if ALLOW_DEBUGGING:
+                print("There is no page with number:", page_num)
+            return
+
+        self._stop_scrolling()
+        self._scroll_canvas_to(self._page_tops[page_num - 1] - y)
+        self._update_pages_on_canvas()
+
+    def _create_page_on_canvas(self, page_num):
+        if ALLOW_DEBUGGING:
+            print("Create page", page_num, "on canvas")
 
         tag_for_this_page_num = get_page_num_tag(page_num)
         # adding the above tag is necessary
         # reason: all the annotations that belong to a page can be removed along with the page
 
-        if page_num in self._dict_page_num_to_image:
-
+        unzoomed_size = self._page_sizes[page_num - 1]
+        if unzoomed_size is None:
             if ALLOW_DEBUGGING:
-                print(f"Page-{page_num} was already loaded. Just scrolling to that page")
-                print("It's bbox:", self._canvas.bbox(tag_for_this_page_num))
+                print("There is no png for the page yet:", page_num)
+            return
 
-            _, y1, _, _ = self._canvas.bbox(tag_for_this_page_num)
-            dy = y - y1
-            self._canvas.move(TAG_OBJECT, 0, dy)  # move all canvas objects by that amount
+        # the page is first drawn as a placeholder rectangle of the page's size (only the header of the png is
+        # read for the size), and the png is decoded on a worker thread, see _poll_decoded_pages
+        page_width, page_height = get_zoomed_size(unzoomed_size, self._zoom)
+        x1, y1 = PAGE_X1, self._page_tops[page_num - 1]
 
-            if ALLOW_DEBUGGING:
-                print("It's new bbox:", self._canvas.bbox(tag_for_this_page_num))
+        page_id = self._canvas.create_rectangle(x1, y1, x1 + page_width, y1 + page_height,
+                                                fill=PAGE_PLACEHOLDER_COLOR, width=0,
+                                                tags=(TAG_OBJECT, TAG_PAGE_IMAGE, tag_for_this_page_num))
+        self._dict_canvas_id_to_page_num[page_id] = page_num
+        self._dict_page_num_to_canvas_id[page_num] = page_id
+        self._dict_page_num_to_image[page_num] = None  # until the page is decoded (stays None if tiled)
+        self._dict_page_num_to_unzoomed_size[page_num] = unzoomed_size
 
+        if is_tiled_page_size((page_width, page_height)):
+            if ALLOW_DEBUGGING:
+                print("The page is shown as tiles")
+            self._dict_page_num_to_tiles[page_num] = dict()
+            self._update_tiles_of_page(page_num)
         else:
+            decoded_image = self._decoded_page_cache.get((page_num, self._zoom))
+            if decoded_image is not None:
+                if ALLOW_DEBUGGING:
+                    print("The page was already decoded (prefetched, or, shown before)")
+                self._show_decoded_page_image(page_num, decoded_image)
+            else:
+                self._decode_page_in_background(page_num)
+
+        self._draw_annotations_on_canvas_for_page(page_num)
+        self._draw_search_hits_for_page(page_num)
+
+    @_measured
+    def _update_pages_on_canvas(self, look_ahead_top=0, look_ahead_bottom=0):
+        # creates the pages in the visible area (extended by the look aheads, in pixels, above and below it) that
+        # are not on canvas yet, and deletes the pages on canvas that are far away from it
+        # pages within NUM_PAGE_IMAGE_RANGE_TO_KEEP of the visible ones are kept, so that scrolling back and forth
+        # doesn't create them again
+        if len(self._page_tops) == 0:
+            return
 
-            if ALLOW_DEBUGGING:
-                print("This page has to be loaded")
+        _, visible_y1, _, visible_y2 = self._get_visible_area()
+        page_nums = self._get_page_nums_between(visible_y1 - look_ahead_top, visible_y2 + look_ahead_bottom)
 
-            page_png_image_path = get_page_path(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK], page_num)
-            if not os.path.isfile(page_png_image_path):
-                if ALLOW_DEBUGGING:
-                    print("There is no page with number:", page_num)
-                return
+        for p in page_nums:
+            if p not in self._dict_page_num_to_image:
+                self._create_page_on_canvas(p)
 
-            # PIL needs lingering reference (otherwise, the image gets garbage collected and unavailable)
-            self._dict_page_num_to_image[page_num] = ImageTk.PhotoImage(Image.open(page_png_image_path))
+        if len(page_nums) > 0:
+            for p in tuple(self._dict_page_num_to_image.keys()):
+                if p < page_nums[0] - NUM_PAGE_IMAGE_RANGE_TO_KEEP or p > page_nums[-1] + NUM_PAGE_IMAGE_RANGE_TO_KEEP:
+                    self._delete_page_from_canvas(p)
 
-            img_id = self._canvas.create_image(x, y, anchor=anchor, image=self._dict_page_num_to_image[page_num],
-                                               tags=(TAG_OBJECT, TAG_PAGE_IMAGE, tag_for_this_page_num))
-            self._dict_canvas_id_to_page_num[img_id] = page_num
-            self._dict_page_num_to_canvas_id[page_num] = img_id
+        self._update_tiles_of_tiled_pages()
+        self._update_current_bookmark()
 
-            self._draw_annotations_in_dict_on_to_canvas_for_page(page_num)
+    def _update_page_layout(self, page_sizes=None):
+        # reads the sizes of the pages (see read_page_sizes), unless they are given, and lays them out
+        if page_sizes is None:
+            with self._performance_stats.measure("read_page_sizes"):
+                page_sizes = read_page_sizes(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK])
+        self._page_sizes = page_sizes
+        self._lay_out_pages()
 
-            # delete images on canvas that are far away
-            # although this section can be moved out of the parent if block, it is kept here, the idea is,
-            # delete things only when new things are added (otherwise, it's ok to keep things in memory)
-            loaded_images_page_numbers = tuple(self._dict_page_num_to_image.keys())
-            for p in loaded_images_page_numbers:
-                if abs(p - page_num) > NUM_PAGE_IMAGE_RANGE_TO_KEEP:
-                    self._delete_page_from_canvas(p)
+    def _lay_out_pages(self):
+        # at the current zoom
+        self._page_tops, self._page_bottoms = get_page_tops_and_bottoms(self._page_sizes, self._zoom)
+
+        width = max([get_zoomed_size(size, self._zoom)[0] for size in self._page_sizes if size is not None],
+                    default=0)
+        self._canvas.configure(scrollregion=(0, 0, PAGE_X1 + width + PAGE_X1, self._get_document_height()))
+
+        # the pages on canvas are moved to their places, if the sizes of the pages above them were not known before
+        for p in self._dict_page_num_to_image:
+            dy = self._page_tops[p - 1] - self._get_page_bbox(p)[1]
+            if dy != 0:
+                self._canvas.move(get_page_num_tag(p), 0, dy)
+                for annotation in self._annotations.get(p, []):
+                    annotation_id = self._dict_annotation_to_canvas_id.get(annotation)
+                    if annotation_id is not None:
+                        self._annotations_grid.move(annotation_id, 0, dy)
+
+    def _get_visible_area(self):
+        # in canvas coordinates
+        x1 = self._canvas.canvasx(0)
+        y1 = self._canvas.canvasy(0)
+        return x1, y1, x1 + self._canvas.winfo_width(), y1 + self._canvas.winfo_height()
+
+    def _get_page_nums_between(self, y1, y2):
+        # the pages (in order) that are at least partly between y1 and y2 on canvas
+        first_page_index = bisect.bisect_right(self._page_bottoms, y1)  # the first page whose bottom is below y1
+        last_page_index = bisect.bisect_left(self._page_tops, y2) - 1  # the last page whose top is above y2
+        return list(range(first_page_index + 1, last_page_index + 2))
+
+    def _get_visible_page_nums(self):
+        _, visible_y1, _, visible_y2 = self._get_visible_area()
+        return self._get_page_nums_between(visible_y1, visible_y2)
+
+    def _find_page_at(self, x, y):
+        # the page on canvas at the point on canvas, or None; the pages are one below the other, so, this is a
+        # binary search in the page layout
+        page_num = bisect.bisect_right(self._page_tops, y)  # the last page whose top is not below y
+        if page_num == 0 or y > self._page_bottoms[page_num - 1]:
+            return None
+        unzoomed_size = self._dict_page_num_to_unzoomed_size.get(page_num)
+        if unzoomed_size is None:  # not on canvas
+            return None
+        page_width, _ = get_zoomed_size(unzoomed_size, self._zoom)
+        return page_num if PAGE_X1 <= x <= PAGE_X1 + page_width else None
+
+    def _find_annotation_at(self, x, y):
+        # the canvas id of the top-most (i.e. the last drawn) annotation at the point on canvas, or None
+        return max(self._annotations_grid.find_at(x, y, ANNOTATION_HIT_PADDING), default=None)
+
+    def _get_document_height(self):
+        return self._page_bottoms[-1] + PIXELS_BETWEEN_PAGES if len(self._page_bottoms) > 0 else 0
+
+    def _scroll_canvas_to(self, y):
+        # scrolls such that y on canvas is at the top of the visible area (as close as the scroll region allows)
+        height = self._get_document_height()
+        if height > 0:
+            self._canvas.yview_moveto(y / height)
+
+    def _get_page_bbox(self, page_num):
+        # the page rectangle's coords are exact, unlike canvas.bbox, which adds a pixel or two to the rectangles
+        return tuple(map(int, self._canvas.coords(self._dict_page_num_to_canvas_id[page_num])))
+
+    def _decode_page_in_background(self, page_num):
+        key = (page_num, self._zoom)
+        if key not in self._page_decode_futures:
+            self._page_decode_futures[key] = self._page_decode_executor.submit(
+                self._performance_stats.call_measured, "decode_page_image",
+                decode_page_image, self._gui_settings[KEY_CURRENTLY_OPENED_BOOK], page_num, self._zoom)
+        self._schedule_poll_decoded_pages()
+
+    def _decode_page_tile_in_background(self, page_num, row, col):
+        key = (page_num, self._zoom, row, col)
+        if key not in self._page_tile_decode_futures:
+            self._page_tile_decode_futures[key] = self._page_decode_executor.submit(
+                self._performance_stats.call_measured, "decode_page_tile",
+                decode_page_tile, self._gui_settings[KEY_CURRENTLY_OPENED_BOOK], page_num, self._zoom, row, col)
+        self._schedule_poll_decoded_pages()
+
+    def _schedule_poll_decoded_pages(self):
+        if self._page_decode_poll_after_id is None:
+            self._page_decode_poll_after_id = self.after(PAGE_DECODE_POLL_INTERVAL, self._poll_decoded_pages)
+
+    def _poll_decoded_pages(self):
+        self._page_decode_poll_after_id = None
+
+        for key, future in tuple(self._page_decode_futures.items()):
+            if not future.done():
+                continue
+            self._page_decode_futures.pop(key)
+            page_num, zoom = key
+
+            if future.cancelled():
+                continue
+
+            try:
+                decoded_image = future.result()
+            except (IOError, SyntaxError) as e:  # PIL raises SyntaxError for some broken png files
+                print(f"Error: Couldn't decode page {page_num}:", e)
+                continue
+
+            self._decoded_page_cache.put(key, decoded_image)
+
+            if page_num in self._dict_page_num_to_image and zoom == self._zoom:
+                self._show_decoded_page_image(page_num, decoded_image)
+            # else, it is a prefetched page, or, a page that was deleted from canvas (or zoomed) while it was being
+            # decoded
+
+        tiled_pages_to_update = set()
+        for key, future in tuple(self._page_tile_decode_futures.items()):
+            if not future.done():
+                continue
+            self._page_tile_decode_futures.pop(key)
+            page_num, zoom, row, col = key
+
+            if future.cancelled():
+                continue
+
+            try:
+                decoded_image = future.result()
+            except (IOError, SyntaxError) as e:
+                print(f"Error: Couldn't decode tile ({row}, {col}) of page {page_num}:", e)
+                continue
+
+            self._decoded_page_cache.put(key, decoded_image)
+
+            if page_num in self._dict_page_num_to_tiles and zoom == self._zoom:
+                tiled_pages_to_update.add(page_num)
+
+        for page_num in tiled_pages_to_update:
+            self._update_tiles_of_page(page_num)  # this shows the decoded tiles (from the cache) if still required
+
+        if len(self._page_decode_futures) > 0 or len(self._page_tile_decode_futures) > 0:
+            self._page_decode_poll_after_id = self.after(PAGE_DECODE_POLL_INTERVAL, self._poll_decoded_pages)
+
+    def _show_decoded_page_image(self, page_num, decoded_image):
+        if ALLOW_DEBUGGING:
+            print("Show decoded image of page", page_num)
+
+        # PIL needs lingering reference (otherwise, the image gets garbage collected and unavailable)
+        from PIL import ImageTk
+        with self._performance_stats.measure("make_photo_image"):
+            self._dict_page_num_to_image[page_num] = ImageTk.PhotoImage(decoded_image)
+
+        page_id = self._dict_page_num_to_canvas_id[page_num]
+        x1, y1, _, _ = self._get_page_bbox(page_num)
+        img_id = self._canvas.create_image(x1, y1, anchor="nw", image=self._dict_page_num_to_image[page_num],
+                                           tags=(TAG_OBJECT, TAG_PAGE_DECODED_IMAGE, get_page_num_tag(page_num)))
+        self._canvas.tag_raise(img_id, page_id)  # just above the page rectangle, i.e. below the annotations
+        self._dict_canvas_id_to_page_num[img_id] = page_num
+        self._dict_page_num_to_decoded_image_canvas_id[page_num] = img_id
+
+    def _prefetch_pages(self):
+        if len(self._dict_page_num_to_image) == 0 or self._scroll_direction == 0:
+            return
+
+        # the page at the edge of the scroll direction tells how far the pages are from being scrolled into view
+        if self._scroll_direction > 0:
+            edge_page = max(self._dict_page_num_to_image.keys())
+        else:
+            edge_page = min(self._dict_page_num_to_image.keys())
+        _, y1, _, y2 = self._get_page_bbox(edge_page)
+        page_height = max(1, y2 - y1)
+
+        # the number of pages that will be scrolled past in the look-ahead time, but, at least one
+        num_pages_to_prefetch = 1 + int(self._scroll_speed * PREFETCH_LOOK_AHEAD_TIME / page_height)
+        num_pages_to_prefetch = min(num_pages_to_prefetch, self._prefetch_page_range)
+
+        if ALLOW_DEBUGGING:
+            print(f"Prefetch {num_pages_to_prefetch} pages after page {edge_page} in direction"
+                  f" {self._scroll_direction} at speed {self._scroll_speed:.2f} px/ms")
+
+        for i in range(1, num_pages_to_prefetch + 1):
+            page_num = edge_page + self._scroll_direction * i
+            if not 1 <= page_num <= len(self._page_sizes):
+                break  # beginning or end of the book
+            if page_num in self._dict_page_num_to_image or (page_num, self._zoom) in self._decoded_page_cache:
+                continue
+            if self._page_sizes[page_num - 1] is None:
+                continue  # its png isn't there yet
+            if is_tiled_page_size(get_zoomed_size(self._page_sizes[page_num - 1], self._zoom)):
+                continue  # tiles are decoded only when they are near the visible area
+            self._decode_page_in_background(page_num)
+
+    def _update_scroll_speed(self, scroll_amount, event_time):
+        direction = -1 if scroll_amount > 0 else 1  # scrolling down (negative amount) shows higher page numbers
+        if (self._last_scroll_event_time is None or direction != self._scroll_direction or
+                event_time - self._last_scroll_event_time > SCROLL_SPEED_RESET_TIME):
+            self._scroll_speed = 0.0
+        else:
+            latest_speed = abs(scroll_amount) / max(1, event_time - self._last_scroll_event_time)
+            self._scroll_speed += SCROLL_SPEED_SMOOTHING * (latest_speed - self._scroll_speed)
+        self._scroll_direction = direction
+        self._last_scroll_event_time = event_time
+
+    def _update_tiles_of_page(self, page_num):
+        # keeps on canvas only the tiles that are in the visible area (extended by the margin), and starts decoding
+        # the ones that are missing
+        tiles = self._dict_page_num_to_tiles[page_num]
+
+        page_x1, page_y1, page_x2, page_y2 = self._get_page_bbox(page_num)
+        zoomed_size = (page_x2 - page_x1, page_y2 - page_y1)
+        level_size = get_zoomed_size(self._dict_page_num_to_unzoomed_size[page_num],
+                                     1 / get_pyramid_level_for_zoom(self._zoom))
+        num_rows, num_cols = get_page_tile_grid(level_size)
+        tile_width = zoomed_size[0] * PAGE_TILE_SIZE / level_size[0]  # on canvas
+        tile_height = zoomed_size[1] * PAGE_TILE_SIZE / level_size[1]
+
+        # the visible area, extended by the margin, relative to the page
+        visible_x1, visible_y1, visible_x2, visible_y2 = self._get_visible_area()
+        x1 = visible_x1 - PAGE_TILE_MARGIN - page_x1
+        y1 = visible_y1 - PAGE_TILE_MARGIN - page_y1
+        x2 = visible_x2 + PAGE_TILE_MARGIN - page_x1
+        y2 = visible_y2 + PAGE_TILE_MARGIN - page_y1
+        rows = range(max(0, math.floor(y1 / tile_height)), min(num_rows, math.floor(y2 / tile_height) + 1))
+        cols = range(max(0, math.floor(x1 / tile_width)), min(num_cols, math.floor(x2 / tile_width) + 1))
+        required_tiles = set((row, col) for row in rows for col in cols)
+
+        for row_col in tuple(tiles.keys()):
+            if row_col not in required_tiles:
+                tile_id, _ = tiles.pop(row_col)
+                self._canvas.delete(tile_id)
+                self._dict_canvas_id_to_page_num.pop(tile_id)
+
+        page_id = self._dict_page_num_to_canvas_id[page_num]
+        for row, col in required_tiles:
+            if (row, col) in tiles:
+                continue
+            key = (page_num, self._zoom, row, col)
+            if key in self._page_tile_decode_futures:
+                continue  # still being decoded
+            decoded_tile = self._decoded_page_cache.get(key)
+            if decoded_tile is None:
+                self._decode_page_tile_in_background(page_num, row, col)
+                continue
 
+            from PIL import ImageTk
+            with self._performance_stats.measure("make_photo_image"):
+                tile_photo = ImageTk.PhotoImage(decoded_tile)
+            tile_x1, tile_y1, _, _ = get_page_tile_bbox_on_canvas(row, col, level_size, zoomed_size)
+            tile_id = self._canvas.create_image(page_x1 + tile_x1, page_y1 + tile_y1, anchor="nw", image=tile_photo,
+                                                tags=(TAG_OBJECT, TAG_PAGE_DECODED_IMAGE, get_page_num_tag(page_num)))
+            self._canvas.tag_raise(tile_id, page_id)  # just above the page rectangle, i.e. below the annotations
+            self._dict_canvas_id_to_page_num[tile_id] = page_num
+            tiles[(row, col)] = (tile_id, tile_photo)
+
+    def _update_tiles_of_tiled_pages(self):
+        for page_num in self._dict_page_num_to_tiles:
+            self._update_tiles_of_page(page_num)
+
+    def _cancel_page_decodes(self):
+        # on closing the book: unlike in _delete_page_from_canvas, the decodes that are already running are forgotten
+        # too, because their pages are of the closed book (the cache keys don't have the book, and the cache is
+        # cleared), so, their results must not be cached or shown
+        for future in self._page_decode_futures.values():
+            future.cancel()
+        self._page_decode_futures.clear()
+        for future in self._page_tile_decode_futures.values():
+            future.cancel()
+        self._page_tile_decode_futures.clear()
+        if self._page_decode_poll_after_id is not None:
+            self.after_cancel(self._page_decode_poll_after_id)
+            self._page_decode_poll_after_id = None
+
+    @_measured
     def _mouse_wheel_in_canvas(self, event):
         # try:
         #     self._i += 1
@@ -700,48 +2049,147 @@ class PdfViewer(tk.Tk):
         if ALLOW_DEBUGGING:
             print("\nMouse wheel in canvas", event.delta)
 
-        # print("Canvas geo:", self._canvas.winfo_geometry(),
-        #       "width:", self._canvas.winfo_width(),
-        #       "height:", self._canvas.winfo_height(),
-        #       "Root geo:", self.winfo_toplevel().winfo_geometry())
-        # canvas's winfo_width and height are giving correct values along with canvas' geo string
-
-        canvas_width = self._canvas.winfo_width()
-        canvas_height = self._canvas.winfo_height()
-
-        if ALLOW_DEBUGGING:
-            print("Canvas width:", canvas_width, "Canvas height:", canvas_height)
-
         scroll_amount = (event.delta // 120) * NUM_PIXELS_TO_SCROLL
 
-        objects_in_scroll_distance = self._canvas.find_overlapping(
-            0, -scroll_amount, canvas_width, canvas_height - scroll_amount)
-        # note: using +scroll_amount above is causing a bug:
-        # which is, after scrolling the page, and it fully goes beyond top boundary, it is not coming back,
-        # the same bug is also caused if we used 0 in the place of scroll_amount above i.e. visible screen
+        self._update_scroll_speed(scroll_amount, event.time)
+
+        # the scroll events are only accumulated here, and the canvas is scrolled at most once per frame, so that
+        # a fast wheel flick doesn't move all the objects on canvas for every event, see _scroll_one_frame
+        if self._pending_scroll_amount * scroll_amount < 0:
+            self._pending_scroll_amount = 0  # scrolling in the other direction stops the remaining scroll
+        self._pending_scroll_amount += scroll_amount
+        if self._scroll_after_id is None:
+            self._scroll_after_id = self.after_idle(self._scroll_one_frame)  # the first frame without delay
+
+    def _scroll_one_frame(self):
+        self._scroll_after_id = None
+        frame_start_time = time.perf_counter()
+
+        # smooth scrolling: a fraction of the remaining scroll is done in each frame, so that the scrolling eases out
+        # (at least a pixel, so that it ends)
+        fraction = SMOOTH_SCROLL_FRACTION if self._gui_settings.get(KEY_SMOOTH_SCROLLING, True) else 1
+        scroll_amount = int(math.copysign(math.ceil(abs(self._pending_scroll_amount) * fraction),
+                                          self._pending_scroll_amount))
+
+        # the canvas's view is scrolled, the objects on canvas are not moved, so, the cost doesn't depend on how many
+        # objects there are; the view doesn't go beyond the scroll region, i.e. the beginning or the end of the book
+        # note: a positive scroll amount moves the pages down, i.e. the view up
+        visible_y1_before_scroll = self._canvas.canvasy(0)
+        self._canvas.yview_scroll(-scroll_amount, "units")  # a unit is a pixel (yscrollincrement)
+        if round(visible_y1_before_scroll - self._canvas.canvasy(0)) == scroll_amount:
+            self._pending_scroll_amount -= scroll_amount
+        else:
+            self._pending_scroll_amount = 0  # there is nothing more to scroll to
 
         if ALLOW_DEBUGGING:
-            print("Objects in scroll distance:", objects_in_scroll_distance)
-            for v in objects_in_scroll_distance:
-                print("Id:", v, "Tags:", self._canvas.gettags(v), "Bbox:", self._canvas.bbox(v))
+            print("Scrolled by", scroll_amount, "Visible area:", self._get_visible_area())
 
-        if len(objects_in_scroll_distance) > 0:
-            self._canvas.move(TAG_OBJECT, 0, scroll_amount)  # move all objects on canvas
+        # the pages are created when they are about to be scrolled into view, i.e. within the remaining scroll
+        if self._pending_scroll_amount > 0:
+            self._update_pages_on_canvas(look_ahead_top=self._pending_scroll_amount)
+        else:
+            self._update_pages_on_canvas(look_ahead_bottom=-self._pending_scroll_amount)
+        self._prefetch_pages()
+
+        if self._pending_scroll_amount != 0:
+            self._scroll_after_id = self.after(SCROLL_FRAME_INTERVAL, self._scroll_one_frame)
+
+        self._measure_frame(frame_start_time)
+
+    def _stop_scrolling(self):
+        # stops the remaining scroll, for example, when jumping to a page
+        self._pending_scroll_amount = 0
+        if self._scroll_after_id is not None:
+            self.after_cancel(self._scroll_after_id)
+            self._scroll_after_id = None
+
+    def _measure_frame(self, frame_start_time):
+        # a frame is from the first event handler that changed the canvas, to the end of the canvas's redraw
+        # tkinter redraws the canvas when idle, and the idle callbacks are called in the order they are scheduled,
+        # so, the callback scheduled here (after the canvas was changed) is called after the redraw
+        if self._frame_start_time is not None:
+            return  # a frame is already being measured, this event is part of it
+        self._frame_start_time = frame_start_time
+        self.after_idle(self._end_frame)
+
+    def _end_frame(self):
+        self._performance_stats.record("frame", self._frame_start_time, time.perf_counter())
+        self._frame_start_time = None
+
+    def _get_resident_image_num_bytes(self):
+        # the decoded page cache, and, the photo images on canvas (tk keeps them as 4 bytes per pixel)
+        num_bytes = self._decoded_page_cache.num_bytes
+        photo_images = [photo for photo in self._dict_page_num_to_image.values() if photo is not None]
+        for tiles in self._dict_page_num_to_tiles.values():
+            photo_images.extend(photo for _, photo in tiles.values())
+        for photo in photo_images:
+            num_bytes += photo.width() * photo.height() * 4
+        return num_bytes
+
+    def _get_performance_overlay_text(self):
+        lines = [f"{'':<26}" + "".join(f"{f'p{p}':>9}" for p in PERFORMANCE_PERCENTILES) + f"{'n':>6}"]
+        for name in self._performance_stats.get_names():
+            percentiles = self._performance_stats.get_percentiles(name)
+            lines.append(f"{name[:26]:<26}" + "".join(f"{t * 1000:>7.1f}ms" for t in percentiles) +
+                         f"{self._performance_stats.get_num_samples(name):>6}")
+
+        cache_stats = self._decoded_page_cache.get_stats()
+        num_lookups = cache_stats["hits"] + cache_stats["misses"]
+        hit_rate = 100 * cache_stats["hits"] / num_lookups if num_lookups > 0 else 0
+        lines.append("")
+        lines.append(f"cache hit rate: {hit_rate:.0f}% of {num_lookups}, {cache_stats['pages']} pages, "
+                     f"{cache_stats['mb']:.0f} MB, {cache_stats['evictions']} evictions")
+        lines.append(f"resident images: {self._get_resident_image_num_bytes() / (1024 * 1024):.0f} MB")
+        if self._performance_stats.is_tracing():
+            lines.append(f"recording trace: {self._performance_stats.get_num_trace_events()} events (F3 to save)")
+        return "\n".join(lines)
+
+    def _update_performance_overlay(self):
+        self._label_performance_overlay.configure(text=self._get_performance_overlay_text())
+        self._performance_overlay_after_id = self.after(PERFORMANCE_OVERLAY_UPDATE_INTERVAL,
+                                                        self._update_performance_overlay)
+
+    def _toggle_performance_overlay(self, _event=None):
+        if self._label_performance_overlay is None:
+            # a label placed on the canvas (not a canvas item, so that it stays in place when the canvas is scrolled)
+            self._label_performance_overlay = tk.Label(self._canvas, justify=tk.LEFT, anchor="nw",
+                                                       font="TkFixedFont", bg=_COLOR_LAVENDER, fg=_COLOR_DARK_BLUE,
+                                                       relief=tk.SOLID, bd=1)
+        if self._performance_overlay_after_id is None:
+            self._label_performance_overlay.place(relx=1, x=-10, y=10, anchor="ne")
+            self._update_performance_overlay()
+        else:
+            self.after_cancel(self._performance_overlay_after_id)
+            self._performance_overlay_after_id = None
+            self._label_performance_overlay.place_forget()
+
+    def _toggle_trace_recording(self, _event=None):
+        if not self._performance_stats.is_tracing():
+            self._performance_stats.start_trace()
+            print("Recording a trace")
+            return
+        self._save_trace()
 
-        self._load_neighbor_pages_if_there_is_empty_space_on_visible_area()
+    def _save_trace(self):
+        trace_file_path = get_trace_file_path()
+        try:
+            os.makedirs(os.path.dirname(trace_file_path), exist_ok=True)
+            self._performance_stats.stop_trace(trace_file_path)
+        except IOError:
+            print("IOError while writing trace to", trace_file_path)
+            return
+        print("Trace saved to", trace_file_path)
 
     def _click_on_a_bookmark(self, _):
-        bookmark_clicked = self._text_bookmarks.get("current linestart", "current lineend")
-        if ALLOW_DEBUGGING:
-            print("Clicked bookmark:", bookmark_clicked)
-
+        # each bookmark is a line in the bookmarks panel, the line number is its index + 1 in the bookmarks
+        line = int(self._text_bookmarks.index("current").split(".")[0])
         try:
-            page_num = int(str.rsplit(bookmark_clicked, " ", 1)[-1])
-            # max-split argument in the above call to rsplit is 1, it means only one breaking point i.e.
-            # the whole string is split into two parts at first space character from the right
-        except ValueError:
-            print("The page number extracted is not a valid integer")
+            _, title, page_num = self._bookmarks[line - 1]
+        except IndexError:
+            print("There is no bookmark at line", line)
             return
+        if ALLOW_DEBUGGING:
+            print("Clicked bookmark:", title)
 
         if ALLOW_DEBUGGING:
             print("Page num:", page_num)
@@ -754,202 +2202,160 @@ class PdfViewer(tk.Tk):
         canvas_x = self._canvas.canvasx(event.x)
         canvas_y = self._canvas.canvasy(event.y)
 
-        # there should be an underlying page to add an arrow annotation
-        closest = self._canvas.find_closest(canvas_x, canvas_y)  # either empty, or a singleton with closest object id
-        if len(closest) == 0:
+        # there should be an underlying page (and not an annotation) to add an arrow annotation
+        page_num = self._find_page_at(canvas_x, canvas_y)
+        if page_num is None or self._find_annotation_at(canvas_x, canvas_y) is not None:
             if ALLOW_DEBUGGING:
-                print("No page exists at this position, so, annotation can't be added")
+                print("The underlying object is not a page image. So, annotation can't be added")
             return
 
-        obj_id = closest[0]
-        tags_of_this_object = self._canvas.gettags(obj_id)
-        if ALLOW_DEBUGGING:
-            print("Underlying object:", obj_id, "with tags:", tags_of_this_object)
-        if TAG_PAGE_IMAGE not in tags_of_this_object:
+        dx = (canvas_x - PAGE_X1) / self._zoom  # annotations are stored unzoomed
+        dy = (canvas_y - self._page_tops[page_num - 1]) / self._zoom
+        self._add_annotation(page_num, _Annotation(dx, dy, TAG_ARROW))
+
+    def _add_annotation(self, page_num, annotation):
+        page_annotations = self._annotations.setdefault(page_num, [])
+        if any(a.to_list() == annotation.to_list() for a in page_annotations):
             if ALLOW_DEBUGGING:
-                print("The underlying object is not a page image. So, annotation can't be added")
+                print("The same annotation already exists on page", page_num)
             return
-
-        # the object given by obj_id is a page image object
-        page_bbox = self._canvas.bbox(obj_id)
-        x1, y1, _, _ = page_bbox
-        dx = canvas_x - x1
-        dy = canvas_y - y1
-        page_num = self._dict_canvas_id_to_page_num[obj_id]
-        self._add_arrow_annotation(dx, dy, page_num)
-
-    def _add_arrow_annotation(self, dx, dy, page_num):
-        # print(dx, dy, page_num)
-        page_bbox = self._canvas.bbox(self._dict_page_num_to_canvas_id[page_num])
-        x1, y1, _, _ = page_bbox
-
-        annotation_id = self._canvas.create_line(
-            x1 + dx, y1 + dy, x1 + dx - ANNOTATION_ARROW_LENGTH, y1 + dy,
-            arrow=tk.FIRST, arrowshape=ANNOTATION_ARROW_SHAPE,
-            fill=ANNOTATION_ARROW_COLOR, width=ANNOTATION_ARROW_WIDTH,
-            tags=(TAG_OBJECT, TAG_ANNOTATION, TAG_ARROW, get_page_num_tag(page_num),
-                  get_tag_annotation_deltas(dx, dy))
-        )
+        page_annotations.append(annotation)
+        self._draw_annotation(page_num, annotation)
+        self._save_annotations_of_page_to_journal(page_num)
+
+    def _draw_annotation(self, page_num, annotation):
+        x = PAGE_X1 + annotation.dx * self._zoom  # the tip of the arrow, or the anchor of the text
+        y = self._page_tops[page_num - 1] + annotation.dy * self._zoom
+        tags = (TAG_OBJECT, TAG_ANNOTATION, annotation.kind, get_page_num_tag(page_num))
+        if annotation.kind == TAG_ARROW:
+            annotation_id = self._canvas.create_line(
+                x, y, x - ANNOTATION_ARROW_LENGTH, y,
+                arrow=tk.FIRST, arrowshape=ANNOTATION_ARROW_SHAPE,
+                fill=ANNOTATION_ARROW_COLOR, width=ANNOTATION_ARROW_WIDTH, tags=tags)
+        elif annotation.kind == TAG_TEXT:
+            annotation_id = self._canvas.create_text(
+                x, y, text=annotation.text, fill=ANNOTATION_TEXT_COLOR, anchor=annotation.anchor,
+                justify=annotation.justify, tags=tags)
+        else:
+            print("Error: Unknown annotation type", annotation.kind, "on page", page_num)
+            return
+        self._dict_canvas_id_to_annotation[annotation_id] = (page_num, annotation)
+        self._dict_annotation_to_canvas_id[annotation] = annotation_id
+        self._annotations_grid.insert(annotation_id, self._canvas.bbox(annotation_id))  # the text's size is known
+        # only to the canvas
         if ALLOW_DEBUGGING:
-            print("Arrow annotation added with id:", annotation_id, "tags:", self._canvas.gettags(annotation_id))
+            print("Annotation drawn with id:", annotation_id, "tags:", tags)
 
     def _event_handler_for_remove_annotation(self, event):
         if ALLOW_DEBUGGING:
             print("Right click on canvas")
         canvas_x = self._canvas.canvasx(event.x)
         canvas_y = self._canvas.canvasy(event.y)
-        closest = self._canvas.find_closest(canvas_x, canvas_y)
-        if len(closest) == 0:
+        obj_id = self._find_annotation_at(canvas_x, canvas_y)
+        if obj_id is None:
             if ALLOW_DEBUGGING:
-                print("No close objects at this point")
+                print("No annotations at this point")
             return
-        obj_id = closest[0]  # closest is a singleton list, containing the id of an object on the canvas
+        page_num, annotation = self._forget_canvas_item_of_annotation(obj_id)
+        self._canvas.delete(obj_id)
+        self._annotations[page_num].remove(annotation)
         if ALLOW_DEBUGGING:
-            print(f"Found object with {obj_id} near ({canvas_x}, {canvas_y})"
-                  f" with tags {self._canvas.gettags(obj_id)}")
-        if TAG_ANNOTATION in self._canvas.gettags(obj_id):
-            self._canvas.delete(obj_id)
-            if ALLOW_DEBUGGING:
-                print("Deleted the annotation")
-
+            print("Deleted the annotation")
+        self._save_annotations_of_page_to_journal(page_num)
+
+    def _forget_canvas_item_of_annotation(self, annotation_id):
+        # before the annotation's canvas item is deleted; returns (page num, _Annotation)
+        page_num, annotation = self._dict_canvas_id_to_annotation.pop(annotation_id)
+        self._dict_annotation_to_canvas_id.pop(annotation)
+        self._annotations_grid.remove(annotation_id)
+        if annotation_id == self._highlighted_annotation_id:
+            self._highlighted_annotation_id = None
+            self._canvas.delete(TAG_BBOX)
+        return page_num, annotation
+
+    @_measured
     def _delete_page_from_canvas(self, page_num):
         if ALLOW_DEBUGGING:
             print("Delete page", page_num, "from canvas")
 
-        self._save_annotations_back_to_the_dict_for_page(page_num)
-
         page_obj_id = self._dict_page_num_to_canvas_id[page_num]
 
-        self._canvas.delete(page_obj_id)
+        # all the objects of the page, i.e. the page image(s) and its annotations
+        # (the annotations are drawn again from the model when the page is loaded again, so, if they were left on
+        # canvas, they would be duplicated)
+        self._canvas.delete(get_page_num_tag(page_num))
+        for annotation in self._annotations.get(page_num, []):
+            annotation_id = self._dict_annotation_to_canvas_id.get(annotation)
+            if annotation_id is not None:
+                self._forget_canvas_item_of_annotation(annotation_id)
         self._dict_page_num_to_image.pop(page_num)
         self._dict_page_num_to_canvas_id.pop(page_num)
         self._dict_canvas_id_to_page_num.pop(page_obj_id)
 
-    def _save_annotations_back_to_the_dict_for_page(self, page_num):
-        if ALLOW_DEBUGGING:
-            print("Save annotations back to the dict for page", page_num)
-
-        # requires that the page still be present on canvas
-        objects_with_page_num_tag = self._canvas.find_withtag(get_page_num_tag(page_num))
-
-        if ALLOW_DEBUGGING:
-            print(len(objects_with_page_num_tag), "objects found for this page")
-
-        self._annotations[str(page_num)] = []  # string key because, this is saved to a json file, and,
-        # json converts int keys to string keys while saving
-
-        # page bbox is used to store the annotations by relative position to the page
-        page_bbox = self._canvas.bbox(self._dict_page_num_to_canvas_id[page_num])
-
-        for o in objects_with_page_num_tag:
-            tags = self._canvas.gettags(o)
-            bbox = self._canvas.bbox(o)
-
-            if ALLOW_DEBUGGING:
-                print("Object with id:", o, "Tags:", tags, "Bbox:", bbox)
-
-            x1, y1, x2, y2 = bbox
-
-            dx, dy = None, None
-
-            for t in tags:
-                if t.startswith(PREFIX_TAG_ANNOTATION_DELTAS):
-                    dx, dy = get_dx_dy_from_tag_annotation_deltas(t)
-                    break
-
-            if TAG_ARROW in tags:
-                if dx is None or dy is None:
-                    if ALLOW_DEBUGGING:
-                        print("Critical warning: Tag annotation deltas is None."
-                              " It is required to get dx and dy for arrow annotations."
-                              " Otherwise, the arrows keep moving to the right everytime the book is reopened.")
-                    self._annotations[str(page_num)].append([x2, (y1 + y2) // 2, TAG_ARROW])
-                else:
-                    self._annotations[str(page_num)].append([page_bbox[0] + dx, page_bbox[1] + dy, TAG_ARROW])
-                    # note that page_bbox[0] and page_bbox[1] are added above, because,
-                    # at the end of the function, all x and y are made relative to the page
-            elif TAG_TEXT in tags:
-                if dx is None or dy is None:
-                    if ALLOW_DEBUGGING:
-                        print("Critical warning: Tag annotation deltas is None."
-                              " It is required to get dx and dy because they are used in conjunction with anchor.")
-                    self._annotations[str(page_num)].append(
-                        [(x1 + x2) // 2, y1, TAG_TEXT,  # using default anchor position
-                         self._canvas.itemcget(o, 'text')])
-                else:
-                    self._annotations[str(page_num)].append(
-                        [page_bbox[0] + dx, page_bbox[1] + dy, TAG_TEXT,
-                         self._canvas.itemcget(o, 'text'),
-                         self._canvas.itemcget(o, 'anchor'),
-                         self._canvas.itemcget(o, 'justify')])
-                    # note that page_bbox[0] and page_bbox[1] are added above, because,
-                    # at the end of the function, all x and y are made relative to the page
-
-        # make all x and y relative to the page
-        x1, y1, x2, y2 = page_bbox
-        for i in range(len(self._annotations[str(page_num)])):
-            x, y = self._annotations[str(page_num)][i][:2]
-            self._annotations[str(page_num)][i][0] = x - x1
-            self._annotations[str(page_num)][i][1] = y - y1
-
-        # remove duplicates
-        annotations_as_set = set(map(tuple, self._annotations[str(page_num)]))
-        # directly converting to set is throwing an error: unhashable type: 'list', so,
-        # each annotation(which is itself a list) in the list of annotations is converted to tuple
-        if len(annotations_as_set) != len(self._annotations[str(page_num)]):
-            if ALLOW_DEBUGGING:
-                print("Duplicates found:", self._annotations[str(page_num)])
-            self._annotations[str(page_num)] = list(map(list, annotations_as_set))
-
-    def _draw_annotations_in_dict_on_to_canvas_for_page(self, page_num):
+        decoded_image_obj_id = self._dict_page_num_to_decoded_image_canvas_id.pop(page_num, None)
+        if decoded_image_obj_id is not None:
+            self._canvas.delete(decoded_image_obj_id)
+            self._dict_canvas_id_to_page_num.pop(decoded_image_obj_id)
+
+        # the decodes that are already running can't be cancelled, they are kept, so that their results are cached
+        # (see _poll_decoded_pages), and the page isn't decoded again when it is scrolled back to
+        key = (page_num, self._zoom)
+        if key in self._page_decode_futures and self._page_decode_futures[key].cancel():
+            self._page_decode_futures.pop(key)
+
+        self._dict_page_num_to_unzoomed_size.pop(page_num)
+        for tile_id, _ in self._dict_page_num_to_tiles.pop(page_num, {}).values():
+            self._canvas.delete(tile_id)
+            self._dict_canvas_id_to_page_num.pop(tile_id)
+        for key in tuple(self._page_tile_decode_futures.keys()):
+            if key[0] == page_num and self._page_tile_decode_futures[key].cancel():
+                self._page_tile_decode_futures.pop(key)
+
+    @_measured
+    def _draw_annotations_on_canvas_for_page(self, page_num):
+        for annotation in self._annotations.get(page_num, []):
+            self._draw_annotation(page_num, annotation)
+
+    def _save_annotations(self, compact_if_long=True):
         if ALLOW_DEBUGGING:
-            print("Draw annotations in dict on to canvas for page")
+            print("Save annotations")
 
-        if str(page_num) not in self._annotations:
-            if ALLOW_DEBUGGING:
-                print("No annotations exist for page", page_num)
+        # every change is already in the journal, so, the annotations file is written only if the journal is long
+        # (and not at all while closing the app, then, the journal is compacted after the book's next change)
+        if self._annotations_journal is None:
             return
-
-        # remove duplicates
-        annotations_as_set = set(map(tuple, self._annotations[str(page_num)]))
-        # directly converting to set is throwing an error: unhashable type: 'list', so,
-        # each annotation(which is itself a list) in the list of annotations is converted to tuple
-        if len(annotations_as_set) != len(self._annotations[str(page_num)]):
+        if compact_if_long and self._annotations_journal.num_records >= ANNOTATIONS_JOURNAL_MAX_RECORDS:
+            self._compact_annotations_journal()
+        self._annotations_journal.close()
+
+    def _save_annotations_of_page_to_journal(self, page_num):
+        # called after every change to the annotations of a page
+        page_annotations = self._annotations.get(page_num, [])
+        self._annotations_index.set_page(page_num, page_annotations)
+        if self._annotations_journal is None:
             if ALLOW_DEBUGGING:
-                print("Duplicates found:", self._annotations[str(page_num)])
-            self._annotations[str(page_num)] = list(map(list, annotations_as_set))
-
-        for a in self._annotations[str(page_num)]:
-            dx, dy = a[:2]
-            ann_type = a[2]
-            if ann_type == TAG_ARROW:
-                self._add_arrow_annotation(dx, dy, page_num)
-            elif ann_type == TAG_TEXT:
-                text = a[3]
-                anchor = ANNOTATION_TEXT_DEFAULT_ANCHOR
-                justify = ANNOTATION_TEXT_DEFAULT_JUSTIFY
-                try:
-                    anchor = a[4]
-                    justify = a[5]
-                except IndexError:
-                    pass
-                self._add_new_text_annotation(dx, dy, page_num, text, anchor, justify)
-
-    def _save_annotations(self):
+                print("No annotations journal (the book has no metadata folder), so, the change isn't saved")
+            return
+        try:
+            self._annotations_journal.append(page_num, [a.to_list() for a in page_annotations])
+        except IOError:
+            print("Couldn't write to annotations journal of page", page_num)
+            return
+        try:
+            self._get_library_annotations_index().set_page(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK], page_num,
+                                                           [a.to_list() for a in page_annotations])
+        except sqlite3.Error as e:
+            print("Error: Couldn't update the library annotations index:", e)
+        if self._annotations_journal.num_records >= ANNOTATIONS_JOURNAL_MAX_RECORDS:
+            self._compact_annotations_journal()
+
+    def _compact_annotations_journal(self):
         if ALLOW_DEBUGGING:
-            print("Save annotations")
-
-        # first, save annotations of page images being displayed on canvas back to dict
-        for p in self._dict_page_num_to_image:
-            self._save_annotations_back_to_the_dict_for_page(p)
-
-        metadata_folder = get_metadata_folder(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK])
-        annotations_file_path = get_annotations_file_path(metadata_folder)
+            print("Compact annotations journal with", self._annotations_journal.num_records, "records")
         try:
-            with open(annotations_file_path, 'w') as f:
-                f.write(json.dumps(self._annotations))
+            self._annotations_journal.compact(annotations_to_json(self._annotations))
         except IOError:
-            print("Couldn't write to annotations file:", annotations_file_path)
+            print("Couldn't write to annotations file of", self._gui_settings[KEY_CURRENTLY_OPENED_BOOK])
 
     def _read_annotations(self):
         if ALLOW_DEBUGGING:
@@ -957,16 +2363,27 @@ class PdfViewer(tk.Tk):
 
         metadata_folder = get_metadata_folder(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK])
         annotations_file_path = get_annotations_file_path(metadata_folder)
+        annotations = dict()
         try:
             with open(annotations_file_path) as f:
-                self._annotations = json.loads(f.read())
+                annotations = json.loads(f.read())
             if ALLOW_DEBUGGING:
-                print("Annotations:", self._annotations)
+                print("Annotations:", annotations)
         except IOError:
             print("Couldn't write to annotations file:", annotations_file_path)
         except json.JSONDecodeError:
             print("Bad json in", annotations_file_path)
 
+        # the changes made after the annotations file was last written
+        self._annotations_journal = _AnnotationsJournal(metadata_folder)
+        self._annotations_journal.replay(annotations)
+        if ALLOW_DEBUGGING:
+            print("Replayed", self._annotations_journal.num_records, "records from annotations journal")
+
+        self._annotations = annotations_from_json(annotations)
+
+        self._annotations_index.build(self._annotations)
+
     def _event_handler_for_text_annotation(self, event):
         if ALLOW_DEBUGGING:
             print("Event handler for text annotation")
@@ -974,91 +2391,59 @@ class PdfViewer(tk.Tk):
         canvas_x = self._canvas.canvasx(event.x)
         canvas_y = self._canvas.canvasy(event.y)
 
-        # there should be an underlying page to add a text annotation
-        closest = self._canvas.find_closest(canvas_x, canvas_y)  # either empty, or a singleton with closest object id
-        if len(closest) == 0:
-            if ALLOW_DEBUGGING:
-                print("No page exists at this position, so, annotation can't be added")
-            return
-
-        obj_id = closest[0]
-        tags_of_this_object = self._canvas.gettags(obj_id)
-        if ALLOW_DEBUGGING:
-            print(obj_id, tags_of_this_object)
-
-        if TAG_TEXT in tags_of_this_object:
-            self._edit_existing_text_annotation(obj_id)
-        elif TAG_PAGE_IMAGE in tags_of_this_object:
-            # this is a page-image object
-            try:
-                page_num = self._dict_canvas_id_to_page_num.get(obj_id)
-                page_x1, page_y1, _, _ = self._canvas.bbox(obj_id)
-                dx = canvas_x - page_x1
-                dy = canvas_y - page_y1
-                self._add_new_text_annotation(dx, dy, page_num)
-            except KeyError:
-                if ALLOW_DEBUGGING:
-                    print("ERROR: Page object", obj_id, "doesn't exist in the dict")
-                return
+        # there should be an underlying text annotation to edit, or, a page to add a text annotation to
+        obj_id = self._find_annotation_at(canvas_x, canvas_y)
+        page_num = self._find_page_at(canvas_x, canvas_y)
+        if obj_id is not None:
+            if self._dict_canvas_id_to_annotation[obj_id][1].kind == TAG_TEXT:
+                self._edit_existing_text_annotation(obj_id)
+            elif ALLOW_DEBUGGING:
+                print("The underlying annotation is not a text annotation, so, it can't be edited")
+        elif page_num is not None:
+            dx = (canvas_x - PAGE_X1) / self._zoom  # annotations are stored unzoomed
+            dy = (canvas_y - self._page_tops[page_num - 1]) / self._zoom
+            self._add_new_text_annotation(dx, dy, page_num)
         else:
             if ALLOW_DEBUGGING:
                 print("The underlying object is neither a text annotation for editing,"
                       " nor a page image to add new text annotation on to.")
 
-        return
-
-    def _add_new_text_annotation(self, dx, dy, page_num, text=None,
-                                 anchor=ANNOTATION_TEXT_DEFAULT_ANCHOR, justify=ANNOTATION_TEXT_DEFAULT_JUSTIFY):
-
-        # if text is None, ask user for new text
-        if text is None:
-            self._unbind_all_hot_keys()  # otherwise pressing any hot keys in the text dialog will run their handlers
-            result = ask_text("New Text Annotation", "Please enter text:",
-                              text_anchor=self._gui_settings.get(KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_ANCHOR,
-                                                                 ANNOTATION_TEXT_DEFAULT_ANCHOR),
-                              text_justify=self._gui_settings.get(KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_JUSTIFY,
-                                                                  ANNOTATION_TEXT_DEFAULT_JUSTIFY))
-            self._bind_all_hot_keys()
-
-            if result is None:
-                if ALLOW_DEBUGGING:
-                    print("New text annotation cancelled")
-                return
+    def _add_new_text_annotation(self, dx, dy, page_num):
+        self._unbind_all_hot_keys()  # otherwise pressing any hot keys in the text dialog will run their handlers
+        from dialogs import ask_text
+        result = ask_text("New Text Annotation", "Please enter text:", None,
+                          text_anchor=self._gui_settings.get(KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_ANCHOR,
+                                                             ANNOTATION_TEXT_DEFAULT_ANCHOR),
+                          text_justify=self._gui_settings.get(KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_JUSTIFY,
+                                                              ANNOTATION_TEXT_DEFAULT_JUSTIFY))
+        self._bind_all_hot_keys()
 
-            text, anchor, justify = result
+        if result is None:
+            if ALLOW_DEBUGGING:
+                print("New text annotation cancelled")
+            return
 
-            # save user selected anchor and justify for future use
-            self._gui_settings[KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_ANCHOR] = anchor
-            self._gui_settings[KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_JUSTIFY] = justify
+        text, anchor, justify = result
 
-            text = text.strip()
-            if text == "":
-                if ALLOW_DEBUGGING:
-                    print("Text annotation cancelled (empty string received)")
-                return
+        # save user selected anchor and justify for future use
+        self._gui_settings[KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_ANCHOR] = anchor
+        self._gui_settings[KEY_GUI_RECENTLY_USED_TEXT_ANNOTATION_JUSTIFY] = justify
+        self._save_gui_settings_later()
 
-        try:
-            page_x1, page_y1, _, _ = self._canvas.bbox(self._dict_page_num_to_canvas_id[page_num])
-        except KeyError:
+        text = text.strip()
+        if text == "":
             if ALLOW_DEBUGGING:
-                print(f"ERROR: Page-{page_num} doesn't exist on canvas")
+                print("Text annotation cancelled (empty string received)")
             return
 
-        annotation_id = self._canvas.create_text(
-            page_x1 + dx, page_y1 + dy,
-            text=text, fill=ANNOTATION_TEXT_COLOR, anchor=anchor, justify=justify,
-            tags=(TAG_OBJECT, TAG_ANNOTATION, TAG_TEXT, get_page_num_tag(page_num),
-                  get_tag_annotation_deltas(dx, dy))
-        )
-        if ALLOW_DEBUGGING:
-            print("Text annotation added with id:", annotation_id, "tags:", self._canvas.gettags(annotation_id))
+        self._add_annotation(page_num, _Annotation(dx, dy, TAG_TEXT, text, anchor, justify))
 
     def _edit_existing_text_annotation(self, text_annotation_object):
-        text = self._canvas.itemcget(text_annotation_object, 'text').strip()
-        anchor = self._canvas.itemcget(text_annotation_object, 'anchor')
-        justify = self._canvas.itemcget(text_annotation_object, 'justify')
+        page_num, annotation = self._dict_canvas_id_to_annotation[text_annotation_object]
         self._unbind_all_hot_keys()
-        result = ask_text("Edit text", "Please make any changes:", text, anchor, justify)
+        from dialogs import ask_text
+        result = ask_text("Edit text", "Please make any changes:", annotation.text.strip(), annotation.anchor,
+                          annotation.justify)
         self._bind_all_hot_keys()
         if result is None:
             if ALLOW_DEBUGGING:
@@ -1070,25 +2455,12 @@ class PdfViewer(tk.Tk):
             if ALLOW_DEBUGGING:
                 print("Edit text cancelled because new text is empty")
             return
-        old_tags = self._canvas.gettags(text_annotation_object)
-
-        dx, dy, page_num = None, None, None
-        for t in old_tags:
-            if t.startswith(PREFIX_TAG_ANNOTATION_DELTAS):
-                dx, dy = get_dx_dy_from_tag_annotation_deltas(t)
-                break
-        for t in old_tags:
-            if t.startswith(PREFIX_TAG_PAGE_NUM):
-                page_num = int(str.rsplit(t, "-", 1)[-1])
-                break
-
-        if dx is None or dy is None or page_num is None:
-            if ALLOW_DEBUGGING:
-                print(f"ERROR: dx={dx}, dy={dy}, pageNum={page_num}. Edit text annotation cancelled")
-            return
 
-        self._canvas.delete(text_annotation_object)
-        self._add_new_text_annotation(dx, dy, page_num, new_text, anchor, justify)
+        # the canvas item is changed in place, so, it keeps its id (and its highlight, if any)
+        annotation.text, annotation.anchor, annotation.justify = new_text, anchor, justify
+        self._canvas.itemconfigure(text_annotation_object, text=new_text, anchor=anchor, justify=justify)
+        self._annotations_grid.insert(text_annotation_object, self._canvas.bbox(text_annotation_object))
+        self._save_annotations_of_page_to_journal(page_num)
 
         if ALLOW_DEBUGGING:
             print("Text annotation edited")
@@ -1102,6 +2474,11 @@ class PdfViewer(tk.Tk):
                                       "j": self._jump_to_a_page, "h": self._show_help_text,
                                       "p": self._show_visible_page_numbers,
                                       "q": self._open_visible_page_externally,
+                                      "plus": self._zoom_in, "equal": self._zoom_in, "minus": self._zoom_out,
+                                      "t": self._toggle_thumbnails, "i": self._import_a_pdf,
+                                      "F2": self._toggle_performance_overlay, "F3": self._toggle_trace_recording,
+                                      "f": self._search_text, "Escape": self._clear_search_hits,
+                                      "a": self._search_annotations_in_library,
                                       }
         except AttributeError:
             print("Error: Some functions mentioned for key bindings in self._hot_key_bindings do not exist."
@@ -1120,250 +2497,121 @@ class PdfViewer(tk.Tk):
         if ALLOW_DEBUGGING:
             print("Save book settings")
 
-        canvas_width = self._canvas.winfo_width()
-        canvas_height = self._canvas.winfo_height()
-
         book_settings = {KEY_CURRENTLY_VISIBLE_PAGES: []}
 
-        objects_in_visible_region = self._canvas.find_overlapping(0, 0, canvas_width, canvas_height)
-        for o in objects_in_visible_region:
-            tags = self._canvas.gettags(o)
-            if ALLOW_DEBUGGING:
-                print("Object", o, "in visible region with tags", tags)
-            if TAG_PAGE_IMAGE not in tags:
-                continue
-            page_num = self._dict_canvas_id_to_page_num.get(o)
-            bbox = self._canvas.bbox(o)
-            x1, y1, _, _ = bbox
-            book_settings[KEY_CURRENTLY_VISIBLE_PAGES].append([page_num, x1, y1])
-
-        book_settings[KEY_SCROLLBAR_POSITIONS] = (self._h_scroll_bookmarks.get(), self._v_scroll_bookmarks.get())
+        # the pages are saved with their positions in the visible area (not on canvas)
+        visible_x1, visible_y1, _, _ = self._get_visible_area()
+        for page_num in self._get_visible_page_nums():
+            x1, y1 = PAGE_X1, self._page_tops[page_num - 1]
+            book_settings[KEY_CURRENTLY_VISIBLE_PAGES].append([page_num, round(x1 - visible_x1),
+                                                               round(y1 - visible_y1)])
+
+        if self._bookmarks_insert_after_id is None:
+            book_settings[KEY_SCROLLBAR_POSITIONS] = (self._h_scroll_bookmarks.get(), self._v_scroll_bookmarks.get())
+        else:  # the bookmarks panel is not filled yet
+            book_settings[KEY_SCROLLBAR_POSITIONS] = self._bookmarks_scroll_positions_to_restore
+        book_settings[KEY_COLLAPSED_BOOKMARKS] = sorted(self._collapsed_bookmarks)
+        book_settings[KEY_PREFETCH_PAGE_RANGE] = self._prefetch_page_range
+        book_settings[KEY_ZOOM] = self._zoom
 
         if ALLOW_DEBUGGING:
             print("Book settings to be saved:", book_settings)
 
         metadata_folder = get_metadata_folder(self._gui_settings[KEY_CURRENTLY_OPENED_BOOK])
-        book_settings_file_path = get_book_settings_file_path(metadata_folder)
-        try:
-            with open(book_settings_file_path, 'w') as f:
-                f.write(json.dumps(book_settings))
-        except IOError:
-            print("Error: Couldn't write to book settings file:", book_settings_file_path)
+        # written on the settings writer's thread; the book is being closed, so, right away
+        self._settings_writer.write(get_book_settings_file_path(metadata_folder), json.dumps(book_settings), delay=0)
 
+    @_measured
     def _down_or_up_arrow(self, event):
         if ALLOW_DEBUGGING:
             print("Down or Up arrow hot key event")
 
         """
-        note: for the below discussion: annotations are ordered by sorting with x1 and then by y1 (of their bbox) 
+        note: annotations are cycled in the order of the annotations index, i.e. by page number, and then by (y, x) on
+        the page, so, the next or previous annotation is found by a binary search in the index, whether or not its page
+        is on canvas
         there are two possibilities: there is a highlighted annotation, there isn't
         if there isn't a highlighted annotation:
-            again two possibilities: there are annotations on canvas, there aren't
-            if there are annotations on canvas:
-                first, try to choose the top-most among the visible annotations
-                if can't then:
-                if direction is up:
-                    try to choose the ones beyond top of the visible portion
-                    if still can't, need to load a new page (lesser page number) with annotations
-                      (--check that volatile things like annotations are saved while loading the new page) 
-                    and choose the bottom most annotation in it
-                else i.e. direction is down:
-                    try to choose the ones beyond the bottom of the visible portion
-                    if still can't, need to load a new page (higher page number) with annotations
-                      (--check that volatile things like annotations are saved while loading the new page)
-                    and choose the top most annotation in it
-            else:  i.e. there are NO annotations on canvas:
-                if direction is up:
-                    need to load a new page (lesser page number) with annotations 
-                    and choose the bottom most annotation in it
-                else i.e. direction is down:
-                    need to load a new page (higher page number) with annotations
-                    and choose the top most annotation in it
-        else:  i.e. there IS a highlighted annotation 
-            two possibilities: it is in the visible region, it is not in the visible region  (happens if scrolled)
-            if it is NOT in the visible region:
+            if there are annotations in the visible area, choose the top-most among them
+            else, if direction is down, choose the first one below the top of the visible area
+            else, i.e. direction is up, choose the last one above the top of the visible area
+        else:  i.e. there IS a highlighted annotation
+            if it is NOT in the visible region (happens if scrolled):
                 bring it into view
-            else i.e. it is in the visible region:
-                if direction is up:
-                    try to go to an annotation above the current highlighted annotation
-                    if can't, need to load a new page (lesser page number) with annotations
-                      (--check that volatile things like annotations are saved while loading the new page) 
-                    and choose the bottom most annotation in it
-                else i.e. direction is down:
-                    try to go to an annotation below the current highlighted annotation
-                    if still can't, need to load a new page (higher page number) with annotations
-                      (--check that volatile things like annotations are saved while loading the new page)
-                    and choose the top most annotation in it
+            else:
+                choose the next one if direction is down, or the previous one if direction is up
+        if the chosen annotation's page isn't on canvas, it is loaded (which also draws its annotations)
         """
 
-        highlighted_annotations = self._canvas.find_withtag(TAG_ANNOTATION_HIGHLIGHTED)
-        # there should either be none or one
-
         if ALLOW_DEBUGGING:
-            print(f"Highlighted annotations:", highlighted_annotations)
-
-        annotations_on_canvas = self._canvas.find_withtag(TAG_ANNOTATION)
-        annotations_on_canvas_with_their_bbox = list(zip(
-            annotations_on_canvas, map(lambda x: self._canvas.bbox(x), annotations_on_canvas)
-        ))
-        # sort by x1 in bbox
-        annotations_on_canvas_with_their_bbox.sort(key=lambda x: x[1][0])  # x[1] is bbox; bbox[0] is x1
-        # then, sort by y1 in bbox (so that sort by y1 is the most recent)
-        annotations_on_canvas_with_their_bbox.sort(key=lambda x: x[1][1])  # x[1] is bbox; bbox[1] is y1
+            print(f"Highlighted annotation:", self._highlighted_annotation_id)
 
+        frame_start_time = time.perf_counter()
         direction_is_down = (event.keysym == "Down")
         canvas_height = self._canvas.winfo_height()
+        visible_y1 = self._canvas.canvasy(0)  # the annotations' y on canvas minus this is their y in the visible area
 
-        annotation_to_highlight = None
+        position_to_highlight = None  # position in the annotations index: (page num, (dy, dx, type))
 
-        if len(highlighted_annotations) == 0:  # there isn't a highlighted annotation
-            if len(annotations_on_canvas) > 0:  # there are annotations on canvas
-                # try to choose the top-most visible annotation if any
-                for a, bbox in annotations_on_canvas_with_their_bbox:
-                    y1 = bbox[1]
-                    if 0 <= y1 < canvas_height:
-                        annotation_to_highlight = a
-                        break
-                if annotation_to_highlight is None:
-                    if direction_is_down:
-                        # try to choose the ones beyond the bottom of the visible portion
-                        for a, bbox in annotations_on_canvas_with_their_bbox:
-                            y1 = bbox[1]
-                            if y1 > canvas_height:
-                                annotation_to_highlight = a
-                                break
-                        if annotation_to_highlight is None:
-                            # (handled at bottom)
-                            # need to load a new page (higher page number) with annotations
-                            # (--check that volatile things like annotations are saved while loading the new page)
-                            # and choose the top most annotation in it
-                            pass
-                    else:
-                        # try to choose the ones beyond top of the visible portion
-                        for a, bbox in reversed(annotations_on_canvas_with_their_bbox):
-                            # reversed because, we want to get bottom-most
-                            y1 = bbox[1]
-                            if y1 < 0:
-                                annotation_to_highlight = a
-                                break
-                        if annotation_to_highlight is None:
-                            # (handled at bottom)
-                            # need to load a new page (lesser page number) with annotations
-                            # (--check that volatile things like annotations are saved while loading the new page)
-                            # and choose the bottom most annotation in it
-                            pass
-            else:  # there aren't any annotations on canvas
-                if direction_is_down:
-                    # (handled at bottom)
-                    # need to load a new page (higher page number) with annotations
-                    # and choose the top most annotation in it
-                    pass
-                else:
-                    # (handled at bottom)
-                    # need to load a new page (lesser page number) with annotations
-                    # and choose the bottom most annotation in it
-                    pass
-        elif len(highlighted_annotations) == 1:
-            current_highlighted_annotation = highlighted_annotations[0]
+        if self._highlighted_annotation_id is None:  # there isn't a highlighted annotation
+            top_position = self._get_annotations_index_position_at_canvas_y(visible_y1)
+            first_below_top = self._annotations_index.get_next(top_position)
+            if first_below_top is not None and self._is_annotations_index_position_visible(first_below_top):
+                position_to_highlight = first_below_top  # the top-most visible annotation
+            elif direction_is_down:
+                position_to_highlight = first_below_top
+            else:
+                position_to_highlight = self._annotations_index.get_previous(top_position)
+        else:
+            current_position = self._get_annotations_index_position_of_canvas_item(self._highlighted_annotation_id)
             _, y1_current_highlighted_annotation, _, y2_current_highlighted_annotation =\
-                self._canvas.bbox(current_highlighted_annotation)
+                self._annotations_grid.get_bbox(self._highlighted_annotation_id)
+            y1_current_highlighted_annotation -= visible_y1
+            y2_current_highlighted_annotation -= visible_y1
             if y2_current_highlighted_annotation < 0 or y1_current_highlighted_annotation >= canvas_height:
                 # highlighted annotation is outside visible region
-                annotation_to_highlight = current_highlighted_annotation
-                pass
-            else:  # highlighted annotation IS in the visible region
-                if direction_is_down:
-                    # try to go to an annotation below the current highlighted annotation
-                    for i in range(len(annotations_on_canvas_with_their_bbox)):
-                        a = annotations_on_canvas_with_their_bbox[i][0]
-                        if a == current_highlighted_annotation:
-                            if (i + 1) < len(annotations_on_canvas_with_their_bbox):
-                                annotation_to_highlight = annotations_on_canvas_with_their_bbox[i+1][0]
-                            break
-                    if annotation_to_highlight is None:
-                        # (handled at bottom)
-                        # need to load a new page (higher page number) with annotations
-                        # (--check that volatile things like annotations are saved while loading the new page)
-                        # and choose the top most annotation in it
-                        pass
-                else:
-                    # try to go to an annotation above the current highlighted annotation
-                    for i in range(len(annotations_on_canvas_with_their_bbox)):
-                        a = annotations_on_canvas_with_their_bbox[i][0]
-                        if a == current_highlighted_annotation:
-                            if i > 0:
-                                annotation_to_highlight = annotations_on_canvas_with_their_bbox[i-1][0]
-                            break
-                    if annotation_to_highlight is None:
-                        # (handled at bottom)
-                        # need to load a new page (lesser page number) with annotations
-                        # (--check that volatile things like annotations are saved while loading the new page)
-                        # and choose the bottom most annotation in it
-                        pass
-
-        else:  # error there can't be more than 1 highlighted annotations
-            print("Error: There can't be more than 1 highlighted annotations. Their details:")
-            for a in highlighted_annotations:
-                print("Object", a, "with tags:", self._canvas.gettags(a))
-            # todo: un-highlight all annotations
+                position_to_highlight = current_position
+            elif direction_is_down:
+                position_to_highlight = self._annotations_index.get_next(current_position)
+            else:
+                position_to_highlight = self._annotations_index.get_previous(current_position)
+
+        if position_to_highlight is None:
+            if ALLOW_DEBUGGING:
+                print("No more annotations in this book")
             return
 
-        if annotation_to_highlight is None:
+        page_num, (dy, dx, ann_type) = position_to_highlight
+        if page_num not in self._dict_page_num_to_image:
+            self._load_page(page_num)  # this also draws the annotations of the page
+            visible_y1 = self._canvas.canvasy(0)
 
-            # need to load new page with annotations
-            sorted_page_nums_with_annotations = sorted(
-                map(int, self._annotations.keys()),
-                reverse=(not direction_is_down))  # if direction is up, we get descending order
+        annotation_to_highlight = self._get_canvas_id_of_annotation_at(page_num, (dy, dx, ann_type))
+        if annotation_to_highlight is None:
+            print("Error: Annotation to highlight is not on canvas. This shouldn't happen.")
+            return
 
-            page_to_load = None
+        x1, y1, x2, y2 = self._highlight_annotation(annotation_to_highlight)
+        y1 -= visible_y1  # in the visible area
+        y2 -= visible_y1
+        if y1 > canvas_height or y2 < 0:  # the highlighted annotation is out of sight
             if direction_is_down:
-                highest_page_num_on_canvas = max(self._dict_page_num_to_image.keys())
-                for p in sorted_page_nums_with_annotations:
-                    if p > highest_page_num_on_canvas and len(self._annotations[str(p)]) > 0:
-                        page_to_load = p
-                        break
+                # bring to the top: it's y1 should be at top highlighted-padding
+                dy = ANNOTATION_HIGHLIGHTED_BRING_TO_SIGHT_PADDING - y1
             else:  # direction is up
-                lowest_page_num_on_canvas = min(self._dict_page_num_to_image.keys())
-                for p in sorted_page_nums_with_annotations:
-                    if p < lowest_page_num_on_canvas and len(self._annotations[str(p)]) > 0:
-                        page_to_load = p
-                        break
-
-            if page_to_load is None:
-                if ALLOW_DEBUGGING:
-                    print("No more annotations in this book")
-                return
-
-            self._load_page(page_to_load)  # note that this will also save any volatile annotations and clears canvas
-            # and also draws annotations
-
-            annotations_on_canvas = self._canvas.find_withtag(TAG_ANNOTATION)
-            annotations_on_canvas_with_their_bbox = list(zip(
-                annotations_on_canvas, map(lambda x: self._canvas.bbox(x), annotations_on_canvas)
-            ))
-            annotations_on_canvas_with_their_bbox.sort(key=lambda x: x[1][0])  # x[1] is bbox, x[1][0] is x1
-            annotations_on_canvas_with_their_bbox.sort(key=lambda x: x[1][1])  # x[1] is bbox, x[1][1] is y1
-
-            # now depending on the direction, scroll to the annotation
-            if direction_is_down:  # highlight top most
-                annotation_to_highlight = annotations_on_canvas_with_their_bbox[0][0]
-            else:  # highlight bottom most
-                annotation_to_highlight = annotations_on_canvas_with_their_bbox[-1][0]
+                # bring to the bottom: it's y2 should be at the bottom highlighted-padding
+                dy = canvas_height - ANNOTATION_HIGHLIGHTED_BRING_TO_SIGHT_PADDING - y2
+            self._stop_scrolling()
+            self._canvas.yview_scroll(-dy, "units")
+            self._update_pages_on_canvas()
 
-        if annotation_to_highlight is None:
-            print("Error: Annotation to highlight is None. This shouldn't happen.")
-            return
+        self._measure_frame(frame_start_time)
 
+    def _highlight_annotation(self, annotation_id):
+        # un-highlights the highlighted annotation, if any, and returns the bbox drawn around the given annotation
         self._canvas.delete(TAG_BBOX)
-        try:
-            self._canvas.dtag(highlighted_annotations[0], TAG_ANNOTATION_HIGHLIGHTED)
-        except IndexError:  # highlighted_annotations is either empty or singleton
-            if ALLOW_DEBUGGING:
-                print("No highlighted annotation exists yet to remove the tag from")
-            pass
-
-        self._canvas.addtag_withtag(TAG_ANNOTATION_HIGHLIGHTED, annotation_to_highlight)
-        x1, y1, x2, y2 = self._canvas.bbox(annotation_to_highlight)
+        self._highlighted_annotation_id = annotation_id
+        x1, y1, x2, y2 = self._annotations_grid.get_bbox(annotation_id)
         x1 -= ANNOTATION_HIGHLIGHT_BBOX_PADDING
         y1 -= ANNOTATION_HIGHLIGHT_BBOX_PADDING
         x2 += ANNOTATION_HIGHLIGHT_BBOX_PADDING
@@ -1371,64 +2619,420 @@ class PdfViewer(tk.Tk):
         self._canvas.create_rectangle(x1, y1, x2, y2, outline=ANNOTATION_HIGHLIGHT_COLOR,
                                       width=ANNOTATION_HIGHLIGHT_WIDTH,
                                       tags=(TAG_OBJECT, TAG_BBOX))
-        if y1 > canvas_height or y2 < 0:  # the highlighted annotation is out of sight
-            if direction_is_down:
-                # bring to the top: it's y1 should be at top highlighted-padding
-                dy = ANNOTATION_HIGHLIGHTED_BRING_TO_SIGHT_PADDING - y1
-            else:  # direction is up
-                # bring to the bottom: it's y2 should be at the bottom highlighted-padding
-                dy = canvas_height - ANNOTATION_HIGHLIGHTED_BRING_TO_SIGHT_PADDING - y2
-            self._canvas.move(TAG_OBJECT, 0, dy)
-            self._load_neighbor_pages_if_there_is_empty_space_on_visible_area()
+        return x1, y1, x2, y2
+
+    def _get_annotations_index_position_of_canvas_item(self, annotation_id):
+        page_num, annotation = self._dict_canvas_id_to_annotation[annotation_id]
+        return page_num, annotation.get_position()
+
+    def _get_canvas_id_of_annotation_at(self, page_num, position_in_page):
+        # the canvas item of the annotation at the position (as in the annotations index) on the page, or None
+        for annotation in self._annotations.get(page_num, []):
+            if annotation.get_position() == position_in_page:
+                return self._dict_annotation_to_canvas_id.get(annotation)
+        return None
+
+    def _get_annotations_index_position_at_canvas_y(self, y):
+        # a position (that is between annotations) in the annotations index at the given y on canvas
+        if len(self._page_tops) == 0:
+            return 0, (-math.inf, -math.inf, "")  # before all the annotations
+        page_num = max(1, bisect.bisect_right(self._page_tops, y))  # the last page whose top is not below y
+        return page_num, ((y - self._page_tops[page_num - 1]) / self._zoom, -math.inf, "")
+
+    def _is_annotations_index_position_visible(self, position):
+        page_num, (dy, _, _) = position
+        _, visible_y1, _, visible_y2 = self._get_visible_area()
+        return visible_y1 <= self._page_tops[page_num - 1] + dy * self._zoom < visible_y2
+
+    def _zoom_in(self, _event):
+        self._set_zoom(self._zoom * ZOOM_STEP)
+
+    def _zoom_out(self, _event):
+        self._set_zoom(self._zoom / ZOOM_STEP)
+
+    def _set_zoom(self, zoom):
+        zoom = round(min(MAX_ZOOM, max(MIN_ZOOM, zoom)), 4)  # rounded because zoom is a part of the cache keys
+        if zoom == self._zoom:
+            return
 
-    def _load_neighbor_pages_if_there_is_empty_space_on_visible_area(self):
         if ALLOW_DEBUGGING:
-            print("Load neighbor pages if there is empty space on visible area")
+            print("Set zoom from", self._zoom, "to", zoom)
 
-        # canvas_width = self._canvas.winfo_width()
-        canvas_height = self._canvas.winfo_height()
+        visible_page_nums = self._get_visible_page_nums()
 
-        existing_pages_on_canvas = sorted(self._dict_page_num_to_image.keys())
-        if len(existing_pages_on_canvas) == 0:
-            if ALLOW_DEBUGGING:
-                print("There are no pages on canvas")
-            return 
+        # the pages drawn at the old zoom are removed, they are drawn again at the new zoom as they come into view
+        for p in tuple(self._dict_page_num_to_image.keys()):
+            self._delete_page_from_canvas(p)  # the annotations are drawn again from the model at the new zoom
+        self._canvas.delete(TAG_OBJECT)  # the annotation highlight
+
+        if len(visible_page_nums) == 0:
+            self._zoom = zoom
+            self._lay_out_pages()
+            return
+
+        # the pages are laid out again at the new zoom, such that, the same part of the top-most page in the visible
+        # area is at the top of the visible area
+        top_page = visible_page_nums[0]
+        y1 = self._page_tops[top_page - 1] - self._canvas.canvasy(0)
+        y1 = round(y1 * zoom / self._zoom)
+        self._zoom = zoom
+        self._lay_out_pages()
+        self._load_page(top_page, y=y1)
+
+    def _open_thumbnails(self, book_folder):
+        self._num_pages = get_num_pages(book_folder)
+        self._canvas_thumbnails.configure(scrollregion=(0, 0, THUMBNAIL_PANEL_WIDTH,
+                                                        self._num_pages * THUMBNAIL_ROW_HEIGHT))
+        self._canvas_thumbnails.yview_moveto(0)
+
+        metadata_folder = get_metadata_folder(book_folder)
+        if os.path.exists(metadata_folder):
+            try:
+                self._thumbnails_db = open_thumbnails_db(metadata_folder)
+            except sqlite3.Error as e:
+                print("Error: Couldn't open the thumbnails file:", e)
+            else:
+                # the thumbnails are made in the background, so, opening a book doesn't wait for them
+                self._thumbnail_builder = _ThumbnailBuilder(book_folder, self._num_pages)
+                self._thumbnail_builder.start()
+                self._thumbnail_poll_after_id = self.after(THUMBNAIL_POLL_INTERVAL, self._poll_made_thumbnails)
+
+        self._update_visible_thumbnails()
+
+    def _close_thumbnails(self):
+        if self._thumbnail_builder is not None:
+            self._thumbnail_builder.stop()  # not joined, the thread stops after the thumbnail being made
+            self._thumbnail_builder = None
+        if self._thumbnail_poll_after_id is not None:
+            self.after_cancel(self._thumbnail_poll_after_id)
+            self._thumbnail_poll_after_id = None
+        if self._thumbnails_db is not None:
+            self._thumbnails_db.close()
+            self._thumbnails_db = None
+        self._canvas_thumbnails.delete(tk.ALL)
+        self._dict_page_num_to_thumbnail.clear()
+        self._num_pages = 0
+
+    def _poll_made_thumbnails(self):
+        self._thumbnail_poll_after_id = None
+        made_thumbnails = self._thumbnail_builder.made_thumbnails
+        redraw = False
+        while not made_thumbnails.empty():
+            page_num = made_thumbnails.get_nowait()
+            if page_num in self._dict_page_num_to_thumbnail:  # it is on canvas, but, is outdated or a placeholder
+                self._dict_page_num_to_thumbnail.pop(page_num)
+                self._canvas_thumbnails.delete(self._get_thumbnail_tag(page_num))
+                redraw = True
+        if redraw:
+            self._update_visible_thumbnails()
+
+        if self._thumbnail_builder.is_alive() or not made_thumbnails.empty():
+            self._thumbnail_poll_after_id = self.after(THUMBNAIL_POLL_INTERVAL, self._poll_made_thumbnails)
 
-        min_page = existing_pages_on_canvas[0]
-        max_page = existing_pages_on_canvas[-1]
+    @staticmethod
+    def _get_thumbnail_tag(page_num):
+        return f"thumb-{page_num}"
 
-        min_page_bbox = self._canvas.bbox(self._dict_page_num_to_canvas_id[min_page])
-        max_page_bbox = self._canvas.bbox(self._dict_page_num_to_canvas_id[max_page])
+    def _y_scroll_in_canvas_thumbnails(self, first, last):
+        self._v_scroll_thumbnails.set(first, last)
+        self._update_visible_thumbnails()
 
-        _, min_page_top, _, _ = min_page_bbox
-        _, _, _, max_page_bottom = max_page_bbox
+    def _update_visible_thumbnails(self):
+        # virtualization: only the thumbnails in the visible part of the canvas exist on it
+        if self._num_pages == 0:
+            return
+        top = self._canvas_thumbnails.canvasy(0)
+        bottom = self._canvas_thumbnails.canvasy(self._canvas_thumbnails.winfo_height())
+        first_page = max(1, int(top // THUMBNAIL_ROW_HEIGHT) + 1)
+        last_page = min(self._num_pages, int(bottom // THUMBNAIL_ROW_HEIGHT) + 1)
+
+        for page_num in tuple(self._dict_page_num_to_thumbnail.keys()):
+            if page_num < first_page or page_num > last_page:
+                self._dict_page_num_to_thumbnail.pop(page_num)
+                self._canvas_thumbnails.delete(self._get_thumbnail_tag(page_num))
+
+        pages_without_thumbnails = []
+        for page_num in range(first_page, last_page + 1):
+            if page_num in self._dict_page_num_to_thumbnail:
+                continue
 
-        if min_page_top > PIXELS_BETWEEN_PAGES:
-            if ALLOW_DEBUGGING:
-                print("Empty space detected at top. Loading a previous neighbor page: Page", min_page - 1)
-            self._load_page(min_page - 1, delete_all_objects=False, y=min_page_top-PIXELS_BETWEEN_PAGES, anchor="sw")
+            png = None
+            if self._thumbnails_db is not None:
+                row = self._thumbnails_db.execute("SELECT png FROM thumbnails WHERE page = ?", (page_num,)).fetchone()
+                if row is not None:
+                    png = row[0]
+
+            tag = self._get_thumbnail_tag(page_num)
+            x = THUMBNAIL_PANEL_WIDTH // 2
+            y = (page_num - 1) * THUMBNAIL_ROW_HEIGHT + 5
+            if png is None:
+                thumbnail = None
+                pages_without_thumbnails.append(page_num)
+                self._canvas_thumbnails.create_rectangle(
+                    x - THUMBNAIL_MAX_SIZE[0] // 2, y, x + THUMBNAIL_MAX_SIZE[0] // 2, y + THUMBNAIL_MAX_SIZE[1],
+                    fill=PAGE_PLACEHOLDER_COLOR, width=0, tags=(tag,))
+            else:
+                from PIL import Image, ImageTk
+                thumbnail = ImageTk.PhotoImage(Image.open(io.BytesIO(png)))
+                self._canvas_thumbnails.create_image(x, y, anchor="n", image=thumbnail, tags=(tag,))
+            self._canvas_thumbnails.create_text(x, y + THUMBNAIL_MAX_SIZE[1] + 5, anchor="n", text=str(page_num),
+                                                tags=(tag,))
+            self._dict_page_num_to_thumbnail[page_num] = thumbnail
+
+        if self._thumbnail_builder is not None and len(pages_without_thumbnails) > 0:
+            self._thumbnail_builder.prioritize(pages_without_thumbnails)
+
+    def _mouse_wheel_in_canvas_thumbnails(self, event):
+        self._canvas_thumbnails.yview_scroll(-(event.delta // 120), "units")  # a unit is a thumbnail row
+
+    def _click_on_a_thumbnail(self, event):
+        page_num = int(self._canvas_thumbnails.canvasy(event.y) // THUMBNAIL_ROW_HEIGHT) + 1
+        if ALLOW_DEBUGGING:
+            print("Clicked thumbnail of page", page_num)
+        if 1 <= page_num <= self._num_pages:
+            self._load_page(page_num)
+
+    def _toggle_thumbnails(self, _event):
+        show_thumbnails = not self._frame_thumbnails.winfo_ismapped()
+        if show_thumbnails:
+            self._frame_thumbnails.grid()
         else:
+            self._frame_thumbnails.grid_remove()
+        self._gui_settings[KEY_SHOW_THUMBNAILS] = show_thumbnails
+        self._save_gui_settings_later()
+
+    def _import_a_pdf(self, _event):
+        if ALLOW_DEBUGGING:
+            print("Import a pdf")
+
+        if self._pdf_import_book_folder is not None:
+            messagebox.showinfo("Import a pdf", "Please wait until the pdf being imported is done")
+            return
+
+        from tkinter import filedialog
+        result = filedialog.askopenfilename(filetypes=[("Pdf files", "*.pdf")])
+        if result == "":
             if ALLOW_DEBUGGING:
-                print("No empty space detected at top to load a neighbor page")
+                print("Import a pdf cancelled")
+            return
+
+        pdf_file_path = result
+        self._pdf_import_book_folder = get_book_folder_for_pdf(pdf_file_path)
+        self._pdf_import_stop_event.clear()
+        rasterizer_command = self._gui_settings.setdefault(KEY_PDF_RASTERIZER_COMMAND, DEFAULT_RASTERIZER_COMMAND)
+
+        def import_pdf():
+            # runs on the import thread, so, only the queue is used to talk to the gui
+            try:
+                convert_pdf_to_book(pdf_file_path, self._pdf_import_book_folder, rasterizer_command,
+                                    on_pages_ready=lambda _, num_pages_done, num_pages:
+                                    self._pdf_import_progress.put(("progress", (num_pages_done, num_pages))),
+                                    stop_event=self._pdf_import_stop_event)
+                self._pdf_import_progress.put(("done", None))
+            except Exception as e:  # reported to the user, whatever it is
+                self._pdf_import_progress.put(("error", e))
+
+        threading.Thread(target=import_pdf, name="pdf-import", daemon=True).start()
+        self.after(PDF_IMPORT_POLL_INTERVAL, self._poll_pdf_import_progress)
+
+    def _poll_pdf_import_progress(self):
+        book_folder = self._pdf_import_book_folder
+        book_name = os.path.split(book_folder)[-1]
+
+        while not self._pdf_import_progress.empty():
+            kind, value = self._pdf_import_progress.get_nowait()
+
+            if kind == "progress":
+                num_pages_done, num_pages = value
+                self.title(f"PdfViewer - importing {book_name}: {num_pages_done}/{num_pages} pages")
+                # the book is opened as soon as its first page is ready, the rest of the pages are shown as they are
+                # ready when scrolled to
+                if (self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK) != book_folder and
+                        os.path.isfile(get_page_path(book_folder, 1))):
+                    self._save_current_book_and_clear_canvas_and_bookmarks_and_dictionaries()
+                    self._load_book(book_folder)
+                elif self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK) == book_folder:
+                    self._update_page_layout()  # the pages that are ready now
+                    self._update_pages_on_canvas()
+                continue
+
+            # done or error
+            self._pdf_import_book_folder = None
+            self.set_default_title()
+            if kind == "error":
+                print("Error: Importing the pdf failed:", value)
+                messagebox.showerror("Import a pdf", f"Importing {book_name} failed:\n{value}")
+            elif self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK) == book_folder:
+                # the thumbnails panel is remade to show all the pages
+                self._close_thumbnails()
+                self._open_thumbnails(book_folder)
+            return
+
+        self.after(PDF_IMPORT_POLL_INTERVAL, self._poll_pdf_import_progress)
+
+    def _start_text_index_builder(self):
+        # the builder process indexes only the pages that are not indexed yet, so, it is done quickly if the index is
+        # complete; it is stopped when the book is closed, and continues from where it stopped next time
+        self._text_index_builder_after_id = None
+        book_folder = self._gui_settings[KEY_CURRENTLY_OPENED_BOOK]
+        command = [sys.executable, os.path.join(_FOLDER_OF_THIS_PYTHON_FILE, "text_index.py"), book_folder,
+                   "--pdf_text_command",
+                   json.dumps(self._gui_settings.setdefault(KEY_PDF_TEXT_COMMAND, DEFAULT_PDF_TEXT_COMMAND))]
+        ocr_command = self._gui_settings.setdefault(KEY_OCR_COMMAND, None)
+        if ocr_command is not None:
+            command += ["--ocr_command", json.dumps(ocr_command)]
+        if ALLOW_DEBUGGING:
+            print("Start text index builder:", command)
+        try:
+            self._text_index_builder_process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        except OSError as e:
+            print("Error: Couldn't start the text index builder:", e)
+
+    def _stop_text_index_builder(self):
+        if self._text_index_builder_after_id is not None:
+            self.after_cancel(self._text_index_builder_after_id)
+            self._text_index_builder_after_id = None
+        if self._text_index_builder_process is not None:
+            if self._text_index_builder_process.poll() is None:
+                self._text_index_builder_process.terminate()  # the pages indexed so far are kept
+            self._text_index_builder_process = None
+
+    def _search_text(self, _event):
+        if ALLOW_DEBUGGING:
+            print("Search text")
 
-        if max_page_bottom < canvas_height - PIXELS_BETWEEN_PAGES:
+        book_folder = self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK)
+        if book_folder is None or not os.path.exists(get_metadata_folder(book_folder)):
+            messagebox.showinfo("Search", "Please open a book first")
+            return
+        try:
+            connection = open_text_index_db(get_metadata_folder(book_folder))
+        except sqlite3.Error as e:
+            print("Error: Couldn't open the text index file:", e)
+            return
+
+        def search(query):
+            try:
+                with self._performance_stats.measure("search_text"):
+                    hits = search_text_index(connection, query)
+                num_indexed_pages = get_num_indexed_pages(connection)
+            except sqlite3.Error as e:
+                return [], f"Error: {e}"
+            status = f"{len(hits)} pages found"
+            if num_indexed_pages < len(self._page_sizes):
+                status += f" (only {num_indexed_pages} of {len(self._page_sizes)} pages are indexed yet)"
+            return [(f"Page {page_num}: {len(bboxes)} matches", (page_num, bboxes))
+                    for page_num, bboxes in hits], status
+
+        self._unbind_all_hot_keys()  # otherwise pressing any hot keys in the search dialog will run their handlers
+        try:
+            from dialogs import ask_search
+            result = ask_search("Search", "Please enter words to search:", search, self._search_query)
+        finally:
+            self._bind_all_hot_keys()
+            connection.close()
+
+        if result is None:
             if ALLOW_DEBUGGING:
-                print("Empty space detected at bottom. Loading a next page: Page", max_page + 1)
-            self._load_page(max_page + 1, delete_all_objects=False, y=max_page_bottom+PIXELS_BETWEEN_PAGES)
-        else:
+                print("Search cancelled, or, nothing found")
+            return
+
+        self._search_query, (page_num, bboxes) = result
+        self._show_search_hits(page_num, bboxes)
+
+    def _show_search_hits(self, page_num, bboxes):
+        # highlights the hits (unzoomed bboxes relative to the page), and scrolls the first one to a third of the
+        # visible area's height
+        self._canvas.delete(TAG_SEARCH_HIT)
+        self._search_hits = (page_num, bboxes)
+        if page_num in self._dict_page_num_to_image:
+            self._draw_search_hits_for_page(page_num)  # otherwise, drawn when the page is created
+        first_hit_y = min(y1 for _, y1, _, _ in bboxes)
+        self._load_page(page_num, y=self._canvas.winfo_height() // 3 - round(first_hit_y * self._zoom))
+
+    def _draw_search_hits_for_page(self, page_num):
+        if self._search_hits is None or self._search_hits[0] != page_num:
+            return
+        page_x1, page_y1 = PAGE_X1, self._page_tops[page_num - 1]
+        for x1, y1, x2, y2 in self._search_hits[1]:
+            self._canvas.create_rectangle(page_x1 + x1 * self._zoom - SEARCH_HIT_PADDING,
+                                          page_y1 + y1 * self._zoom - SEARCH_HIT_PADDING,
+                                          page_x1 + x2 * self._zoom + SEARCH_HIT_PADDING,
+                                          page_y1 + y2 * self._zoom + SEARCH_HIT_PADDING,
+                                          outline=SEARCH_HIT_COLOR, width=SEARCH_HIT_WIDTH,
+                                          tags=(TAG_OBJECT, TAG_SEARCH_HIT, get_page_num_tag(page_num)))
+
+    def _clear_search_hits(self, _event):
+        self._search_hits = None
+        self._canvas.delete(TAG_SEARCH_HIT)
+
+    def _get_library_annotations_index(self):
+        if self._library_annotations_index is None:
+            os.makedirs(os.path.dirname(get_library_annotations_index_file_path()), exist_ok=True)
+            self._library_annotations_index = _LibraryAnnotationsIndex(get_library_annotations_index_file_path())
+        return self._library_annotations_index
+
+    def _search_annotations_in_library(self, _event):
+        if ALLOW_DEBUGGING:
+            print("Search annotations in library")
+
+        recently_opened_books = [book_folder for book_folder in self._gui_settings.get(KEY_RECENTLY_OPENED_BOOKS, {})
+                                 if os.path.isdir(get_metadata_folder(book_folder))]
+        try:
+            with self._performance_stats.measure("update_library_annotations_index"):
+                self._get_library_annotations_index().update_books(recently_opened_books)  # only the changed books
+                # are read
+        except sqlite3.Error as e:
+            print("Error: Couldn't update the library annotations index:", e)
+            return
+
+        def search(query):
+            if query.strip() == "":
+                return [], f"{len(recently_opened_books)} books"
+            try:
+                with self._performance_stats.measure("search_library_annotations"):
+                    results = self._library_annotations_index.search(query.strip())
+            except sqlite3.Error as e:
+                return [], f"Error: {e}"
+            hits = [(f"{os.path.split(book_folder)[-1]}, page {page_num}: {' '.join(text.split())}",
+                     (book_folder, page_num, dx, dy))
+                    for book_folder, page_num, dx, dy, text in results]
+            return hits, f"{len(hits)} annotations found in {len(recently_opened_books)} books"
+
+        self._unbind_all_hot_keys()  # otherwise pressing any hot keys in the search dialog will run their handlers
+        try:
+            from dialogs import ask_search
+            result = ask_search("Search annotations", "Please enter text to search in the annotations of the books:",
+                                search, self._library_annotations_search_query)
+        finally:
+            self._bind_all_hot_keys()
+
+        if result is None:
             if ALLOW_DEBUGGING:
-                print("No empty space detected at bottom to load a next neighbor page")
+                print("Search annotations cancelled, or, nothing found")
+            return
+
+        self._library_annotations_search_query, (book_folder, page_num, dx, dy) = result
+        if book_folder != self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK):
+            self._save_current_book_and_clear_canvas_and_bookmarks_and_dictionaries()
+            self._load_book(book_folder)
 
-        # note that this function may be called inside _load_page itself, they will call each other recursively
-        # until the entire visible region is filled (in case of short page heights), however, an infinite loop may
-        # occur if the combined page heights along with the spaces between pages for the maximum number of pages
-        # allowed to load (given by NUM_PAGE_IMAGE_RANGE_TO_KEEP), on a whole, is shorter than the visible region
+        # the annotation at a third of the visible area's height, highlighted
+        self._load_page(page_num, y=self._canvas.winfo_height() // 3 - round(dy * self._zoom))
+        annotation_id = self._get_canvas_id_of_annotation_at(page_num, (dy, dx, TAG_TEXT))
+        if annotation_id is not None:
+            self._highlight_annotation(annotation_id)
 
     def _jump_to_a_page(self, _event):
         if ALLOW_DEBUGGING:
             print("Jump to a page")
 
-        result = simpledialog.askinteger("Jump to", "Please enter a page number to jump to:")
+        from tkinter import simpledialog
+        self._unbind_all_hot_keys()  # otherwise pressing any hot keys (e.g. '-') in the dialog will run their handlers
+        try:
+            result = simpledialog.askinteger("Jump to", "Please enter a page number to jump to:")
+        finally:
+            self._bind_all_hot_keys()
         if ALLOW_DEBUGGING:
             print("Result:", result)
 
@@ -1446,67 +3050,55 @@ class PdfViewer(tk.Tk):
             "2. Middle click to add a text annotation\n" \
             "3. Right click on an existing annotation to remove it\n" \
             "4. Use 'Up' and 'Down' keys to navigate through annotations\n" \
+            "   (click the triangle before a bookmark to collapse or expand the bookmarks nested in it)\n" \
             "Hot keys:\n" \
             "5. Click 'o' to open a new book\n" \
             "6. Click 'r' to choose from recently opened books\n" \
             "7. Click 'j' to jump to a page by page number\n" \
             "8. Click 'p' to show currently visible page numbers\n" \
-            "9. Click 'q' to open currently visible page in an external program"
+            "9. Click 'q' to open currently visible page in an external program\n" \
+            "10. Click '+' or '-' to zoom in or zoom out\n" \
+            "11. Click 't' to show or hide the thumbnails\n" \
+            "12. Click 'i' to import a pdf file (it is converted to a book beside the pdf file)\n" \
+            "13. Click 'F2' to show or hide the performance overlay (times of loading pages, decoding etc.)\n" \
+            "14. Click 'F3' to start recording a trace, and 'F3' again to save it to the data folder\n" \
+            "    (it can be opened in chrome://tracing or https://ui.perfetto.dev)\n" \
+            "15. Click 'f' to search the text of the book, and 'Escape' to remove the highlights of the hits\n" \
+            "    (the text is taken from the pdf file the book was imported from, indexed in the background)\n" \
+            "16. Click 'a' to search the text annotations of all the recently opened books"
         messagebox.showinfo("Help", help_text)
 
     def _show_visible_page_numbers(self, _event):
         if ALLOW_DEBUGGING:
             print("Show visible page numbers")
-        objects_in_visible_region = self._canvas.find_overlapping(0, 0,
-                                                                  self._canvas.winfo_width(),
-                                                                  self._canvas.winfo_height())
-        visible_page_numbers = []
-        for o in objects_in_visible_region:
-            tags = self._canvas.gettags(o)
-            if ALLOW_DEBUGGING:
-                print("Object", o, "in visible region with tags", tags)
-            if TAG_PAGE_IMAGE not in tags:
-                continue
-            page_num = self._dict_canvas_id_to_page_num.get(o)
-            visible_page_numbers.append(page_num)
+        visible_page_numbers = self._get_visible_page_nums()
 
         if len(visible_page_numbers) == 0:
             message = "No pages in visible area"
         else:
-            visible_page_numbers.sort()
             message = f"Pages in visible area: {', '.join(map(str, visible_page_numbers))}"
         messagebox.showinfo("Visible pages", message)
 
     def _open_visible_page_externally(self, _event):
         if ALLOW_DEBUGGING:
             print("Open visible page externally")
-        objects_in_visible_region = self._canvas.find_overlapping(0, 0,
-                                                                  self._canvas.winfo_width(),
-                                                                  self._canvas.winfo_height())
-        visible_page_numbers = []
-        for o in objects_in_visible_region:
-            tags = self._canvas.gettags(o)
-            if ALLOW_DEBUGGING:
-                print("Object", o, "in visible region with tags", tags)
-            if TAG_PAGE_IMAGE not in tags:
-                continue
-            page_num = self._dict_canvas_id_to_page_num.get(o)
-            visible_page_numbers.append(page_num)
+        visible_page_numbers = self._get_visible_page_nums()
 
         if len(visible_page_numbers) == 0:
             messagebox.showinfo("Open visible page externally", "No pages in visible area")
         else:
-            visible_page_numbers.sort()
             os.startfile(get_page_path(self._gui_settings.get(KEY_CURRENTLY_OPENED_BOOK), visible_page_numbers[0]))
 
 
 def main():
-
-    # parser = argparse.ArgumentParser()
-
-    # args = parser.parse_args()
-
-    PdfViewer().mainloop()
+    parser = argparse.ArgumentParser(description="A viewer for books of page images (see import_pdf.py).")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each step of the startup took: the imports, building the window, "
+                             "showing it, and restoring the last opened book "
+                             "(see python -X importtime for the time of each import)")
+    args = parser.parse_args()
+
+    PdfViewer(profile_startup=args.profile_startup).mainloop()
 
     return
 
@@ -0,0 +1,91 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_pdf import NUM_PAGES_PER_RANGE, convert_pdf_to_book  # noqa: E402
+
+NUM_PAGES = 20
+
+# writes <output_root>-<N>.png for the pages of the range, 0-filled for the even pages and not for the odd ones (the
+# rasterizers differ), and appends the range to the log; exits with 1 for the range starting at the failing page
+_STUB_RASTERIZER = """
+import sys
+first_page, last_page, output_root, log_file_path, failing_page = sys.argv[1:]
+with open(log_file_path, 'a') as f:
+    f.write(f"{first_page} {last_page}\\n")
+if first_page == failing_page:
+    sys.stderr.write("stub rasterizer failed")
+    sys.exit(1)
+for page_num in range(int(first_page), int(last_page) + 1):
+    name = str(page_num).rjust(6, "0") if page_num % 2 == 0 else str(page_num)
+    with open(f"{output_root}-{name}.png", 'wb') as f:
+        f.write(b"page %d" % page_num)
+"""
+
+
+def _make_pdf(pdf_file_path):
+    import PyPDF2
+    writer = PyPDF2.PdfFileWriter()
+    for _ in range(NUM_PAGES):
+        writer.addBlankPage(100, 100)
+    chapter = writer.addBookmark("Chapter 1", 0)
+    writer.addBookmark("Section 1.1", 4, parent=chapter)
+    writer.addBookmark("Chapter 2", 9)
+    with open(pdf_file_path, 'wb') as f:
+        writer.write(f)
+
+
+def _make_rasterizer_command(tmp_path, failing_page=0):
+    stub_file_path = tmp_path / "stub_rasterizer.py"
+    stub_file_path.write_text(_STUB_RASTERIZER)
+    log_file_path = str(tmp_path / "rasterizer.log")
+    return ([sys.executable, str(stub_file_path), "{first_page}", "{last_page}", "{output_root}", log_file_path,
+             str(failing_page)], log_file_path)
+
+
+def _read_ranges(log_file_path):
+    with open(log_file_path) as f:
+        return sorted(tuple(map(int, line.split())) for line in f)
+
+
+def test_convert_pdf_to_book(tmp_path):
+    pdf_file_path = str(tmp_path / "book.pdf")
+    _make_pdf(pdf_file_path)
+    rasterizer_command, log_file_path = _make_rasterizer_command(tmp_path)
+    lock = threading.Lock()
+    calls = []
+
+    def on_pages_ready(page_nums, num_pages_done, num_pages):
+        with lock:
+            calls.append((page_nums, num_pages_done, num_pages))
+
+    book_folder = convert_pdf_to_book(pdf_file_path, rasterizer_command=rasterizer_command, num_workers=2,
+                                      on_pages_ready=on_pages_ready)
+
+    assert book_folder == str(tmp_path / "book")
+    assert NUM_PAGES_PER_RANGE == 8
+    assert _read_ranges(log_file_path) == [(1, 8), (9, 16), (17, 20)]
+    assert sorted(os.listdir(book_folder)) == [f"{p:06d}.png" for p in range(1, NUM_PAGES + 1)] + ["metadata"]
+    with open(os.path.join(book_folder, "000007.png"), 'rb') as f:  # renamed from importing-7.png
+        assert f.read() == b"page 7"
+
+    assert sorted(page_nums for page_nums, _, _ in calls) == [list(range(1, 9)), list(range(9, 17)),
+                                                              list(range(17, 21))]
+    assert sorted(num_pages_done for _, num_pages_done, _ in calls) == [8, 16, 20]
+    assert all(num_pages == NUM_PAGES for _, _, num_pages in calls)
+
+    with open(os.path.join(book_folder, "metadata", "bookmarks.json")) as f:
+        assert json.loads(f.read()) == [[0, "Chapter 1", 1], [1, "Section 1.1", 5], [0, "Chapter 2", 10]]
+
+
+def test_convert_pdf_to_book_raises_when_the_rasterizer_fails(tmp_path):
+    pdf_file_path = str(tmp_path / "book.pdf")
+    _make_pdf(pdf_file_path)
+    rasterizer_command, _ = _make_rasterizer_command(tmp_path, failing_page=9)
+    with pytest.raises(RuntimeError, match="pages 9-16 with exit code 1: stub rasterizer failed"):
+        convert_pdf_to_book(pdf_file_path, rasterizer_command=rasterizer_command, num_workers=2)
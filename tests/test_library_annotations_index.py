@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (_AnnotationsJournal, _LibraryAnnotationsIndex, get_annotations_file_path,  # noqa: E402
+                  get_metadata_folder)
+
+
+def _make_book(book_folder, annotations):
+    os.makedirs(get_metadata_folder(book_folder))
+    with open(get_annotations_file_path(get_metadata_folder(book_folder)), 'w') as f:
+        f.write(json.dumps(annotations))
+
+
+def _save_page(index, book_folder, page_num, page_annotations):
+    # like the viewer does: the page is appended to the book's journal, and then, the index is updated
+    journal = _AnnotationsJournal(get_metadata_folder(book_folder))
+    journal.append(page_num, page_annotations)
+    journal.close()
+    index.set_page(book_folder, page_num, page_annotations)
+
+
+def test_editing_a_page_of_a_book_that_was_never_indexed_doesnt_hide_its_other_pages(tmp_path):
+    book_folder = str(tmp_path / "book")
+    _make_book(book_folder, {"1": [[10, 20, "txt", "first page note", "n", "center"]]})
+    index = _LibraryAnnotationsIndex(str(tmp_path / "index.sqlite3"))
+    try:
+        _save_page(index, book_folder, 3, [[30, 40, "txt", "third page note", "n", "center"]])
+        index.update_books([book_folder])
+        assert index.search("first page") == [(book_folder, 1, 10, 20, "first page note")]
+        assert index.search("third page") == [(book_folder, 3, 30, 40, "third page note")]
+    finally:
+        index.close()
+
+
+def test_editing_a_page_of_an_indexed_book_keeps_it_up_to_date(tmp_path):
+    book_folder = str(tmp_path / "book")
+    _make_book(book_folder, {"1": [[10, 20, "txt", "first page note", "n", "center"]]})
+    index = _LibraryAnnotationsIndex(str(tmp_path / "index.sqlite3"))
+    try:
+        index.update_books([book_folder])
+        _save_page(index, book_folder, 1, [[10, 20, "txt", "edited note", "n", "center"]])
+        index.update_books([book_folder])
+        assert index.search("note") == [(book_folder, 1, 10, 20, "edited note")]
+    finally:
+        index.close()
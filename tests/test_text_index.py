@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_index import build_text_index, get_num_indexed_pages, open_text_index_db, search_text_index  # noqa: E402
+
+NUM_PAGES = 3
+_OCR_TSV = "level\tleft\ttop\twidth\theight\ttext\n5\t1\t2\t3\t4\thello\n"
+
+
+def _make_book(tmp_path):
+    from PIL import Image
+    book_folder = str(tmp_path / "book")
+    os.makedirs(os.path.join(book_folder, "metadata"))
+    for page_num in range(1, NUM_PAGES + 1):
+        Image.new("L", (100, 100), 255).save(os.path.join(book_folder, f"{page_num:06d}.png"))
+    with open(book_folder + ".pdf", 'wb'):  # only its path is given to the pdf text command
+        pass
+    return book_folder
+
+
+def _counting_command(tmp_path, name, output):
+    # a command that appends a line to <name>.calls each time it is run, and writes the output
+    calls_file_path = str(tmp_path / f"{name}.calls")
+    script = f"open({calls_file_path!r}, 'a').write('.\\n'); print({output!r}, end='')"
+    return [sys.executable, "-c", script], calls_file_path
+
+
+def _count_calls(calls_file_path):
+    if not os.path.isfile(calls_file_path):
+        return 0
+    with open(calls_file_path) as f:
+        return len(f.readlines())
+
+
+def test_pages_without_text_are_recorded_and_not_extracted_again(tmp_path):
+    book_folder = _make_book(tmp_path)
+    pdf_text_command, calls_file_path = _counting_command(tmp_path, "pdftotext", "")
+    for _ in range(3):  # like opening the book three times
+        build_text_index(book_folder, pdf_text_command=pdf_text_command)
+    assert _count_calls(calls_file_path) == NUM_PAGES
+    connection = open_text_index_db(os.path.join(book_folder, "metadata"))
+    try:
+        assert get_num_indexed_pages(connection) == NUM_PAGES
+    finally:
+        connection.close()
+
+
+def test_pages_without_text_are_indexed_again_when_the_commands_change(tmp_path):
+    book_folder = _make_book(tmp_path)
+    pdf_text_command, _ = _counting_command(tmp_path, "pdftotext", "")
+    assert build_text_index(book_folder, pdf_text_command=pdf_text_command) == NUM_PAGES
+    ocr_command, ocr_calls_file_path = _counting_command(tmp_path, "ocr", _OCR_TSV)
+    assert build_text_index(book_folder, pdf_text_command=pdf_text_command, ocr_command=ocr_command) == NUM_PAGES
+    assert build_text_index(book_folder, pdf_text_command=pdf_text_command, ocr_command=ocr_command) == 0
+    assert _count_calls(ocr_calls_file_path) == NUM_PAGES
+    connection = open_text_index_db(os.path.join(book_folder, "metadata"))
+    try:
+        assert [page_num for page_num, _ in search_text_index(connection, "hello")] == [1, 2, 3]
+    finally:
+        connection.close()
+
+
+def test_a_missing_command_stops_the_build_without_recording_the_pages(tmp_path):
+    book_folder = _make_book(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        build_text_index(book_folder, pdf_text_command=["no-such-pdftotext-command"])
+    connection = open_text_index_db(os.path.join(book_folder, "metadata"))
+    try:
+        assert get_num_indexed_pages(connection) == 0
+    finally:
+        connection.close()
+
+
+def test_the_pages_are_recognized_when_the_pdf_text_command_is_missing(tmp_path):
+    book_folder = _make_book(tmp_path)
+    ocr_command, _ = _counting_command(tmp_path, "ocr", _OCR_TSV)
+    assert build_text_index(book_folder, pdf_text_command=["no-such-pdftotext-command"],
+                            ocr_command=ocr_command) == NUM_PAGES
@@ -0,0 +1,294 @@
+import argparse
+import html
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import json
+
+
+# the words of the pages are taken from the text layer of the book's pdf file, with this command, run once per page,
+# each item is formatted with the keys: page_num and pdf_file_path
+# the command must write the words of the page with their bounding boxes in points to stdout, in the format of
+# poppler's pdftotext -bbox, i.e. <page width=".." height=".."> and <word xMin=".." yMin=".." xMax=".." yMax="..">
+DEFAULT_PDF_TEXT_COMMAND = ["pdftotext", "-bbox", "-f", "{page_num}", "-l", "{page_num}", "{pdf_file_path}", "-"]
+# the pages without a text layer (i.e. scanned pages) are recognized with this command, if it is given, run once per
+# page, each item is formatted with the key: page_image_path
+# the command must write the words of the page with their bounding boxes in pixels to stdout, in the format of
+# tesseract's tsv output, like this command
+EXAMPLE_OCR_COMMAND = ["tesseract", "{page_image_path}", "stdout", "tsv"]
+
+NUM_PAGES_TO_SEARCH = 200  # the pages with the most hits, in the order of page numbers, are returned
+
+_WORD_STRIP_CHARS = "\"'`.,;:!?()[]{}<>"
+_PAGE_SIZE_PATTERN = re.compile(r'<page width="([\d.]+)" height="([\d.]+)"')
+_WORD_PATTERN = re.compile(r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>',
+                           re.DOTALL)
+
+
+def get_page_image_path(book_folder, page_num):
+    # the pages are named with their six-digit-0-filled page numbers, like import_pdf.py names them
+    return os.path.join(book_folder, f'{str(page_num).rjust(6, "0")}.png')
+
+
+def get_page_nums(book_folder):
+    page_nums = []
+    for file_name in os.listdir(book_folder):
+        name, extension = os.path.splitext(file_name)
+        if extension.lower() == ".png" and len(name) == 6 and name.isdigit():
+            page_nums.append(int(name))
+    return sorted(page_nums)
+
+
+def get_text_index_file_path(book_metadata_folder):
+    return os.path.join(book_metadata_folder, "text_index.sqlite3")
+
+
+def get_pdf_file_path_for_book(book_folder):
+    # the pdf file the book was imported from, beside the book folder with the same name (see
+    # import_pdf.get_book_folder_for_pdf), or None
+    pdf_file_path = book_folder + ".pdf"
+    return pdf_file_path if os.path.isfile(pdf_file_path) else None
+
+
+def normalize_word(word):
+    # the words are indexed and searched case-insensitively, without the punctuation around them
+    return word.strip(_WORD_STRIP_CHARS).casefold()
+
+
+def open_text_index_db(book_metadata_folder):
+    connection = sqlite3.connect(get_text_index_file_path(book_metadata_folder), timeout=10)
+    connection.execute("PRAGMA journal_mode=WAL")  # so that the gui can search while the builder process writes
+    connection.execute("PRAGMA synchronous=NORMAL")
+    # words: the words of the pages with their bounding boxes in the page's png pixels
+    # pages: the pages that are indexed, with the png's mtime and size when indexed (to find the outdated pages),
+    # and, the commands the page was indexed with (see get_commands_fingerprint), to index the pages that had no text
+    # again when the commands change
+    connection.execute("CREATE TABLE IF NOT EXISTS words"
+                       " (word TEXT, page INTEGER, x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER)")
+    connection.execute("CREATE INDEX IF NOT EXISTS words_word ON words (word)")
+    connection.execute("CREATE INDEX IF NOT EXISTS words_page ON words (page)")
+    connection.execute("CREATE TABLE IF NOT EXISTS pages"
+                       " (page INTEGER PRIMARY KEY, png_mtime INTEGER, png_size INTEGER, source TEXT, commands TEXT)")
+    if "commands" not in [row[1] for row in connection.execute("PRAGMA table_info(pages)")]:  # made by an older
+        # version; the pages without text in it are indexed again, once
+        connection.execute("ALTER TABLE pages ADD COLUMN commands TEXT")
+    connection.commit()
+    return connection
+
+
+def parse_pdf_text_bbox(output):
+    # the output of the pdf text command (see DEFAULT_PDF_TEXT_COMMAND) to the page size in points and the words with
+    # their bounding boxes in points, the page size is None if the output has no page
+    match = _PAGE_SIZE_PATTERN.search(output)
+    if match is None:
+        return None, []
+    page_size = (float(match.group(1)), float(match.group(2)))
+    words = [(html.unescape(text), float(x1), float(y1), float(x2), float(y2))
+             for x1, y1, x2, y2, text in _WORD_PATTERN.findall(output, match.end())]
+    return page_size, words
+
+
+def parse_ocr_tsv(output):
+    # the output of the ocr command (see EXAMPLE_OCR_COMMAND) to the words with their bounding boxes in pixels
+    words = []
+    lines = output.splitlines()
+    if len(lines) == 0:
+        return words
+    columns = {name: i for i, name in enumerate(lines[0].split("\t"))}
+    for line in lines[1:]:
+        values = line.split("\t")
+        if len(values) != len(columns) or values[columns["level"]] != "5":  # level 5 is a word
+            continue
+        left, top = int(values[columns["left"]]), int(values[columns["top"]])
+        width, height = int(values[columns["width"]]), int(values[columns["height"]])
+        words.append((values[columns["text"]], left, top, left + width, top + height))
+    return words
+
+
+def _run_command(command):
+    completed_process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if completed_process.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed with exit code {completed_process.returncode}: "
+                           f"{completed_process.stderr.decode(errors='replace')}")
+    return completed_process.stdout.decode(errors="replace")
+
+
+def get_commands_fingerprint(pdf_file_path=None, pdf_text_command=None, ocr_command=None):
+    # what a page without text was indexed with; if it changes (e.g. an ocr command is configured, or, the pdf file
+    # is found), the page may have text now
+    return json.dumps([pdf_text_command if pdf_file_path is not None else None, ocr_command])
+
+
+def get_words_of_page(page_image_path, page_num, pdf_file_path=None, pdf_text_command=None, ocr_command=None):
+    # (the words of the page with their bounding boxes in the png's pixels, the source of the words: "pdf", "ocr",
+    # or "" if there is no text for the page)
+    # the text layer of the pdf is used if there is one for the page, otherwise, the page image is recognized
+    # raises FileNotFoundError if a needed command is not installed (the pdf text command is not needed if the page
+    # can be recognized instead)
+    if pdf_file_path is not None and pdf_text_command is not None:
+        try:
+            output = _run_command([c.format(page_num=page_num, pdf_file_path=pdf_file_path)
+                                   for c in pdf_text_command])
+        except FileNotFoundError:
+            if ocr_command is None:
+                raise
+            output = ""  # as if the page has no text layer
+        page_size, words = parse_pdf_text_bbox(output)
+        if len(words) > 0:
+            from PIL import Image  # imported here, so that importing this module (the viewer does) stays cheap
+            with Image.open(page_image_path) as image:  # only the header is read
+                scale_x, scale_y = image.size[0] / page_size[0], image.size[1] / page_size[1]
+            return [(text, round(x1 * scale_x), round(y1 * scale_y), round(x2 * scale_x), round(y2 * scale_y))
+                    for text, x1, y1, x2, y2 in words], "pdf"
+
+    if ocr_command is not None:
+        output = _run_command([c.format(page_image_path=page_image_path) for c in ocr_command])
+        return parse_ocr_tsv(output), "ocr"
+
+    return [], ""
+
+
+def build_text_index(book_folder, pdf_file_path=None, pdf_text_command=None, ocr_command=None,
+                     on_page_indexed=None):
+    # indexes the pages of the book that are not indexed yet, or, whose png files changed since, in the order of page
+    # numbers; each page is committed as it is done, so, an interrupted build is continued next time
+    # on_page_indexed(page_num, num_words) is called after each page is indexed
+    # a page whose text couldn't be got is skipped, and tried again next time; a page that has no text (no text
+    # layer and no ocr command, or, a blank page) is indexed with no words, and indexed again only when the commands
+    # change (see get_commands_fingerprint); if a command is not installed, the build stops (FileNotFoundError), so,
+    # the pages are tried again once it is installed
+    # returns the number of pages indexed
+    if pdf_file_path is None:
+        pdf_file_path = get_pdf_file_path_for_book(book_folder)
+    if pdf_text_command is None:
+        pdf_text_command = DEFAULT_PDF_TEXT_COMMAND
+
+    connection = open_text_index_db(os.path.join(book_folder, "metadata"))
+    commands_fingerprint = get_commands_fingerprint(pdf_file_path, pdf_text_command, ocr_command)
+    num_pages_indexed = 0
+    try:
+        indexed_pages = {page_num: (png_mtime, png_size, source, commands)
+                         for page_num, png_mtime, png_size, source, commands
+                         in connection.execute("SELECT page, png_mtime, png_size, source, commands FROM pages")}
+        for page_num in get_page_nums(book_folder):
+            page_image_path = get_page_image_path(book_folder, page_num)
+            try:
+                stat = os.stat(page_image_path)
+            except OSError:
+                continue  # removed since listed
+            indexed_page = indexed_pages.get(page_num)
+            if (indexed_page is not None and indexed_page[:2] == (stat.st_mtime_ns, stat.st_size)
+                    and (indexed_page[2] != "" or indexed_page[3] == commands_fingerprint)):
+                continue
+
+            try:
+                words, source = get_words_of_page(page_image_path, page_num, pdf_file_path, pdf_text_command,
+                                                  ocr_command)
+            except FileNotFoundError:  # the command is not installed, there is no point in trying the other pages
+                raise
+            except (RuntimeError, IOError, SyntaxError) as e:  # SyntaxError: PIL's error for a broken png
+                print(f"Error: Couldn't get the text of page {page_num}:", e)
+                continue
+            with connection:  # a transaction per page
+                connection.execute("DELETE FROM words WHERE page = ?", (page_num,))
+                connection.executemany("INSERT INTO words VALUES (?, ?, ?, ?, ?, ?)",
+                                       [(normalize_word(text), page_num, x1, y1, x2, y2)
+                                        for text, x1, y1, x2, y2 in words if normalize_word(text) != ""])
+                connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                                   (page_num, stat.st_mtime_ns, stat.st_size, source, commands_fingerprint))
+            num_pages_indexed += 1
+            if on_page_indexed is not None:
+                on_page_indexed(page_num, len(words))
+    finally:
+        connection.close()
+    return num_pages_indexed
+
+
+def get_num_indexed_pages(connection):
+    return connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+def search_text_index(connection, query, max_num_pages=NUM_PAGES_TO_SEARCH):
+    # list of (page num, bounding boxes of the matching words in the png's pixels) of the pages that have all the
+    # words of the query, in the order of page numbers
+    # the last word of the query matches as a prefix too, so that the hits show up while the query is being typed
+    terms = [normalize_word(word) for word in query.split()]
+    terms = [term for term in terms if term != ""]
+    if len(terms) == 0:
+        return []
+
+    page_nums = None
+    bboxes_by_page_num = dict()
+    for i, term in enumerate(terms):
+        if i == len(terms) - 1:
+            rows = connection.execute("SELECT page, x1, y1, x2, y2 FROM words WHERE word >= ? AND word < ?",
+                                      (term, term + "\uffff"))  # i.e. the words starting with the term
+        else:
+            rows = connection.execute("SELECT page, x1, y1, x2, y2 FROM words WHERE word = ?", (term,))
+        term_page_nums = set()
+        for page_num, x1, y1, x2, y2 in rows:
+            term_page_nums.add(page_num)
+            bboxes_by_page_num.setdefault(page_num, []).append((x1, y1, x2, y2))
+        page_nums = term_page_nums if page_nums is None else page_nums & term_page_nums
+        if len(page_nums) == 0:
+            return []
+
+    page_nums = sorted(sorted(page_nums, key=lambda p: len(bboxes_by_page_num[p]), reverse=True)[:max_num_pages])
+    return [(page_num, bboxes_by_page_num[page_num]) for page_num in page_nums]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=""
+        "Builds the full text search index of a book, i.e. the words of the pages with their positions, in\n"
+        "text_index.sqlite3 in the book's metadata folder. The viewer runs this in the background when a book is\n"
+        "opened. The words are taken from the text layer of the pdf file the book was imported from, and the\n"
+        "pages without text are recognized with the ocr command, if given.\n"
+        "The pages are committed one by one, so, an interrupted build continues from where it stopped.\n"
+        "\n"
+        "Command line args:\n\n"
+        "Required arguments:\n\n"
+        "book_folder: the folder of the book (the png files and the metadata folder)\n\n"
+        "Optional arguments:\n\n"
+        "pdf_file_path: \n"
+        "    The pdf file of the book. Default: the pdf file beside the book folder with its name, if it exists\n\n"
+        "pdf_text_command: \n"
+        "    The command to get the words of a page of the pdf file, as a json list of strings, formatted with\n"
+        "    {page_num} and {pdf_file_path}. It must write the words in the format of pdftotext -bbox.\n"
+        f"    Default: {json.dumps(DEFAULT_PDF_TEXT_COMMAND)}\n\n"
+        "ocr_command: \n"
+        "    The command to recognize the words of a page image, as a json list of strings, formatted with\n"
+        "    {page_image_path}. It must write the words in the format of tesseract's tsv output.\n"
+        f"    Example: {json.dumps(EXAMPLE_OCR_COMMAND)}",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("book_folder")
+    parser.add_argument("-p", "--pdf_file_path")
+    parser.add_argument("--pdf_text_command")
+    parser.add_argument("--ocr_command")
+    args = parser.parse_args()
+
+    if not os.path.isdir(os.path.join(args.book_folder, "metadata")):
+        print("Not a valid book folder (it has no metadata folder):", args.book_folder)
+        return
+
+    pdf_text_command = None if args.pdf_text_command is None else json.loads(args.pdf_text_command)
+    ocr_command = None if args.ocr_command is None else json.loads(args.ocr_command)
+
+    def print_progress(page_num, num_words):
+        print(f"\rIndexed page {page_num} ({num_words} words)", end="")
+        sys.stdout.flush()
+
+    try:
+        num_pages_indexed = build_text_index(args.book_folder, args.pdf_file_path, pdf_text_command, ocr_command,
+                                             on_page_indexed=print_progress)
+    except FileNotFoundError as e:
+        print("Error: The command is not found:", e)
+        return
+    print(f"\nIndexed {num_pages_indexed} pages")
+
+
+if __name__ == '__main__':
+    main()